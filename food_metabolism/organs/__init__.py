@@ -10,6 +10,29 @@ Modules included:
 - system.py: Integration of different organ systems.
 - parameters.py: Common parameters and constants.
 - index.py: Provides an indexing enum and helper functions for accessing arrays
+- compiled.py: Fused right hand side equivalent to system.py, writing into a caller-provided output array.
+- jacobian.py: Analytic Jacobian and sparsity pattern of system.py for stiff solvers.
+- population.py: Batched parameters and integration of virtual populations.
+- packing.py: Flat float64 packing of Parameters with named offsets.
+- prepared.py: Cached rate products and linear rate matrices per Parameters for the compiled kernel and Jacobian.
+- simulate.py: simulate() front end returning results with organ-named views.
+- schedule.py: Meal and dosing schedules (boluses, infusions, regimens) for simulate().
+- steady_state.py: Cached Newton / pseudo-transient steady-state solver.
+- profiling.py: Opt-in per-organ timing and solver counters.
+- benchmark.py: Benchmarks of rhs throughput, preset solves and population runs with baseline comparison.
+- test_regression.py: Bit-for-bit regression tests of the compiled kernel, checkpoint restarts and scenario arms on init().
+- subsystem.py: Reduced state subsystems of single organ presets with index maps to the full layout.
+- stoichiometry.py: The model as reactions, dydt = S · v with a sparse stoichiometric matrix.
+- conservation.py: Conservation laws from the stoichiometry and elimination of dependent states.
+- qssa.py: Quasi-steady-state reduction of fast states and its error estimate against the full model.
+- superposition.py: Linear PK models and FFT superposition of unit dose responses over many dosing regimens.
+- sweep.py: Grid and Latin hypercube parameter designs run on a process pool into memory-mapped, resumable outputs.
+- cache.py: Content-addressed, size-bounded on-disk cache of simulate() results.
+- trajectory.py: Streaming trajectory sink for simulate() with memory-mapped, Index-named readers.
+- export.py: Parquet / Arrow IPC export and loading of single runs, sweeps and populations (needs pyarrow).
+- checkpoint.py: Checkpoints of simulate() runs at schedule splits or a fixed interval, and bit-for-bit restart or what-if branching.
+- scenarios.py: Scenario trees simulating a shared lead-in once and fanning arms out from the branch-point state.
+- metrics.py: Streaming PK/PD metrics (AUC, Cmax/Tmax, time in range, accumulation) for runs, populations and sweeps.
 
 This package supports simulation and analysis of organ-level metabolic processes.
 """
@@ -0,0 +1,251 @@
+"""
+Benchmarks for the right hand sides, end-to-end solves and batched population runs.
+
+    python -m organs.benchmark --output benchmark.json
+    python -m organs.benchmark --output new.json --compare benchmark.json
+
+Every result is a time in seconds (per evaluation for the right hand sides), so lower is better and a
+comparison flags results that got slower than the baseline by more than the threshold.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from dataclasses import fields, replace
+from datetime import datetime, timezone
+
+import numpy as np
+import scipy
+
+from .index import Index
+from .system import system, init, giInit, muscle_init, subq_init, vsc_init
+from .fat import fat
+from .gi import GI
+from .muscle import skeletalmuscle
+from .pancreas import pancreas
+from .compiled import compile_system
+from .population import stack_parameters, solve_population
+from .simulate import simulate
+
+PRESETS = {
+    "init": init,
+    "giInit": giInit,
+    "muscle_init": muscle_init,
+    "subq_init": subq_init,
+    "vsc_init": vsc_init,
+}
+METHODS = ("LSODA", "BDF", "Radau")
+POPULATION_SIZES = (1, 10, 100, 1000, 10000)
+# the sparse LU of the (len(Index) * N)-dimensional BDF solve outgrows a few GB of memory beyond this
+POPULATION_SOLVE_MAX = 100
+
+def benchmark_state(p) -> np.ndarray:
+    """
+    A fed state: fasting plasma, charged muscle cofactors, adipose stores and a meal in the gut.
+    """
+    y = np.zeros(len(Index))
+    y[Index.plasma_glucose] = 5.5
+    y[Index.plasma_insulin] = 1.2
+    y[Index.plasma_fattyacid] = 0.4
+    y[Index.plasma_aminoacid] = 0.2
+    y[Index.plasma_fructose] = 3
+    y[Index.subq_TAG] = 10 * 1000 / p.V.subq * .9
+    y[Index.vsc_TAG] = 10 * 1000 / p.V.vsc * .1
+    y[Index.muscle_NAD] = 1.6 * (60 * .4) / 25
+    y[Index.muscle_NADH] = 0.15 * (60 * .4) / 25
+    y[Index.muscle_FAD] = 1.6 * (60 * .4) / 25 / 3
+    y[Index.muscle_FADH2] = 0.15 * (60 * .4) / 25 / 3
+    y[Index.gut_glucose] = 50
+    y[Index.gut_fructose] = 30
+    y[Index.micellar_fattyacid] = 100
+    return y
+
+def time_call(fn, repeats: int = 5, min_time: float = 0.05) -> float:
+    """
+    Best time of one call of `fn` in seconds, out of `repeats` rounds that each call it often enough to run
+    for at least `min_time`.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(np.ceil(min_time / elapsed)))
+
+    best = elapsed / number
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def rhs_benchmarks(repeats: int = 5) -> dict:
+    """
+    Seconds per evaluation of every right hand side at `benchmark_state`.
+    """
+    p = init()
+    y = benchmark_state(p)
+    rhs = compile_system(p)
+    cases = {
+        "rhs/system": lambda: system(0.0, y, p),
+        "rhs/compiled": lambda: rhs(0.0, y),
+        "rhs/skeletalmuscle": lambda: skeletalmuscle(0.0, y, p),
+        "rhs/fat": lambda: fat(0.0, y, p),
+        "rhs/GI": lambda: GI(0.0, y, p),
+        "rhs/pancreas": lambda: pancreas(0.0, y),
+    }
+    return {name: time_call(fn, repeats) for name, fn in cases.items()}
+
+def solve_benchmarks(t_end: float = 24.0, repeats: int = 3) -> tuple:
+    """
+    Seconds per end-to-end `simulate` of every preset under every method, from `benchmark_state` to `t_end`.
+    The single organ presets run on their reduced `subsystem`.
+
+    Returns:
+        results (dict): Timings keyed "solve/<preset>/<method>".
+        skipped (dict): Reason per case that could not run.
+    """
+    results, skipped = {}, {}
+    for preset, make in PRESETS.items():
+        p = make()
+        y0 = benchmark_state(p)
+        for method in METHODS:
+            name = f"solve/{preset}/{method}"
+            try:
+                solution = simulate(p, y0, (0.0, t_end), method=method)
+            except Exception as error:
+                skipped[name] = f"{type(error).__name__}: {error}"
+                continue
+            if not solution.success:
+                skipped[name] = solution.message
+                continue
+            results[name] = time_call(lambda: simulate(p, y0, (0.0, t_end), method=method), repeats, 0.0)
+    return results, skipped
+
+def population_benchmarks(sizes=POPULATION_SIZES, t_end: float = 24.0, repeats: int = 3) -> dict:
+    """
+    Seconds per batched right hand side evaluation and per `solve_population` (BDF) for N virtual subjects.
+    Subjects differ by +-10% in every parameter so that no two are identical.
+    """
+    rng = np.random.default_rng(0)
+    results = {}
+    for N in sizes:
+        subjects = [__perturbed(init(), rng) for _ in range(N)]
+        p = stack_parameters(subjects)
+        y = np.repeat(benchmark_state(subjects[0])[:, None], N, axis=1)
+        rhs = compile_system(p)
+        out = np.empty_like(y)
+        results[f"population/rhs/{N}"] = time_call(lambda: rhs(0.0, y, out), repeats)
+        if N <= POPULATION_SOLVE_MAX:
+            results[f"population/solve/{N}"] = time_call(
+                lambda: solve_population(p, y, (0.0, t_end), method="BDF"), repeats, 0.0
+            )
+    return results
+
+def __perturbed(p, rng):
+    groups = {}
+    for group in fields(p):
+        value = getattr(p, group.name)
+        if value is None or group.name == "V":
+            continue
+        groups[group.name] = replace(value, **{
+            f.name: getattr(value, f.name) * rng.uniform(0.9, 1.1) for f in fields(value)
+        })
+    return replace(p, **groups)
+
+def run(quick: bool = False) -> dict:
+    """
+    Runs every benchmark and returns the machine-readable report.
+
+    Attributes:
+        quick (bool): Fewer repeats and population sizes up to 100, for a fast smoke run.
+    """
+    repeats = 2 if quick else 5
+    results = rhs_benchmarks(repeats)
+    solves, skipped = solve_benchmarks(repeats=1 if quick else 3)
+    results.update(solves)
+    results.update(population_benchmarks(
+        sizes=tuple(N for N in POPULATION_SIZES if not quick or N <= POPULATION_SOLVE_MAX),
+        repeats=1 if quick else 3,
+    ))
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "unit": "seconds",
+        "results": results,
+        "skipped": skipped,
+    }
+
+def compare(current: dict, baseline: dict, threshold: float = 0.10) -> tuple:
+    """
+    Compares two reports from `run`.
+
+    Attributes:
+        current (dict): The new report.
+        baseline (dict): The stored report to compare against.
+        threshold (float): Relative slow down above which a result counts as a regression.
+
+    Returns:
+        table (str): One line per benchmark with both times and the relative change.
+        regressions (list[str]): Names of the benchmarks that got slower than `threshold`.
+    """
+    lines = [f"{'benchmark':<32}{'baseline':>12}{'current':>12}{'change':>9}"]
+    regressions = []
+    names = list(baseline["results"]) + [n for n in current["results"] if n not in baseline["results"]]
+    for name in names:
+        old, new = baseline["results"].get(name), current["results"].get(name)
+        if old is None or new is None:
+            lines.append(f"{name:<32}{__seconds(old):>12}{__seconds(new):>12}{'':>9}")
+            continue
+        change = new / old - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  slower"
+        lines.append(f"{name:<32}{__seconds(old):>12}{__seconds(new):>12}{change:>+9.1%}{flag}")
+    return "\n".join(lines), regressions
+
+def __seconds(value):
+    if value is None:
+        return "-"
+    return f"{value:.3e}"
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write the report to this json file")
+    parser.add_argument("--compare", help="baseline json report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slow down reported as a regression")
+    parser.add_argument("--quick", action="store_true", help="fewer repeats and population sizes")
+    args = parser.parse_args(argv)
+
+    report = run(quick=args.quick)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    for name, reason in report["skipped"].items():
+        print(f"skipped {name}: {reason}")
+    if args.compare is None:
+        for name, seconds in report["results"].items():
+            print(f"{name:<32}{seconds:>12.3e}")
+        return 0
+
+    with open(args.compare) as file:
+        baseline = json.load(file)
+    table, regressions = compare(report, baseline, args.threshold)
+    print(table)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
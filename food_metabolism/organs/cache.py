@@ -0,0 +1,186 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from .parameters import *
+from .index import Index
+from .packing import fingerprint
+from .schedule import Schedule, _state_vector
+
+# the state layout the cached trajectories were computed with; reordering, adding or renaming states
+# changes it and with it every key
+MODEL_VERSION = hashlib.sha256(",".join(state.name for state in Index).encode()).hexdigest()[:16]
+# version of the file contents, bumped when the stored arrays change
+__FORMAT = 1
+
+class ResultCache:
+    """
+    A content-addressed on-disk cache of `simulate` results, consumed by `simulate(..., cache=...)`.
+
+    Results are stored as uncompressed .npz files named by `result_key`, so a hit costs one file read and the
+    same scenario maps to the same file in every session. The cache is bounded to `max_bytes`; reading an entry
+    refreshes its modification time, and storing evicts the entries read least recently until the bound holds.
+
+    Attributes:
+        directory (str): Directory of the cache, created if needed. Several processes may share it.
+        max_bytes (int): Bound on the total size of the stored results.
+    """
+    __slots__ = ("directory", "max_bytes")
+
+    def __init__(self, directory: str, max_bytes: int = 2 ** 30):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+
+    def __len__(self) -> int:
+        return len(self.__entries())
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    @property
+    def size(self) -> int:
+        """
+        Total size of the stored results in bytes.
+        """
+        return sum(size for _, size, _ in self.__entries())
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key: str) -> dict:
+        """
+        Returns the stored fields of a result (t, y, status, message, nfev, njev, nlu), or None on a miss.
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as stored:
+                fields = {name: stored[name] for name in stored.files}
+        except (FileNotFoundError, ValueError, OSError):
+            # a missing entry, or one evicted or truncated while being read
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return {
+            "t": fields["t"],
+            "y": fields["y"],
+            "status": int(fields["status"]),
+            "message": str(fields["message"]),
+            "nfev": int(fields["nfev"]),
+            "njev": int(fields["njev"]),
+            "nlu": int(fields["nlu"]),
+        }
+
+    def put(self, key: str, result) -> None:
+        """
+        Stores a `SimulationResult` under `key` and evicts least recently read entries beyond `max_bytes`.
+        """
+        # written to a temporary file and renamed, so readers never see a partial entry
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as file:
+                np.savez(
+                    file, t=result.t, y=result.y, status=result.status, message=result.message,
+                    nfev=result.nfev, njev=result.njev, nlu=result.nlu,
+                )
+            os.replace(temporary, self.path(key))
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self.evict(keep=key)
+
+    def evict(self, keep: str = None) -> int:
+        """
+        Removes the least recently read entries until the cache fits `max_bytes`, sparing the entry `keep`.
+
+        Returns:
+            removed (int): Number of entries removed.
+        """
+        entries = sorted(self.__entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and path == self.path(keep):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self) -> None:
+        """
+        Removes every entry.
+        """
+        for path, _, _ in self.__entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __entries(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(".npz"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return entries
+
+def result_key(params: Parameters, y0: np.ndarray, t_span: tuple, schedule: Schedule = None, **settings) -> str:
+    """
+    Returns the stable hash of a simulation: the sha256 hex digest of `MODEL_VERSION`, the parameter
+    `fingerprint`, the initial state, the time span, the schedule and the solver settings (method, t_eval,
+    rtol, ...). Equal scenarios share a key across sessions and processes.
+
+    Attributes:
+        params (Parameters): The parameters to simulate.
+        y0 (np.ndarray): The initial state vector.
+        t_span (tuple): The (start, end) time of the simulation.
+        schedule (Schedule): Meals and doses given during the simulation.
+        settings: Every other argument that changes the result, by name.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{__FORMAT}:{MODEL_VERSION}:{fingerprint(params)}".encode())
+    __update(digest, np.asarray(y0, dtype=float))
+    __update(digest, tuple(float(t) for t in t_span))
+    if schedule is not None:
+        # doses keyed by names or `Index` members hash the same
+        __update(digest, tuple((b.time, _state_vector([b.amounts])) for b in schedule.boluses))
+        __update(digest, tuple((i.start, i.stop, _state_vector([i.rates])) for i in schedule.infusions))
+    for name in sorted(settings):
+        digest.update(name.encode())
+        __update(digest, settings[name])
+    return digest.hexdigest()
+
+def __update(digest, value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, np.ndarray):
+        digest.update(f"array{value.dtype.str}{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (tuple, list)):
+        digest.update(f"{type(value).__name__}{len(value)}(".encode())
+        for item in value:
+            __update(digest, item)
+        digest.update(b")")
+    elif isinstance(value, dict):
+        __update(digest, tuple((str(key), value[key]) for key in sorted(value, key=str)))
+    elif value is None or isinstance(value, (bool, int, float, str)):
+        digest.update(f"{type(value).__name__}:{value!r};".encode())
+    else:
+        raise TypeError(f"cannot hash {type(value).__name__} into a cache key")
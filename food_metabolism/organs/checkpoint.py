@@ -0,0 +1,200 @@
+import json
+import os
+import tempfile
+from dataclasses import dataclass
+
+import numpy as np
+
+from .parameters import *
+from .index import Index
+from .packing import _layout, layout, pack, unpack
+from .schedule import Schedule
+
+@dataclass(frozen=True, slots=True)
+class Checkpointing:
+    """
+    Data class with the checkpoint settings of a run, see `simulate(..., checkpoint=...)`.
+
+    Checkpoints are taken where the run is split: where the schedule splits it (a bolus, or an infusion
+    starting or stopping) and, with `every`, at every multiple of `every` from the start of the run, so an
+    unscheduled run or a long infusion is checkpointed too. The solver restarts from the state alone there,
+    so a run resumed from a checkpoint is bit-for-bit the uninterrupted run. A checkpoint is written at the
+    first split after `every` simulated time or `seconds` of wall time since the last one, replacing the
+    previous checkpoint in `path`. Every cut costs a solver restart, so `every` well below the spacing of
+    the doses slows the run down. With `seconds` alone a run the schedule does not split raises ValueError.
+
+    Attributes:
+        path (str): The checkpoint file (.npz).
+        every (float): Simulated time between checkpoints.
+        seconds (float): Wall time between checkpoints.
+    """
+    path   : str
+    every  : float = None
+    seconds: float = None
+
+@dataclass(frozen=True, slots=True)
+class Checkpoint:
+    """
+    Data class holding the state of a run at the start of a schedule segment, see `Checkpointing`.
+
+    Attributes:
+        t (float): The time, the start of a segment (before a bolus given at `t`).
+        y (np.ndarray): The full state at `t`, shape (len(Index),).
+        step (float): The last accepted step size, for reference; the solver picks its own first step after
+                      a split, with or without a checkpoint.
+        segment (int): Number of segments completed, the cuts at `Checkpointing.every` included.
+        t_span (tuple): The (start, end) time of the run.
+        method (str): The solver.
+        t_eval (np.ndarray): The stored times of the run, or None to store every step.
+        t_stored (np.ndarray): The times stored so far, shape (stored,).
+        y_stored (np.ndarray): The states stored so far, shape (len(Index), stored).
+        parameters (np.ndarray): The packed parameters, see `packing.pack`.
+        groups (tuple): The `Parameters` groups of the packed layout.
+        settings (dict): `jac`, `conserved` and `fast` as passed to `simulate`, the `every` the run is split
+                         at, and the solver options.
+        nfev (int): Right hand side evaluations so far.
+        njev (int): Jacobian evaluations so far.
+        nlu (int): LU decompositions so far.
+    """
+    t         : float
+    y         : np.ndarray
+    step      : float
+    segment   : int
+    t_span    : tuple
+    method    : str
+    t_eval    : np.ndarray
+    t_stored  : np.ndarray
+    y_stored  : np.ndarray
+    parameters: np.ndarray
+    groups    : tuple
+    settings  : dict
+    nfev      : int
+    njev      : int
+    nlu       : int
+
+    def params(self) -> Parameters:
+        """
+        Returns the parameters of the run.
+        """
+        return unpack(self.parameters, _layout(self.groups))
+
+def save_checkpoint(checkpoint: Checkpoint, path: str) -> None:
+    """
+    Writes a checkpoint to a compressed .npz file, replacing the file atomically.
+    """
+    settings = {key: value for key, value in checkpoint.settings.items() if not isinstance(value, np.ndarray)}
+    arrays = {f"setting_{key}": value for key, value in checkpoint.settings.items() if isinstance(value, np.ndarray)}
+    metadata = {
+        "t": checkpoint.t,
+        "step": checkpoint.step,
+        "segment": checkpoint.segment,
+        "t_span": list(checkpoint.t_span),
+        "method": checkpoint.method,
+        "groups": list(checkpoint.groups),
+        "settings": settings,
+        "nfev": checkpoint.nfev,
+        "njev": checkpoint.njev,
+        "nlu": checkpoint.nlu,
+        "states": [state.name for state in Index],
+    }
+    if checkpoint.t_eval is not None:
+        arrays["t_eval"] = checkpoint.t_eval
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as file:
+            np.savez_compressed(
+                file, metadata=json.dumps(metadata), y=checkpoint.y, t_stored=checkpoint.t_stored,
+                y_stored=checkpoint.y_stored, parameters=checkpoint.parameters, **arrays,
+            )
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+def load_checkpoint(path: str) -> Checkpoint:
+    """
+    Reads a checkpoint written by `save_checkpoint`.
+    """
+    with np.load(path) as stored:
+        arrays = {name: stored[name] for name in stored.files}
+    metadata = json.loads(str(arrays["metadata"]))
+    if metadata["states"] != [state.name for state in Index]:
+        raise ValueError(f"the checkpoint {path} was written with a different state layout")
+    settings = dict(metadata["settings"])
+    settings.update({name[len("setting_"):]: value for name, value in arrays.items() if name.startswith("setting_")})
+    return Checkpoint(
+        t=metadata["t"],
+        y=arrays["y"],
+        step=metadata["step"],
+        segment=metadata["segment"],
+        t_span=tuple(metadata["t_span"]),
+        method=metadata["method"],
+        t_eval=arrays.get("t_eval"),
+        t_stored=arrays["t_stored"],
+        y_stored=arrays["y_stored"],
+        parameters=arrays["parameters"],
+        groups=tuple(metadata["groups"]),
+        settings=settings,
+        nfev=metadata["nfev"],
+        njev=metadata["njev"],
+        nlu=metadata["nlu"],
+    )
+
+def restart(checkpoint, params: Parameters = None, schedule: Schedule = None, save: Checkpointing = None,
+            **options):
+    """
+    Resumes a run from a checkpoint.
+
+    With the run's own schedule and parameters the result is bit-for-bit the one the uninterrupted run would
+    have returned, including the time points stored before the checkpoint. A different schedule or parameters
+    fork a "what-if" branch from the shared prefix: doses and parameters only change the run after the
+    checkpoint's time.
+
+    Attributes:
+        checkpoint (Checkpoint | str): The checkpoint, or the file holding it.
+        params (Parameters): Parameters from the checkpoint on, by default those of the run.
+        schedule (Schedule): The schedule of the run; only its segments from the checkpoint on are used. The
+                             checkpoint does not store it, so the run's own schedule is passed again to resume.
+        save (Checkpointing): Keeps checkpointing the resumed run.
+        options: Solver options overriding those of the run.
+
+    Returns:
+        result (SimulationResult): The whole run.
+    """
+    # simulate imports this module for its checkpoints
+    from .simulate import simulate
+
+    if isinstance(checkpoint, str):
+        checkpoint = load_checkpoint(checkpoint)
+    settings = dict(checkpoint.settings)
+    jac, conserved, fast = settings.pop("jac", None), settings.pop("conserved", False), settings.pop("fast", None)
+    # the split grid of the run, `simulate` reads it from the checkpoint
+    settings.pop("every", None)
+    settings.update(options)
+    return simulate(
+        checkpoint.params() if params is None else params, checkpoint.y, checkpoint.t_span, method=checkpoint.method,
+        t_eval=checkpoint.t_eval, jac=jac, schedule=schedule, conserved=conserved, fast=fast, checkpoint=save,
+        resume=checkpoint, **settings,
+    )
+
+def _capture(params, t_span, method, t_eval, settings, segment, t, y, step, stored, counters) -> Checkpoint:
+    t_stored, y_stored = stored
+    return Checkpoint(
+        t=float(t),
+        y=np.array(y, dtype=float),
+        step=None if step is None else float(step),
+        segment=int(segment),
+        t_span=(float(t_span[0]), float(t_span[1])),
+        method=method,
+        t_eval=t_eval,
+        t_stored=np.asarray(t_stored, dtype=float),
+        y_stored=np.asarray(y_stored, dtype=float).reshape(len(Index), len(t_stored)),
+        parameters=pack(params),
+        groups=layout(params).groups,
+        settings=settings,
+        nfev=int(counters[0]),
+        njev=int(counters[1]),
+        nlu=int(counters[2]),
+    )
@@ -0,0 +1,445 @@
+import numpy as np
+from .parameters import *
+from .index import Index
+from .pancreas import pancreatic_secretion_response_to_Gblood, pancreatic_secretion_response_to_Gblood_array
+from .system import system
+from .prepared import prepare
+
+def compile_system(p: Parameters):
+    """
+    Builds a fused right hand side for the whole-body model.
+
+    Every organ contribution from `fat`, `GI`, `skeletalmuscle` and `pancreas` is written out in a single
+    flat function. Parameters (and the derived products cached by `prepare`) are read once here and captured
+    as locals, so each evaluation does no attribute walking, no `IntEnum` indexing and no per-organ function
+    calls. It is not allocation-free: a single state is unpacked with `y.tolist()` (Python floats are faster
+    than NumPy scalars for this arithmetic), the derivatives are built as a tuple and copied into `out`, and a
+    batch allocates one temporary row per intermediate term. The arithmetic mirrors the
+    organ modules term by term (including the order in which organs accumulate into shared plasma states)
+    so the result is bit-for-bit identical to `system`, see `is_equivalent`.
+
+    The same kernel evaluates a batch of states: `y` may have shape (len(Index), N), one column per
+    subject, in which case every state and derivative is a row of N values. Combined with parameters
+    from `population.stack_parameters` this advances N virtual subjects in one set of NumPy operations,
+    and with a single `Parameters` it is the vectorized form `solve_ivp(..., vectorized=True)` expects.
+
+    Attributes:
+        p (Parameters): A parameters object with muscle, subq, vsc and GI parameters set (e.g. `init()`).
+
+    Returns:
+        rhs (Callable): `rhs(t, y, out=None)` which writes dydt into `out` (allocated when not given)
+                        and returns it. Pass a preallocated `out` to reuse the output array across calls.
+    """
+    if p.M is None or p.Subq is None or p.Vsc is None or p.GI is None:
+        raise ValueError("compile_system needs muscle, subq, vsc and GI parameters (see init())")
+    if p.Liver is not None:
+        raise NotImplementedError("the liver model is not part of the compiled kernel yet")
+
+    n_wired = Index.liver_glucose
+    prepared = prepare(p)
+
+    V_plasma = p.V.plasma
+    V_gut    = p.V.gut
+    V_subq   = p.V.subq
+    V_vsc    = p.V.vsc
+    V_muscle = p.V.muscle
+
+    M_k_insulin_from_plasma = p.M.k_insulin_from_plasma
+    M_k_insulin_to_plasma   = p.M.k_insulin_to_plasma
+    M_k_FA_from_plasma      = p.M.k_FA_from_plasma
+    M_k_FA_to_plasma        = p.M.k_FA_to_plasma
+    M_k_G_from_plasma       = p.M.k_G_from_plasma
+    M_k_G_to_plasma         = p.M.k_G_to_plasma
+    M_k_AA_from_plasma      = p.M.k_AA_from_plasma
+    M_k_AA_to_plasma        = p.M.k_AA_to_plasma
+    M_k_L_from_plasma       = p.M.k_L_from_plasma
+    M_k_L_to_plasma         = p.M.k_L_to_plasma
+    M_NADH_ETC              = p.M.NADH_ETC
+    M_FADH2_ETC             = p.M.FADH2_ETC
+    M_k_Glc_to_G6P          = p.M.k_Glc_to_G6P
+    M_k_G6P_to_Glc          = p.M.k_G6P_to_Glc
+    M_k_P_to_L              = p.M.k_P_to_L
+    M_k_L_to_P              = p.M.k_L_to_P
+    M_kCL_insulin           = p.M.kCL_insulin
+    M_kCL_ATP               = p.M.kCL_ATP
+    M_k_ACoA_to_TCA         = p.M.k_ACoA_to_TCA
+    M_k_P_to_ACoA           = p.M.k_P_to_ACoA
+    M_k_ACoA_to_P           = p.M.k_ACoA_to_P
+    M_k_FA_to_ACoA          = p.M.k_FA_to_ACoA
+    M_k_AA_to_ACoA          = p.M.k_AA_to_ACoA
+    M_k_G_to_G6P            = p.M.k_G_to_G6P
+    M_k_G6P_to_G            = p.M.k_G6P_to_G
+    M_k_P_to_G6P            = p.M.k_P_to_G6P
+    M_k_G6P_to_P            = p.M.k_G6P_to_P
+
+    subq_esterification_rate = prepared.subq_esterification_rate
+    vsc_esterification_rate  = prepared.vsc_esterification_rate
+    glycogen_synthesis_rate  = prepared.glycogen_synthesis_rate
+
+    Subq_k_insulin_from_plasma = p.Subq.k_insulin_from_plasma
+    Subq_k_insulin_to_plasma   = p.Subq.k_insulin_to_plasma
+    Subq_k_FA_from_plasma      = p.Subq.k_FA_from_plasma
+    Subq_k_FA_to_plasma        = p.Subq.k_FA_to_plasma
+    Subq_k_G_from_plasma       = p.Subq.k_G_from_plasma
+    Subq_k_G_to_plasma         = p.Subq.k_G_to_plasma
+    Subq_k_AA_from_plasma      = p.Subq.k_AA_from_plasma
+    Subq_k_AA_to_plasma        = p.Subq.k_AA_to_plasma
+    Subq_k_TAG_to_FA           = p.Subq.k_TAG_to_FA
+    Subq_kCL_insulin           = p.Subq.kCL_insulin
+    Subq_k_P_to_ACoA           = p.Subq.k_P_to_ACoA
+    Subq_k_FA_to_ACoA          = p.Subq.k_FA_to_ACoA
+    Subq_k_ACoA_to_FA          = p.Subq.k_ACoA_to_FA
+    Subq_k_AA_to_ACoA          = p.Subq.k_AA_to_ACoA
+    Subq_k_G_to_G6P            = p.Subq.k_G_to_G6P
+    Subq_k_G6P_to_G            = p.Subq.k_G6P_to_G
+    Subq_k_P_to_G6P            = p.Subq.k_P_to_G6P
+    Subq_k_G6P_to_P            = p.Subq.k_G6P_to_P
+
+    Vsc_k_insulin_from_plasma = p.Vsc.k_insulin_from_plasma
+    Vsc_k_insulin_to_plasma   = p.Vsc.k_insulin_to_plasma
+    Vsc_k_FA_from_plasma      = p.Vsc.k_FA_from_plasma
+    Vsc_k_FA_to_plasma        = p.Vsc.k_FA_to_plasma
+    Vsc_k_G_from_plasma       = p.Vsc.k_G_from_plasma
+    Vsc_k_G_to_plasma         = p.Vsc.k_G_to_plasma
+    Vsc_k_AA_from_plasma      = p.Vsc.k_AA_from_plasma
+    Vsc_k_AA_to_plasma        = p.Vsc.k_AA_to_plasma
+    Vsc_k_TAG_to_FA           = p.Vsc.k_TAG_to_FA
+    Vsc_kCL_insulin           = p.Vsc.kCL_insulin
+    Vsc_k_G_to_G6P            = p.Vsc.k_G_to_G6P
+    Vsc_k_G6P_to_G            = p.Vsc.k_G6P_to_G
+
+    GI_kabs_glucose                    = p.GI.kabs_glucose
+    GI_kabs_fructose                   = p.GI.kabs_fructose
+    GI_k_diffusion_micelle_to_membrane = p.GI.k_diffusion_micelle_to_membrane
+    GI_k_Vmax_trans                    = p.GI.k_Vmax_trans
+    GI_k_Vmax_reester                  = p.GI.k_Vmax_reester
+    GI_k_Vmax_export                   = p.GI.k_Vmax_export
+    GI_Km_trans                        = p.GI.Km_trans
+    GI_Km_reester                      = p.GI.Km_reester
+    GI_Km_export                       = p.GI.Km_export
+    GI_kCL_glucose                     = p.GI.kCL_glucose
+    GI_kCL_fructose                    = p.GI.kCL_fructose
+    GI_kCL_fattyacid                   = p.GI.kCL_fattyacid
+
+    # same constants as the organ modules
+    Km = 1
+    fat_ROSpercent = 0.01
+    muscle_ROSpercent = 0.02
+
+    def rhs(t: float, y: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        if out is None:
+            out = np.empty(y.shape)
+        batched = y.ndim == 2
+
+        (
+            plasma_glucose, plasma_fructose, plasma_fattyacid, plasma_aminoacid,
+            plasma_lactate, plasma_insulin, plasma_glucagon, plasma_somatostatin,
+
+            subq_glucose, subq_fattyacid, subq_aminoacid, subq_insulin, subq_G6P,
+            subq_TAG, subq_pyruvate, subq_ACoA, subq_ROS,
+
+            vsc_glucose, vsc_insulin, vsc_fattyacid, vsc_aminoacid, vsc_G6P,
+            vsc_TAG, vsc_pyruvate, vsc_ACoA, vsc_ROS,
+
+            muscle_glucose, muscle_insulin, muscle_fattyacid, muscle_aminoacid,
+            muscle_G6P, muscle_glycogen, muscle_pyruvate, muscle_ACoA, muscle_NAD,
+            muscle_NADH, muscle_FAD, muscle_FADH2, muscle_ROS, muscle_ATP, muscle_lactate,
+
+            gut_glucose, gut_fructose, micellar_fattyacid, membrane_fattyacid,
+            cytosol_fattyacid, cytosol_TAG,
+            *_,
+        ) = y if batched else y.tolist()
+
+        # fat
+        subq_esterification = (subq_esterification_rate * subq_fattyacid / (Km + subq_fattyacid * V_subq))**3
+        vsc_esterification = (vsc_esterification_rate * vsc_fattyacid / (Km + vsc_fattyacid * V_vsc))**3
+        subq_pyruvate2 = subq_pyruvate**2
+        vsc_pyruvate2 = vsc_pyruvate**2
+
+        # GI
+        glucose_absorbed = GI_kabs_glucose * gut_glucose * V_gut
+        fructose_absorbed = GI_kabs_fructose * gut_fructose * V_gut
+        J_diff = GI_k_diffusion_micelle_to_membrane * (micellar_fattyacid - membrane_fattyacid)
+        J_trans = (GI_k_Vmax_trans * membrane_fattyacid) / (GI_Km_trans + membrane_fattyacid + 1e-6)
+        J_reester = (GI_k_Vmax_reester * cytosol_fattyacid) / (GI_Km_reester + cytosol_fattyacid + 1e-6)
+        J_export = (GI_k_Vmax_export * cytosol_TAG) / (GI_Km_export + cytosol_TAG + 1e-6)
+        J_clear = GI_kCL_fattyacid * plasma_fattyacid
+
+        # muscle
+        NAD2 = muscle_NAD**2
+        NAD3 = muscle_NAD**3
+        NADH2 = muscle_NADH**2
+        FADH22 = muscle_FADH2**2
+        pyruvate2 = muscle_pyruvate**2
+        ATP3 = muscle_ATP**3
+        glycogen_synthesis = glycogen_synthesis_rate * muscle_G6P / (Km + muscle_G6P * V_muscle)
+
+        # pancreas
+        if batched:
+            dinsulin, dglucagon, dsomat = pancreatic_secretion_response_to_Gblood_array(plasma_glucose)
+        else:
+            dinsulin, dglucagon, dsomat = pancreatic_secretion_response_to_Gblood(plasma_glucose)
+
+        out[:n_wired] = (
+            # plasma_glucose
+            (-Subq_k_G_from_plasma * plasma_glucose * V_plasma + Subq_k_G_to_plasma * subq_glucose * V_subq) / V_plasma
+            + (-Vsc_k_G_from_plasma * plasma_glucose * V_plasma + Vsc_k_G_to_plasma * vsc_glucose * V_vsc) / V_plasma
+            + ((glucose_absorbed) - (GI_kCL_glucose * plasma_glucose * V_plasma)) / V_plasma
+            + (-M_k_G_from_plasma * plasma_glucose * V_plasma + M_k_G_to_plasma * muscle_glucose * V_muscle) / V_plasma,
+            # plasma_fructose
+            ((fructose_absorbed) - (GI_kCL_fructose * plasma_fructose * V_plasma)) / V_plasma,
+            # plasma_fattyacid
+            (
+                - Subq_k_FA_from_plasma * plasma_fattyacid * V_plasma
+                + Subq_k_FA_to_plasma * subq_fattyacid * V_subq
+            ) / V_plasma
+            + (
+                - Vsc_k_FA_from_plasma * plasma_fattyacid * V_plasma
+                + Vsc_k_FA_to_plasma * vsc_fattyacid * V_vsc
+            ) / V_plasma
+            + (J_export - J_clear)
+            + (
+                -M_k_FA_from_plasma * plasma_fattyacid * V_plasma
+                + M_k_FA_to_plasma * muscle_fattyacid * V_muscle
+            ) / V_plasma,
+            # plasma_aminoacid
+            (
+                - Subq_k_AA_from_plasma * plasma_aminoacid * V_plasma
+                + Subq_k_AA_to_plasma * subq_aminoacid * V_subq
+            ) / V_plasma
+            + (
+                - Vsc_k_AA_from_plasma * plasma_aminoacid * V_plasma
+                + Vsc_k_AA_to_plasma * vsc_aminoacid * V_vsc
+            ) / V_plasma
+            + (-M_k_AA_from_plasma * plasma_aminoacid * V_plasma + M_k_AA_to_plasma * muscle_aminoacid * V_muscle) / V_plasma,
+            # plasma_lactate
+            (-M_k_L_from_plasma * plasma_lactate * V_plasma + M_k_L_to_plasma * muscle_lactate * V_muscle) / V_plasma,
+            # plasma_insulin
+            (
+                - Subq_k_insulin_from_plasma * plasma_insulin * V_plasma
+                + Subq_k_insulin_to_plasma * subq_insulin * V_subq
+            ) / V_plasma
+            + (
+                - Vsc_k_insulin_from_plasma * plasma_insulin * V_plasma
+                + Vsc_k_insulin_to_plasma * vsc_insulin * V_vsc
+            ) / V_plasma
+            + (-M_k_insulin_from_plasma * plasma_insulin * V_plasma + M_k_insulin_to_plasma * muscle_insulin * V_muscle) / V_plasma
+            + dinsulin,
+            # plasma_glucagon
+            dglucagon,
+            # plasma_somatostatin
+            dsomat,
+
+            # subq_glucose
+            (Subq_k_G_from_plasma * plasma_glucose * V_plasma - Subq_k_G_to_plasma * subq_glucose * V_subq) / V_subq
+            - Subq_k_G_to_G6P * subq_glucose + Subq_k_G6P_to_G * subq_G6P,
+            # subq_fattyacid
+            (Subq_k_FA_from_plasma * plasma_fattyacid * V_plasma - Subq_k_FA_to_plasma * subq_fattyacid * V_subq) / V_subq
+            - Subq_k_FA_to_ACoA * subq_fattyacid
+            - 3 * subq_esterification
+            + 3 * Subq_k_TAG_to_FA * subq_TAG
+            + Subq_k_ACoA_to_FA * subq_ACoA,
+            # subq_aminoacid
+            (
+                + Subq_k_AA_from_plasma * plasma_aminoacid * V_plasma
+                - Subq_k_AA_to_plasma * subq_aminoacid * V_subq
+            ) / V_subq
+            - Subq_k_AA_to_ACoA * subq_aminoacid,
+            # subq_insulin
+            (Subq_k_insulin_from_plasma * plasma_insulin * V_plasma - Subq_k_insulin_to_plasma * subq_insulin * V_subq) / V_subq
+            - Subq_kCL_insulin * subq_insulin,
+            # subq_G6P
+            Subq_k_G_to_G6P * subq_glucose
+            - Subq_k_G6P_to_G * subq_G6P
+            - Subq_k_G6P_to_P * subq_G6P
+            + Subq_k_P_to_G6P * subq_pyruvate2,
+            # subq_TAG
+            subq_esterification
+            - Subq_k_TAG_to_FA * subq_TAG,
+            # subq_pyruvate
+            2 * Subq_k_G6P_to_P * subq_G6P
+            - 2 * Subq_k_P_to_G6P * subq_pyruvate2
+            - Subq_k_P_to_ACoA * subq_pyruvate,
+            # subq_ACoA
+            Subq_k_P_to_ACoA * subq_pyruvate
+            + 8 * Subq_k_FA_to_ACoA * subq_fattyacid
+            + Subq_k_AA_to_ACoA * subq_aminoacid
+            - 8 * Subq_k_ACoA_to_FA * subq_ACoA,
+            # subq_ROS
+            fat_ROSpercent * (
+                Subq_k_FA_to_ACoA * subq_fattyacid
+                + Subq_k_AA_to_ACoA * subq_aminoacid
+                + 3 * subq_esterification
+                + 3 * Subq_k_TAG_to_FA * subq_TAG
+                + 8 * Subq_k_ACoA_to_FA * subq_ACoA
+            ),
+
+            # vsc_glucose
+            (Vsc_k_G_from_plasma * plasma_glucose * V_plasma - Vsc_k_G_to_plasma * vsc_glucose * V_vsc) / V_vsc
+            - Vsc_k_G_to_G6P * vsc_glucose + Vsc_k_G6P_to_G * vsc_G6P,
+            # vsc_insulin
+            (Vsc_k_insulin_from_plasma * plasma_insulin * V_plasma - Vsc_k_insulin_to_plasma * vsc_insulin * V_vsc) / V_vsc
+            - Vsc_kCL_insulin * vsc_insulin,
+            # vsc_fattyacid
+            (Vsc_k_FA_from_plasma * plasma_fattyacid * V_plasma - Vsc_k_FA_to_plasma * vsc_fattyacid * V_vsc) / V_vsc
+            - Subq_k_FA_to_ACoA * vsc_fattyacid
+            - 3 * vsc_esterification
+            + 3 * Vsc_k_TAG_to_FA * vsc_TAG
+            + Subq_k_ACoA_to_FA * vsc_ACoA,
+            # vsc_aminoacid
+            (
+                + Vsc_k_AA_from_plasma * plasma_aminoacid * V_plasma
+                - Vsc_k_AA_to_plasma * vsc_aminoacid * V_vsc
+            ) / V_vsc
+            - Subq_k_AA_to_ACoA * vsc_aminoacid,
+            # vsc_G6P
+            Subq_k_G_to_G6P * vsc_glucose
+            - Subq_k_G6P_to_G * vsc_G6P
+            - Subq_k_G6P_to_P * vsc_G6P
+            + Subq_k_P_to_G6P * vsc_pyruvate2,
+            # vsc_TAG
+            vsc_esterification
+            - Vsc_k_TAG_to_FA * vsc_TAG,
+            # vsc_pyruvate
+            2 * Subq_k_G6P_to_P * vsc_G6P
+            - 2 * Subq_k_P_to_G6P * vsc_pyruvate2
+            - Subq_k_P_to_ACoA * vsc_pyruvate,
+            # vsc_ACoA
+            Subq_k_P_to_ACoA * vsc_pyruvate
+            + 8 * Subq_k_FA_to_ACoA * vsc_fattyacid
+            + Subq_k_AA_to_ACoA * vsc_aminoacid
+            - 8 * Subq_k_ACoA_to_FA * vsc_ACoA,
+            # vsc_ROS
+            fat_ROSpercent * (
+                Subq_k_FA_to_ACoA * vsc_fattyacid
+                + Subq_k_AA_to_ACoA * vsc_aminoacid
+                + 3 * vsc_esterification
+                + 3 * Vsc_k_TAG_to_FA * vsc_TAG
+                + 8 * Subq_k_ACoA_to_FA * vsc_ACoA
+            ),
+
+            # muscle_glucose
+            (M_k_G_from_plasma * plasma_glucose * V_plasma - M_k_G_to_plasma * muscle_glucose * V_muscle) / V_muscle
+            - M_k_Glc_to_G6P * muscle_glucose + M_k_G6P_to_Glc * muscle_G6P,
+            # muscle_insulin
+            (M_k_insulin_from_plasma * plasma_insulin * V_plasma - M_k_insulin_to_plasma * muscle_insulin * V_muscle) / V_muscle
+            - M_kCL_insulin * muscle_insulin,
+            # muscle_fattyacid
+            (
+                + M_k_FA_from_plasma * plasma_fattyacid * V_plasma
+                - M_k_FA_to_plasma * muscle_fattyacid * V_muscle
+            ) / V_muscle
+            - M_k_FA_to_ACoA * muscle_fattyacid * muscle_ATP,
+            # muscle_aminoacid
+            (M_k_AA_from_plasma * plasma_aminoacid * V_plasma - M_k_AA_to_plasma * muscle_aminoacid * V_muscle) / V_muscle
+            - M_k_AA_to_ACoA * muscle_aminoacid,
+            # muscle_G6P
+            M_k_Glc_to_G6P * muscle_glucose
+            - M_k_G6P_to_Glc * muscle_G6P
+            - glycogen_synthesis
+            + M_k_P_to_G6P * muscle_glycogen
+            - M_k_G6P_to_P * muscle_G6P * NAD2
+            + M_k_P_to_G6P * pyruvate2 * ATP3 * NADH2,
+            # muscle_glycogen
+            glycogen_synthesis
+            - M_k_P_to_G6P * muscle_glycogen,
+            # muscle_pyruvate
+            2 * M_k_G6P_to_P * muscle_G6P * NAD2
+            - 2 * M_k_P_to_G6P * pyruvate2 * ATP3 * NADH2
+            - M_k_P_to_ACoA * muscle_pyruvate * muscle_NAD
+            - M_k_P_to_L * muscle_pyruvate * muscle_NADH
+            + M_k_L_to_P * muscle_lactate * muscle_NAD,
+            # muscle_ACoA
+            M_k_P_to_ACoA * muscle_pyruvate * muscle_NAD
+            + 8 * M_k_FA_to_ACoA * muscle_fattyacid * muscle_ATP
+            + M_k_AA_to_ACoA * muscle_aminoacid
+            - M_k_ACoA_to_P * muscle_ACoA * NAD3 * muscle_FAD
+            - M_k_ACoA_to_TCA * muscle_ACoA * NAD3 * muscle_FAD,
+            # muscle_NAD
+            - 2 * M_k_G6P_to_P * muscle_G6P * NAD2
+            + 2 * M_k_P_to_G6P * pyruvate2 * ATP3 * NADH2
+            - M_k_P_to_ACoA * muscle_pyruvate * muscle_NAD
+            - 3 * M_k_ACoA_to_P * muscle_ACoA * NAD3 * muscle_FAD
+            + 2 * M_NADH_ETC * NADH2
+            + M_k_P_to_L * muscle_pyruvate * muscle_NADH
+            - M_k_L_to_P * muscle_lactate * muscle_NAD
+            - 3 * M_k_ACoA_to_TCA * muscle_ACoA * NAD3 * muscle_FAD,
+            # muscle_NADH
+            2 * M_k_G6P_to_P * muscle_G6P * NAD2
+            - 2 * M_k_P_to_G6P * pyruvate2 * ATP3 * NADH2
+            + M_k_P_to_ACoA * muscle_pyruvate * muscle_NAD
+            + 3 * M_k_ACoA_to_P * muscle_ACoA * NAD3 * muscle_FAD
+            - 2 * M_NADH_ETC * NADH2
+            - M_k_P_to_L * muscle_pyruvate * muscle_NADH
+            + M_k_L_to_P * muscle_lactate * muscle_NAD
+            + 3 * M_k_ACoA_to_TCA * muscle_ACoA * NAD3 * muscle_FAD,
+            # muscle_FAD
+            -M_k_ACoA_to_P * muscle_ACoA * NAD3 * muscle_FAD
+            + 2 * M_FADH2_ETC * FADH22
+            - M_k_ACoA_to_TCA * muscle_ACoA * NAD3 * muscle_FAD,
+            # muscle_FADH2
+            M_k_ACoA_to_P * muscle_ACoA * NAD3 * muscle_FAD
+            - 2 * M_FADH2_ETC * FADH22
+            + M_k_ACoA_to_TCA * muscle_ACoA * NAD3 * muscle_FAD,
+            # muscle_ROS
+            muscle_ROSpercent * (
+                M_k_ACoA_to_P * muscle_ACoA * NAD3 * muscle_FAD
+                + M_FADH2_ETC * FADH22
+                + M_NADH_ETC * NADH2
+                + M_k_FA_to_ACoA * muscle_fattyacid * muscle_ATP
+                + M_k_AA_to_ACoA * muscle_aminoacid
+            ),
+            # muscle_ATP
+            - M_k_G_to_G6P * plasma_insulin * muscle_ATP
+            + M_k_G6P_to_G * muscle_G6P
+            + 3 * M_k_G6P_to_P * muscle_G6P * NAD2
+            - 3 * M_k_P_to_G6P * pyruvate2 * ATP3 * NADH2
+            + M_k_ACoA_to_P * muscle_ACoA * NAD3 * muscle_FAD
+            + 3 * M_FADH2_ETC * FADH22
+            + 5 * M_NADH_ETC * NADH2
+            - M_k_FA_to_ACoA * muscle_fattyacid * muscle_ATP
+            - M_kCL_ATP * muscle_ATP,
+            # muscle_lactate
+            (M_k_L_from_plasma * plasma_lactate * V_plasma - M_k_L_to_plasma * muscle_lactate * V_muscle) / V_muscle
+            + M_k_P_to_L * muscle_pyruvate * muscle_NADH - M_k_L_to_P * muscle_lactate * muscle_NAD,
+
+            # gut_glucose
+            -(glucose_absorbed) / V_gut,
+            # gut_fructose
+            -(fructose_absorbed) / V_gut,
+            # micellar_fattyacid
+            -J_diff,
+            # membrane_fattyacid
+            J_diff - J_trans,
+            # cytosol_fattyacid
+            J_trans - J_reester,
+            # cytosol_TAG
+            J_reester - J_export,
+        )
+        out[n_wired:] = 0.0
+        # system() accumulates into np.zeros, which turns any -0.0 into +0.0
+        out += 0.0
+        return out
+
+    return rhs
+
+def is_equivalent(p: Parameters, y: np.ndarray, t: float = 0.0) -> bool:
+    """
+    Checks that the compiled kernel reproduces `system` bit-for-bit.
+
+    Attributes:
+        p (Parameters): A parameters object accepted by `compile_system`.
+        y (np.ndarray): A single state vector of length `len(Index)`, or a 2-D array with one
+                        state vector per row to check several states at once.
+        t (float): The time point passed to both right hand sides.
+
+    Returns:
+        equal (bool): True when every derivative has exactly the same bits in both implementations.
+    """
+    rhs = compile_system(p)
+    out = np.empty(len(Index))
+    for state in np.atleast_2d(y):
+        expected = system(t, state, p)
+        if expected.tobytes() != rhs(t, state, out).tobytes():
+            return False
+    return True
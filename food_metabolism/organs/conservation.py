@@ -0,0 +1,256 @@
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.linalg import null_space
+
+from .parameters import *
+from .index import Index
+from .stoichiometry import reaction_network
+from .subsystem import subsystem
+
+# moieties the model is meant to conserve, checked against the stoichiometry by `violated_laws`
+EXPECTED_LAWS = {
+    "muscle NAD + NADH": {Index.muscle_NAD: 1.0, Index.muscle_NADH: 1.0},
+    "muscle FAD + FADH2": {Index.muscle_FAD: 1.0, Index.muscle_FADH2: 1.0},
+    "liver NAD + NADH": {Index.liver_NAD: 1.0, Index.liver_NADH: 1.0},
+}
+
+@dataclass(frozen=True, slots=True)
+class ConservationLaw:
+    """
+    Data class for a linear conservation law sum(weights * y[states]) = constant, see `conservation_laws`.
+
+    Attributes:
+        states (tuple[Index, ...]): The states in the law, in `Index` order.
+        weights (tuple[float, ...]): Their weights.
+        dependent (Index): The state eliminated by the law, its weight is one and it appears in no other law.
+    """
+    states   : tuple
+    weights  : tuple
+    dependent: Index
+
+    def __str__(self) -> str:
+        terms = " + ".join(
+            state.name if weight == 1 else f"{weight:g} * {state.name}"
+            for state, weight in zip(self.states, self.weights)
+        )
+        return f"{terms} = const"
+
+    def total(self, y: np.ndarray):
+        """
+        Returns the conserved total of full state vector(s) `y`, shape (len(Index), ...).
+        """
+        y = np.asarray(y)
+        return sum(weight * y[state] for state, weight in zip(self.states, self.weights))
+
+@dataclass(frozen=True, slots=True)
+class ConservedReduction:
+    """
+    Data class eliminating the dependent state of each conservation law from a state vector, see
+    `conserved_reduction`.
+
+    The vector it reduces is the one a solver would integrate otherwise (`base` positions of the full
+    state). Its independent entries are integrated; each dependent entry is rebuilt from its law's total,
+    and entries nothing changes are held at their value.
+
+    Attributes:
+        laws (tuple[ConservationLaw, ...]): The laws over the base states.
+        base (np.ndarray): Positions of the base vector in the full state vector.
+        matrix (np.ndarray): The laws as rows over the base vector, shape (len(laws), len(base)).
+        independent (np.ndarray): Positions (into the base vector) of the integrated entries.
+        dependent (np.ndarray): Positions of the eliminated entries, one per law.
+        constant (np.ndarray): Positions of the entries nothing changes.
+        embedding (np.ndarray): d(base vector) / d(independent entries), shape (len(base), len(independent)).
+        coupling (np.ndarray): The weights of the independent entries in each law, shape
+                               (len(laws), len(independent)).
+    """
+    laws       : tuple
+    base       : np.ndarray
+    matrix     : np.ndarray
+    independent: np.ndarray
+    dependent  : np.ndarray
+    constant   : np.ndarray
+    embedding  : np.ndarray
+    coupling   : np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.independent)
+
+    def totals(self, z: np.ndarray) -> np.ndarray:
+        """
+        Returns the totals of every law for the base vector `z`.
+        """
+        return self.matrix @ z
+
+    def reduce(self, z: np.ndarray) -> np.ndarray:
+        """
+        Returns the independent entries of the base vector(s) `z`.
+        """
+        return np.asarray(z)[self.independent]
+
+    def expand(self, x: np.ndarray, totals: np.ndarray, z: np.ndarray) -> np.ndarray:
+        """
+        Rebuilds base vector(s) from independent entries `x` (shape (len(independent), ...)) and the law
+        `totals` (shape (len(laws), ...)). Constant entries are taken from the base vector `z`.
+        """
+        x = np.asarray(x)
+        if x.ndim == 1:
+            full = np.array(z, dtype=float)
+        else:
+            full = _broadcast(z, x.ndim, (len(self.base),) + x.shape[1:])
+            totals = _broadcast(totals, x.ndim, (len(self.laws),) + x.shape[1:])
+        full[self.independent] = x
+        # the dependent entries have unit weight in their own law and do not appear in the others, and
+        # held entries appear in none
+        full[self.dependent] = totals - self.coupling @ x
+        return full
+
+def conservation_laws(p: Parameters, organs: tuple = None, tol: float = 1e-9) -> tuple:
+    """
+    Finds the linear conservation laws of the model: weights w over `Index` with w · dydt = 0 for every
+    state, read off the left null space of the stoichiometric matrix of `reaction_network`.
+
+    The basis is in reduced row echelon form, so each law has its own dependent state with weight one,
+    e.g. muscle_NAD + muscle_NADH = const. States the organs never change are not reported as laws.
+
+    Attributes:
+        p (Parameters): The parameters of the organs.
+        organs (tuple): Organs of the model, by default the active organs of the preset (see `subsystem`).
+        tol (float): Weights below this are treated as zero.
+
+    Returns:
+        laws (tuple[ConservationLaw, ...]): The laws, ordered by dependent state.
+    """
+    reduced = subsystem(p, organs)
+    return __laws(reduced, reduced.indices, tol)
+
+def conserved_reduction(p: Parameters, base: np.ndarray = None, organs: tuple = None,
+                        tol: float = 1e-9) -> ConservedReduction:
+    """
+    Builds the elimination of the conserved moieties of the model from the vector a solver integrates.
+
+    Attributes:
+        p (Parameters): The parameters of the organs.
+        base (np.ndarray): Positions of the integrated vector in the full state vector, by default all of
+                           `Index` (the full model), or `subsystem(p).indices` for a single organ preset.
+        organs (tuple): Organs of the model, by default the active organs of the preset.
+        tol (float): Weights below this are treated as zero.
+
+    Returns:
+        reduction (ConservedReduction): The laws and the independent, dependent and constant positions.
+    """
+    reduced = subsystem(p, organs)
+    base = np.arange(len(Index)) if base is None else np.asarray(base, dtype=np.intp)
+    laws = __laws(reduced, base, tol)
+
+    changed = np.isin(base, reduced.indices)
+    changed &= np.asarray(reaction_network(reduced.parameters, reduced.organs).S[base].getnnz(axis=1)) > 0
+    position = {int(state): k for k, state in enumerate(base)}
+    matrix = np.zeros((len(laws), len(base)))
+    for row, law in enumerate(laws):
+        for state, weight in zip(law.states, law.weights):
+            matrix[row, position[int(state)]] = weight
+    dependent = np.array([position[int(law.dependent)] for law in laws], dtype=np.intp)
+    constant = np.flatnonzero(~changed)
+    independent = np.setdiff1d(np.flatnonzero(changed), dependent)
+
+    embedding = np.zeros((len(base), len(independent)))
+    embedding[independent, np.arange(len(independent))] = 1.0
+    embedding[dependent] = -matrix[:, independent]
+    return ConservedReduction(
+        laws=laws,
+        base=base,
+        matrix=matrix,
+        independent=independent,
+        dependent=dependent,
+        constant=constant,
+        embedding=embedding,
+        coupling=matrix[:, independent],
+    )
+
+def violated_laws(p: Parameters, organs: tuple = None) -> dict:
+    """
+    Checks the moieties in `EXPECTED_LAWS` against the stoichiometry of the model.
+
+    Returns:
+        violations (dict): Law name mapped to a tuple of (reaction name, imbalance) pairs, the reactions
+                           whose stoichiometry changes the total (empty when the law holds), or to None when
+                           the law's states are not part of the model.
+    """
+    reduced = subsystem(p, organs)
+    network = reaction_network(reduced.parameters, reduced.organs)
+    touched = set(int(i) for i in reduced.indices)
+    violations = {}
+    for name, law in EXPECTED_LAWS.items():
+        if not all(int(state) in touched for state in law):
+            violations[name] = None
+            continue
+        weights = np.zeros(len(Index))
+        for state, weight in law.items():
+            weights[state] = weight
+        imbalance = network.S.T @ weights
+        violations[name] = tuple(
+            (network.reactions[j].name, float(imbalance[j]))
+            for j in np.flatnonzero(np.abs(imbalance) > 1e-12)
+        )
+    return violations
+
+def conservation_report(p: Parameters, organs: tuple = None) -> str:
+    """
+    Returns the laws found in the model and the status of every expected law, as text.
+    """
+    lines = ["conservation laws:"]
+    lines += [f"    {law}" for law in conservation_laws(p, organs)] or ["    none"]
+    lines.append("expected laws:")
+    for name, violations in violated_laws(p, organs).items():
+        if violations is None:
+            lines.append(f"    {name}: not checked, its states are not part of the model")
+        elif not violations:
+            lines.append(f"    {name}: holds")
+        else:
+            lines.append(f"    {name}: violated by")
+            lines += [f"        {reaction} ({imbalance:+g} per unit flux)" for reaction, imbalance in violations]
+    return "\n".join(lines)
+
+def _broadcast(values, ndim, shape):
+    values = np.asarray(values, dtype=float)
+    return np.array(np.broadcast_to(np.reshape(values, values.shape + (1,) * (ndim - values.ndim)), shape))
+
+def __laws(reduced, base, tol):
+    states = np.intersect1d(reduced.indices, base)
+    S = reaction_network(reduced.parameters, reduced.organs).S[states].toarray()
+    changed = np.any(S != 0, axis=1)
+    states, S = states[changed], S[changed]
+    if len(states) == 0:
+        return ()
+
+    basis = _row_echelon(null_space(S.T).T, tol)
+    laws = []
+    for row in basis:
+        support = np.flatnonzero(np.abs(row) > tol)
+        laws.append(ConservationLaw(
+            states=tuple(Index(int(states[k])) for k in support),
+            weights=tuple(float(np.round(row[k], 12)) for k in support),
+            dependent=Index(int(states[support[0]])),
+        ))
+    return tuple(laws)
+
+def _row_echelon(A, tol):
+    # Gauss-Jordan elimination with partial pivoting, the pivots are the dependent states
+    A = A.copy()
+    rows, cols = A.shape
+    pivot_row = 0
+    for col in range(cols):
+        if pivot_row == rows:
+            break
+        best = pivot_row + np.argmax(np.abs(A[pivot_row:, col]))
+        if abs(A[best, col]) <= tol:
+            continue
+        A[[pivot_row, best]] = A[[best, pivot_row]]
+        A[pivot_row] /= A[pivot_row, col]
+        for other in range(rows):
+            if other != pivot_row:
+                A[other] -= A[other, col] * A[pivot_row]
+        pivot_row += 1
+    A[np.abs(A) <= tol] = 0.0
+    return A[:pivot_row]
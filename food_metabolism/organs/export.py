@@ -0,0 +1,314 @@
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+from .parameters import *
+from .index import Index
+from .packing import _layout, layout, pack, unpack
+from .cache import MODEL_VERSION
+from .simulate import SimulationResult
+from .sweep import SweepResult
+
+# rows per Parquet row group / Arrow record batch, rounded down to whole runs so that scanning one run of a
+# batch reads a single row group
+ROW_GROUP_ROWS = 1 << 16
+__COLUMNS = tuple(state.name for state in Index)
+
+def write_result(result: SimulationResult, path: str, row_group_rows: int = ROW_GROUP_ROWS) -> None:
+    """
+    Writes a `SimulationResult` to Parquet (`.parquet`) or to uncompressed Arrow IPC (`.arrow`, `.feather`),
+    with a column `t` and one float64 column per `Index` state. The parameters, status and solver counters
+    are stored in the schema metadata, so `read_result` rebuilds the whole result.
+
+    Needs pyarrow (`pip install food-metabolism[arrow]`).
+
+    Attributes:
+        result (SimulationResult): The run to write.
+        path (str): The file, its suffix selects the format.
+        row_group_rows (int): Rows per row group (record batch for Arrow).
+    """
+    pa = __pyarrow()
+    metadata = {
+        "model_version": MODEL_VERSION,
+        "parameters": __parameters_metadata(result.parameters),
+        "status": int(result.status),
+        "message": result.message,
+        "nfev": int(result.nfev),
+        "njev": int(result.njev),
+        "nlu": int(result.nlu),
+    }
+    schema = __schema(pa, run=False, metadata=metadata)
+    with __writer(path, schema) as write:
+        for start in range(0, len(result.t), row_group_rows):
+            rows = slice(start, start + row_group_rows)
+            write(pa.record_batch(
+                [pa.array(result.t[rows])] + [pa.array(np.ascontiguousarray(column)) for column in result.y[:, rows]],
+                schema=schema,
+            ))
+
+def read_result(path: str) -> SimulationResult:
+    """
+    Reads a run written by `write_result` back into a `SimulationResult`. Arrow IPC files are memory-mapped
+    and their columns read without decoding, Parquet files are memory-mapped and decoded; the state columns
+    are then gathered into `y` once.
+    """
+    table = __read(path)
+    metadata = __metadata(table.schema, run=False)
+    return SimulationResult(
+        t=__column(table, "t"),
+        y=__states(table),
+        parameters=__parameters_from(metadata["parameters"]),
+        status=metadata["status"],
+        message=metadata["message"],
+        nfev=metadata["nfev"],
+        njev=metadata["njev"],
+        nlu=metadata["nlu"],
+    )
+
+def write_batch(path: str, t: np.ndarray, y: np.ndarray, status: np.ndarray = None, design: np.ndarray = None,
+                groups: tuple = None, row_group_rows: int = ROW_GROUP_ROWS) -> None:
+    """
+    Writes a batch of runs on common time points (a sweep or a population) in long format: columns `run`,
+    `t` and one per `Index` state, sorted by run and time. The runs are written in chunks, so memory-mapped
+    batches larger than memory can be exported. A side table next to `path` (`<stem>.runs<suffix>`) holds
+    one row per run with its `status` and packed parameter columns ("V.plasma", "M.k_...", ...).
+
+    Needs pyarrow (`pip install food-metabolism[arrow]`).
+
+    Attributes:
+        path (str): The file, `.parquet`, `.arrow` or `.feather`.
+        t (np.ndarray): Common time points, shape (T,).
+        y (np.ndarray): States, shape (N, len(Index), T).
+        status (np.ndarray): Solver status of every run, zeros by default.
+        design (np.ndarray): Packed parameters of every run, shape (N, len(layout)), see `packing.pack`.
+        groups (tuple): The `Parameters` groups of the design's layout, needed with `design`.
+        row_group_rows (int): Target rows per row group, rounded to whole runs.
+    """
+    pa = __pyarrow()
+    N, T = len(y), len(t)
+    if y.shape[1:] != (len(Index), T):
+        raise ValueError(f"expected states of shape (N, {len(Index)}, {T}), got {y.shape}")
+    if design is not None and groups is None:
+        raise ValueError("the layout groups of the design are needed to read it back")
+
+    metadata = {"model_version": MODEL_VERSION, "runs": N, "steps": T}
+    schema = __schema(pa, run=True, metadata=metadata)
+    runs_per_group = max(1, row_group_rows // max(T, 1))
+    with __writer(path, schema) as write:
+        for start in range(0, N, runs_per_group):
+            block = np.asarray(y[start:start + runs_per_group])
+            count = len(block)
+            write(pa.record_batch(
+                [pa.array(np.repeat(np.arange(start, start + count, dtype=np.int32), T)), pa.array(np.tile(t, count))]
+                + [pa.array(block[:, i].reshape(-1)) for i in range(len(Index))],
+                schema=schema,
+            ))
+
+    columns = {"run": pa.array(np.arange(N, dtype=np.int32))}
+    columns["status"] = pa.array(np.zeros(N, dtype=np.int8) if status is None else np.asarray(status, dtype=np.int8))
+    side = {"groups": json.dumps(None if groups is None else list(groups))}
+    if design is not None:
+        names = _layout(tuple(groups)).names
+        columns.update({name: pa.array(np.ascontiguousarray(design[:, k])) for k, name in enumerate(names)})
+    table = pa.table(columns).replace_schema_metadata({key: value.encode() for key, value in side.items()})
+    with __writer(__side_path(path), table.schema) as write:
+        for batch in table.to_batches():
+            write(batch)
+
+def write_sweep(sweep: SweepResult, path: str, row_group_rows: int = ROW_GROUP_ROWS) -> None:
+    """
+    Writes a trajectory sweep from `sweep.run_sweep` with `write_batch`, chunk by chunk from its memory maps.
+    """
+    if sweep.y.ndim != 3 or sweep.y.shape[1] != len(Index):
+        raise ValueError("only sweeps of trajectories can be exported, not summaries")
+    write_batch(path, sweep.t, sweep.y, sweep.status, sweep.design, sweep.layout.groups, row_group_rows)
+
+def write_population(solution, p: Parameters, path: str, row_group_rows: int = ROW_GROUP_ROWS) -> None:
+    """
+    Writes a `population.solve_population` solution of the batched parameters `p` with `write_batch`.
+    """
+    write_batch(
+        path, solution.t, np.moveaxis(solution.y, 1, 0), np.full(solution.y.shape[1], solution.status),
+        pack(p), layout(p).groups, row_group_rows,
+    )
+
+def read_batch(path: str) -> SweepResult:
+    """
+    Opens a batch written by `write_batch` as a `sweep.SweepResult` whose `y` is a `BatchStates` of shape
+    (N, len(Index), T). No state is read up front: indexing `y` reads only the row groups (record batches
+    for Arrow) holding the runs it selects, memory-mapped as by `read_result`.
+    """
+    schema, rows, read = __groups(path)
+    metadata = __metadata(schema, run=True)
+    T = metadata["steps"]
+    side = __read(__side_path(path))
+    groups = json.loads(side.schema.metadata[b"groups"])
+    packed = None if groups is None else _layout(tuple(groups))
+    design = None if packed is None else np.stack([__column(side, name) for name in packed.names], axis=1)
+    return SweepResult(
+        path=path,
+        layout=packed,
+        design=design,
+        t=read(0, ("t",))[0][:T] if rows else np.empty(0),
+        y=BatchStates(read, [count // max(T, 1) for count in rows], T),
+        status=__column(side, "status"),
+    )
+
+class BatchStates:
+    """
+    The states of a batch written by `write_batch` as a read only array of shape (N, len(Index), T), see
+    `read_batch`. `y[i]` is run i, shape (len(Index), T); `y[i:j]`, `y[runs, Index.plasma_glucose]` and the
+    like gather the selected runs and states into a new array, reading each row group they touch once for
+    sorted runs; `np.asarray(y)` loads everything.
+
+    Attributes:
+        shape (tuple): (N, len(Index), T).
+    """
+    __slots__ = ("shape", "__read", "__starts", "__group", "__columns")
+
+    def __init__(self, read, runs: list, steps: int):
+        # `read(k, names)` returns the named columns of row group k, which holds `runs[k]` whole runs
+        self.__read = read
+        self.__starts = np.concatenate(([0], np.cumsum(runs, dtype=np.intp)))
+        self.shape = (int(self.__starts[-1]), len(Index), int(steps))
+        self.__group = None
+        self.__columns = None
+
+    @property
+    def ndim(self) -> int:
+        return 3
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(float)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        if len(key) > 3:
+            raise IndexError(f"too many indices for an array of shape {self.shape}")
+        runs, states, times = key + (slice(None),) * (3 - len(key))
+        states = np.arange(self.shape[1])[states]
+        if isinstance(runs, (int, np.integer)):
+            return self.__run(np.arange(self.shape[0])[runs], states)[..., times]
+        selected = np.arange(self.shape[0])[runs]
+        y = np.empty((len(selected),) + np.shape(states) + (self.shape[2],))
+        for j, i in enumerate(selected):
+            y[j] = self.__run(i, states)
+        return y[..., times]
+
+    def __array__(self, dtype=None, copy=None):
+        y = self[:]
+        return y if dtype is None else y.astype(dtype)
+
+    def __run(self, i, states):
+        # the states of run i, keeping the row group last read so consecutive runs decode it once
+        k = int(np.searchsorted(self.__starts, i, side="right")) - 1
+        if k != self.__group:
+            self.__columns = self.__read(k, None)
+            self.__group = k
+        steps = self.shape[2]
+        rows = slice((i - self.__starts[k]) * steps, (i - self.__starts[k] + 1) * steps)
+        if np.ndim(states) == 0:
+            return self.__columns[states][rows]
+        return np.stack([self.__columns[s][rows] for s in states]) if len(states) else np.empty((0, steps))
+
+def __pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            "exporting results needs pyarrow, install it with `pip install food-metabolism[arrow]`"
+        ) from None
+    return pyarrow
+
+def __schema(pa, run, metadata):
+    fields = [pa.field("run", pa.int32())] if run else []
+    fields += [pa.field("t", pa.float64())] + [pa.field(name, pa.float64()) for name in __COLUMNS]
+    return pa.schema(fields, metadata={key: json.dumps(value).encode() for key, value in metadata.items()})
+
+def __parquet(path):
+    return os.path.splitext(path)[1] == ".parquet"
+
+@contextmanager
+def __writer(path, schema):
+    pa = __pyarrow()
+    if __parquet(path):
+        writer = pa.parquet.ParquetWriter(path, schema, compression="zstd")
+        write = lambda batch: writer.write_batch(batch, row_group_size=batch.num_rows)
+    elif os.path.splitext(path)[1] in (".arrow", ".feather"):
+        # uncompressed, so `read_batch` can map the columns without decoding them
+        writer = pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression=None))
+        write = writer.write_batch
+    else:
+        raise ValueError(f"unknown format of {path!r}, expected .parquet, .arrow or .feather")
+    try:
+        yield write
+    finally:
+        writer.close()
+
+def __read(path):
+    pa = __pyarrow()
+    if __parquet(path):
+        return pa.parquet.read_table(path, memory_map=True)
+    return pa.feather.read_table(path, memory_map=True)
+
+def __groups(path):
+    # the schema, the rows of every row group (record batch for Arrow) and a reader of one group's columns,
+    # the state columns when no names are given
+    pa = __pyarrow()
+    if __parquet(path):
+        file = pa.parquet.ParquetFile(path, memory_map=True)
+        rows = [file.metadata.row_group(k).num_rows for k in range(file.num_row_groups)]
+        group = lambda k, names: file.read_row_group(k, columns=list(names))
+        schema = file.schema_arrow
+    else:
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        rows = [reader.get_batch(k).num_rows for k in range(reader.num_record_batches)]
+        group = lambda k, names: pa.Table.from_batches([reader.get_batch(k)]).select(list(names))
+        schema = reader.schema
+
+    def read(k, names=None):
+        table = group(k, names or __COLUMNS)
+        return tuple(__column(table, name) for name in names or __COLUMNS)
+
+    return schema, rows, read
+
+def __metadata(schema, run):
+    metadata = {key.decode(): json.loads(value) for key, value in (schema.metadata or {}).items()}
+    if metadata.get("model_version") != MODEL_VERSION:
+        raise ValueError("the file was written with a different state layout")
+    if ("runs" in metadata) != run:
+        raise ValueError("the file holds a batch, read it with read_batch" if not run else
+                         "the file holds a single run, read it with read_result")
+    return metadata
+
+def __column(table, name):
+    # a single chunk of an uncompressed Arrow file converts without a copy
+    column = table.column(name)
+    if column.num_chunks == 1:
+        return column.chunk(0).to_numpy(zero_copy_only=False)
+    return column.to_numpy()
+
+def __states(table):
+    y = np.empty((len(Index), len(table)))
+    for i, name in enumerate(__COLUMNS):
+        y[i] = __column(table, name)
+    return y
+
+def __parameters_metadata(p):
+    return {"groups": list(layout(p).groups), "values": pack(p).tolist()}
+
+def __parameters_from(metadata):
+    return unpack(np.array(metadata["values"]), _layout(tuple(metadata["groups"])))
+
+def __side_path(path):
+    stem, suffix = os.path.splitext(path)
+    return f"{stem}.runs{suffix}"
@@ -20,7 +20,7 @@ def fat(t: float, y: np.ndarray, p: Parameters) -> np.ndarray:
         dydt (np.ndarray): The array of rate-of-change values for each state variable, which is used in 
                             numerical integration methods (e.g., `solve_ivp`) to simulate the system.
     """
-    dydt = np.zeros(len(Index))
+    dydt = np.zeros(np.shape(y))
     __fat(t, y, p, dydt)
     return dydt
 
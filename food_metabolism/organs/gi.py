@@ -21,7 +21,7 @@ def GI(t: float, y: np.ndarray, p: Parameters) -> np.ndarray:
         dydt (np.ndarray): The array of rate-of-change values for each state variable, used in numerical 
                             integration methods (e.g., `solve_ivp`) to simulate the system.
     """
-    dydt = np.zeros(len(Index))
+    dydt = np.zeros(np.shape(y))
     __GI(t, y, p, dydt)
     return dydt
 
@@ -212,3 +212,50 @@ def get_gut_names():
         Index.cytosol_fattyacid.name,
         Index.cytosol_TAG.name,
     )
+
+def get_liver_indices():
+    return (
+        Index.liver_glucose,
+        Index.liver_fructose,
+        Index.liver_fattyacid,
+        Index.liver_aminoacid,
+        Index.liver_extracellular_pyruvate,
+        Index.liver_mitochondrial_pyruvate,
+        Index.liver_mitochondrial_ACoA,
+        Index.liver_G6P,
+        Index.liver_NAD,
+        Index.liver_NADH,
+        Index.liver_ATP,
+        Index.liver_ROS,
+    )
+
+def get_liver_names():
+    return tuple(index.name for index in get_liver_indices())
+
+COMPARTMENTS = ("plasma", "subq", "vsc", "muscle", "gut", "liver")
+
+def get_organ_slice(organ: str) -> slice:
+    """
+    Returns the contiguous block of `Index` positions holding every state of `organ`.
+
+    Unlike the `get_*_indices` tuples, which pick a subset in plotting order, a slice indexes
+    the state vector (or a solution of shape (len(Index), T)) without copying.
+
+    Attributes:
+        organ (str): One of "plasma", "subq", "vsc", "muscle", "gut" and "liver".
+
+    Returns:
+        block (slice): The positions of the organ's states, in `Index` order.
+    """
+    bounds = {
+        "plasma": (Index.plasma_glucose, Index.subq_glucose),
+        "subq": (Index.subq_glucose, Index.vsc_glucose),
+        "vsc": (Index.vsc_glucose, Index.muscle_glucose),
+        "muscle": (Index.muscle_glucose, Index.gut_glucose),
+        "gut": (Index.gut_glucose, Index.liver_glucose),
+        "liver": (Index.liver_glucose, len(Index)),
+    }
+    if organ not in bounds:
+        raise ValueError(f"unknown organ {organ!r}, expected one of {COMPARTMENTS}")
+    start, stop = bounds[organ]
+    return slice(int(start), int(stop))
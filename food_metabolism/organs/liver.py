@@ -189,8 +189,8 @@ def __fattyacid_uptake(t, y, p, dydt):
     return
 
 def __fattyacid_export(t, y, p, dydt):
-    dydt[Index.liver_fattyacid] += - p.Liver.k_FA_to_plasma * y[Index.liver_fattyacid] * p.V.liver) / p.V.plasma
-    dydt[Index.plasma_fattyacid] += + p.Liver.k_FA_to_plasma * y[Index.liver_fattyacid] * p.V.liver) / p.V.plasma
+    dydt[Index.liver_fattyacid] += - (p.Liver.k_FA_to_plasma * y[Index.liver_fattyacid] * p.V.liver) / p.V.plasma
+    dydt[Index.plasma_fattyacid] += + (p.Liver.k_FA_to_plasma * y[Index.liver_fattyacid] * p.V.liver) / p.V.plasma
     return
 
 def __fattyacid_synthesis(t, y, p, dydt):
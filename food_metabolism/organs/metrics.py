@@ -0,0 +1,169 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from .index import Index
+
+# rows of the values returned by `MetricsSink.values` and `Metrics.__call__`
+METRIC_NAMES = ("auc", "cmax", "tmax", "cmin", "tmin", "time_in_range", "initial", "final", "change")
+DEFAULT_STATES = (Index.plasma_glucose, Index.plasma_insulin, Index.subq_TAG, Index.vsc_TAG)
+# glucose target range in the model's concentration units (mM)
+DEFAULT_RANGES = {"plasma_glucose": (3.9, 10.0)}
+
+@dataclass(frozen=True, slots=True)
+class Metrics:
+    """
+    Data class selecting the PK/PD summary metrics of a run: per state the AUC (trapezoidal), the maximum and
+    minimum with their times, the time spent inside a range (of the piecewise linear trajectory), and the
+    initial and final values with their difference (e.g. TAG accumulation).
+
+    `metrics.sink()` computes them while `simulate(..., sink=...)` or `population.solve_population(...,
+    sink=...)` integrates, so the trajectory is never stored; `run_sweep(..., summary=metrics)` streams every
+    run that way. `metrics(result)` computes the same values from a stored result.
+
+    Attributes:
+        states (tuple): `Index` members or names of the states to summarise.
+        ranges (dict): State names mapped to the (low, high) range whose time in range is reported, nan for
+                       the states without one.
+    """
+    states: tuple = DEFAULT_STATES
+    ranges: dict = field(default_factory=lambda: dict(DEFAULT_RANGES))
+
+    @property
+    def indices(self) -> np.ndarray:
+        return np.array([Index[getattr(state, "name", state)] for state in self.states], dtype=np.intp)
+
+    @property
+    def names(self) -> tuple:
+        return tuple(Index(i).name for i in self.indices)
+
+    def sink(self) -> "MetricsSink":
+        """
+        Returns a fresh sink accumulating the metrics of one run (or one batched population).
+        """
+        return MetricsSink(self)
+
+    def __call__(self, result) -> np.ndarray:
+        """
+        Returns the metrics of a stored `SimulationResult`, shape (len(METRIC_NAMES), len(states)).
+        """
+        sink = self.sink()
+        sink.append(result.t, result.y)
+        return sink.values()
+
+class MetricsSink:
+    """
+    A sink for `simulate` and `population.solve_population` that folds every stored time point into running
+    metrics, see `Metrics`. Memory is constant in the length of the run.
+
+    States are of shape (len(Index), k) for a run, or (len(Index), N, k) for N subjects, and every metric is
+    computed for all subjects at once.
+
+    Attributes:
+        metrics (Metrics): The metrics to compute.
+    """
+    __slots__ = ("metrics", "__indices", "__low", "__high", "__t", "__y", "__last", "__sums")
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self.__indices = metrics.indices
+        ranges = [metrics.ranges.get(name, (np.nan, np.nan)) for name in metrics.names]
+        self.__low, self.__high = np.array(ranges, dtype=float).reshape(-1, 2).T
+        self.__t = None
+        self.__y = None
+        self.__last = None
+        self.__sums = None
+
+    def append(self, t, y) -> None:
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        y = np.asarray(y, dtype=float)
+        if y.ndim == 1:
+            # a single state vector, as `simulate` appends every accepted step
+            y = y[:, None]
+        if len(t) == 0:
+            return
+        selected = y[self.__indices]
+        if self.__sums is None:
+            self.__start(t[0], selected[..., 0])
+        self.__last = (t[-1], y[..., -1].copy())
+
+        # each new point closes an interval with the point before it
+        times = np.concatenate(([self.__t], t))
+        values = np.concatenate((self.__y[..., None], selected), axis=-1)
+        dt = np.diff(times)
+        left, right = values[..., :-1], values[..., 1:]
+        sums = self.__sums
+        sums["auc"] += np.sum(0.5 * (left + right) * dt, axis=-1)
+        sums["time_in_range"] += np.sum(self.__inside(left, right) * dt, axis=-1)
+
+        # the first time a maximum or minimum is reached
+        k = np.argmax(selected, axis=-1)
+        peak = np.take_along_axis(selected, k[..., None], axis=-1)[..., 0]
+        higher = peak > sums["cmax"]
+        sums["cmax"] = np.where(higher, peak, sums["cmax"])
+        sums["tmax"] = np.where(higher, t[k], sums["tmax"])
+        k = np.argmin(selected, axis=-1)
+        trough = np.take_along_axis(selected, k[..., None], axis=-1)[..., 0]
+        lower = trough < sums["cmin"]
+        sums["cmin"] = np.where(lower, trough, sums["cmin"])
+        sums["tmin"] = np.where(lower, t[k], sums["tmin"])
+        self.__t, self.__y = t[-1], selected[..., -1].copy()
+
+    def values(self) -> np.ndarray:
+        """
+        Returns the metrics so far, shape (len(METRIC_NAMES), len(states)) or (len(METRIC_NAMES), len(states), N),
+        rows in `METRIC_NAMES` order. Nothing appended gives nan.
+        """
+        if self.__sums is None:
+            return np.full((len(METRIC_NAMES), len(self.__indices)), np.nan)
+        sums = dict(self.__sums, final=self.__y, change=self.__y - self.__sums["initial"])
+        # a state without a range has no time in range
+        no_range = np.isnan(self.__low).reshape((-1,) + (1,) * (self.__y.ndim - 1))
+        sums["time_in_range"] = np.where(no_range, np.nan, sums["time_in_range"])
+        return np.stack([np.broadcast_to(sums[name], self.__y.shape) for name in METRIC_NAMES])
+
+    def as_dict(self) -> dict:
+        """
+        Returns the metrics as {state name: {metric name: value}}.
+        """
+        values = self.values()
+        return {
+            state: {metric: values[m, s] for m, metric in enumerate(METRIC_NAMES)}
+            for s, state in enumerate(self.metrics.names)
+        }
+
+    def view(self) -> tuple:
+        """
+        Returns the last time point and state, shapes (1,) and (len(Index), 1) (or (len(Index), N, 1)): only
+        the final state is kept.
+        """
+        if self.__last is None:
+            return np.empty(0), np.empty((len(Index), 0))
+        t, y = self.__last
+        return np.array([t]), y[..., None]
+
+    def __start(self, t, y):
+        self.__t, self.__y = t, y.copy()
+        self.__sums = {
+            "auc": np.zeros_like(y),
+            "time_in_range": np.zeros_like(y),
+            "cmax": y.copy(),
+            "tmax": np.full_like(y, t),
+            "cmin": y.copy(),
+            "tmin": np.full_like(y, t),
+            "initial": y.copy(),
+        }
+
+    def __inside(self, left, right):
+        # fraction of each interval the linear interpolant spends in [low, high]
+        shape = (-1,) + (1,) * (left.ndim - 1)
+        low, high = self.__low.reshape(shape), self.__high.reshape(shape)
+        slope = right - left
+        flat = slope == 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            s_low = (low - left) / slope
+            s_high = (high - left) / slope
+        start = np.clip(np.minimum(s_low, s_high), 0.0, 1.0)
+        stop = np.clip(np.maximum(s_low, s_high), 0.0, 1.0)
+        inside = (left >= low) & (left <= high)
+        return np.where(flat, inside.astype(float), np.nan_to_num(stop - start))
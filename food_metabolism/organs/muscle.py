@@ -31,7 +31,7 @@ def skeletalmuscle(t: float, y: np.ndarray, p: Parameters) -> np.ndarray:
         dydt (np.ndarray): The array of rate-of-change values for each state variable, which is used in 
                             numerical integration methods (e.g., `solve_ivp`) to simulate the system.
     """
-    dydt = np.zeros(len(Index))
+    dydt = np.zeros(np.shape(y))
     __muscle(t, y, p, dydt)   
     return dydt
 
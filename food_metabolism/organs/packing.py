@@ -0,0 +1,111 @@
+import hashlib
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
+
+import numpy as np
+
+from .parameters import *
+
+@dataclass(frozen=True, slots=True)
+class ParameterLayout:
+    """
+    Data class describing where each field of a `Parameters` tree lives in a packed vector.
+
+    Attributes:
+        groups (tuple[str, ...]): The `Parameters` fields that are present (not `None`), in declaration order.
+        names (tuple[str, ...]): Dotted field names ("V.plasma", "M.k_G_from_plasma", ...) in packed order.
+        offsets (dict[str, int]): Position of each dotted name in the packed vector.
+
+    Layouts only depend on which organs are present, so every `init()` parameter set shares one layout
+    and packed vectors from different presets are comparable column by column.
+    """
+    groups : tuple
+    names  : tuple
+    offsets: dict = field(compare=False, repr=False)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+def layout(p: Parameters) -> ParameterLayout:
+    """
+    Returns the packed layout of a parameters object (single or batched).
+    """
+    return _layout(tuple(f.name for f in fields(Parameters) if getattr(p, f.name) is not None))
+
+@lru_cache(maxsize=None)
+def _layout(groups: tuple) -> ParameterLayout:
+    classes = {f.name: f.type for f in fields(Parameters)}
+    names = tuple(
+        f"{group}.{f.name}"
+        for group in groups
+        for f in fields(classes[group])
+    )
+    return ParameterLayout(groups=groups, names=names, offsets={name: i for i, name in enumerate(names)})
+
+def pack(p: Parameters) -> np.ndarray:
+    """
+    Packs a `Parameters` tree into one contiguous float64 array.
+
+    Attributes:
+        p (Parameters): Parameters of one subject, or batched parameters from `population.stack_parameters`.
+
+    Returns:
+        x (np.ndarray): Shape (len(layout(p)),) for one subject, (N, len(layout(p))) for N subjects, with
+                        column `layout(p).offsets[name]` holding field `name`.
+    """
+    values = [
+        getattr(group, name)
+        for group_name, names in __group_fields(layout(p).groups)
+        for group in (getattr(p, group_name),)
+        for name in names
+    ]
+    # one (len(layout),) or (len(layout), N) array, fields last
+    return np.ascontiguousarray(np.moveaxis(np.array(values, dtype=float), 0, -1))
+
+def unpack(x: np.ndarray, layout: ParameterLayout) -> Parameters:
+    """
+    Rebuilds the `Parameters` tree from a packed array, the inverse of `pack`.
+
+    Attributes:
+        x (np.ndarray): A packed vector, or a 2-D array with one packed vector per row.
+        layout (ParameterLayout): The layout `x` was packed with.
+
+    Returns:
+        p (Parameters): Parameters with float fields for a vector, or batched parameters with (N,) array
+                        fields for a 2-D array. Organs missing from the layout are `None`.
+    """
+    x = np.asarray(x, dtype=float)
+    if x.shape[-1] != len(layout):
+        raise ValueError(f"expected {len(layout)} packed values, got {x.shape[-1]}")
+
+    classes = {f.name: f.type for f in fields(Parameters)}
+    groups = {name: None for name in classes}
+    offset = 0
+    for group in layout.groups:
+        cls = classes[group]
+        values = {}
+        for f in fields(cls):
+            column = x[..., offset]
+            values[f.name] = float(column) if x.ndim == 1 else column.copy()
+            offset += 1
+        groups[group] = cls(**values)
+    return Parameters(**groups)
+
+def fingerprint(p: Parameters) -> str:
+    """
+    Returns a hash identifying a parameter set by value: the sha256 hex digest of its layout and packed
+    values. Equal parameter sets (also separately constructed ones) share a fingerprint, and changing
+    any field changes it.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(layout(p).groups).encode())
+    x = pack(p)
+    digest.update(repr(x.shape).encode())
+    digest.update(x.tobytes())
+    return digest.hexdigest()
+
+@lru_cache(maxsize=None)
+def __group_fields(groups):
+    # the field names of every present group, in packed order
+    classes = {f.name: f.type for f in fields(Parameters)}
+    return tuple((group, tuple(f.name for f in fields(classes[group]))) for group in groups)
@@ -2,16 +2,49 @@
 # https://www.researchgate.net/figure/Concentration-response-of-insulin-secretion-A-Average-insulin-secretion-rate_fig3_336211327
 # https://www.sciencedirect.com/science/article/pii/S0168822713004221
 
+from dataclasses import dataclass
+
+import numpy as np
 from .index import Index 
 
+# piecewise linear response curves, shared by the scalar, array and table versions
+__INSULIN_M1 = (.75 - .0) / (11 - 2.5)
+__INSULIN_M2 = (.85 - .75) / (17 - 11)
+__INSULIN_M3 = (1 - 0.85) / (30 - 17)
+__INSULIN_X1 = 2.5
+__INSULIN_X2 = -34
+__INSULIN_X3 = -170/3
+
+__GLUCAGON_M1 = (0.3 - 1) / (7.5 - 0)
+# glucagon_m2 = (0.55 - 0.3) / (20 - 7.5)
+# glucagon_m3 = (1.3 - 0.55) / (30 - 20)
+__GLUCAGON_M2 = (0 - 0.3) / (30 - 7.5)
+__GLUCAGON_X1 = 75/7
+# glucagon_x2 = -7.5
+__GLUCAGON_X2 = 30
+# glucagon_x3 = 38/3
+
+__SOMATOSTATIN_M1 = 1 / 30
+# Gblood is mmol
+__K_BASELINE_INSULIN_SECRETION_MAX = 1
+__K_BASELINE_GLUCAGON_SECRETION_EMPTY = 1
+__K_BASELINE_SOMATOSTATIN_SECRETION_MAX = 1
+
+# glucose concentrations (mM) where a curve changes slope
+__BREAKPOINTS = (2.5, 7.5, 11, 17, 30)
+
 def __pancreas(t, y, dydt):
-    dinsulin, dglucagon, dsomat = pancreatic_secretion_response_to_Gblood(y[Index.plasma_glucose])
+    Gblood = y[Index.plasma_glucose]
+    if np.ndim(Gblood) == 0:
+        dinsulin, dglucagon, dsomat = pancreatic_secretion_response_to_Gblood(Gblood)
+    else:
+        dinsulin, dglucagon, dsomat = pancreatic_secretion_response_to_Gblood_array(Gblood)
     dydt[Index.plasma_insulin] += dinsulin
     dydt[Index.plasma_glucagon] += dglucagon
     dydt[Index.plasma_somatostatin] += dsomat
 
 def pancreas(t, y):
-    dydt = np.zeros(len(Index))
+    dydt = np.zeros(np.shape(y))
     __pancreas(t, y, dydt)
     return dydt
 
@@ -24,38 +57,16 @@ def pancreatic_secretion_response_to_Gblood(Gblood):
         secretion in the absence of glucose glucagon is based on the baseline secretion
         in the absence of glucose.
     """
-    insulin_m1 = (.75 - .0) / (11 - 2.5)
-    insulin_m2 = (.85 - .75) / (17 - 11)
-    insulin_m3 = (1 - 0.85) / (30 - 17)
-    insulin_x1 = 2.5
-    insulin_x2 = -34
-    insulin_x3 = -170/3
-
-    glucagon_m1 = (0.3 - 1) / (7.5 - 0)
-    # glucagon_m2 = (0.55 - 0.3) / (20 - 7.5)
-    # glucagon_m3 = (1.3 - 0.55) / (30 - 20)
-    __glucagon_m2 = (0 - 0.3) / (30 - 7.5)
-    glucagon_x1 = 75/7
-    # glucagon_x2 = -7.5
-    __glucagon_x2 = 30
-    # glucagon_x3 = 38/3
-
-    somatostatin_m1 =  1 / 30
-    # Gblood is mmol
-    k_baseline_insulin_secretion_max = 1
-    k_baseline_glucagon_secretion_empty = 1
-    k_baseline_somatostatin_secretion_max = 1
-
     # INSULIN
     dinsulin = 0
     if Gblood >= 30:
-        dinsulin +=  k_baseline_insulin_secretion_max
+        dinsulin +=  __K_BASELINE_INSULIN_SECRETION_MAX
     elif Gblood >= 17:
-        dinsulin += insulin_m3 * k_baseline_insulin_secretion_max * (Gblood - insulin_x3)
+        dinsulin += __INSULIN_M3 * __K_BASELINE_INSULIN_SECRETION_MAX * (Gblood - __INSULIN_X3)
     elif Gblood >= 11:
-        dinsulin += insulin_m2 * k_baseline_insulin_secretion_max * (Gblood - insulin_x2)
+        dinsulin += __INSULIN_M2 * __K_BASELINE_INSULIN_SECRETION_MAX * (Gblood - __INSULIN_X2)
     elif Gblood >= 2.5:
-        dinsulin += insulin_m1 * k_baseline_insulin_secretion_max * (Gblood - insulin_x1)
+        dinsulin += __INSULIN_M1 * __K_BASELINE_INSULIN_SECRETION_MAX * (Gblood - __INSULIN_X1)
 
 
     # GLUCAGON
@@ -70,12 +81,128 @@ def pancreatic_secretion_response_to_Gblood(Gblood):
     #     dglucagon += glucagon_m1 * k_baseline_glucagon_secretion_empty * (Gblood - glucagon_x1)
      
     if Gblood <= 7.5:
-        dglucagon += glucagon_m1 * k_baseline_glucagon_secretion_empty * (Gblood - glucagon_x1)
+        dglucagon += __GLUCAGON_M1 * __K_BASELINE_GLUCAGON_SECRETION_EMPTY * (Gblood - __GLUCAGON_X1)
     elif Gblood <= 30:
-        dglucagon += __glucagon_m2 * k_baseline_glucagon_secretion_empty * (Gblood - __glucagon_x2)
+        dglucagon += __GLUCAGON_M2 * __K_BASELINE_GLUCAGON_SECRETION_EMPTY * (Gblood - __GLUCAGON_X2)
 
     # SOMATOSTATIN
-    dsomatostatin = somatostatin_m1 * k_baseline_somatostatin_secretion_max * Gblood
+    dsomatostatin = __SOMATOSTATIN_M1 * __K_BASELINE_SOMATOSTATIN_SECRETION_MAX * Gblood
+
+    return (dinsulin, dglucagon, dsomatostatin)
+
+@dataclass(frozen=True, slots=True)
+class PancreaticSecretionTable:
+    """
+    Data class holding the secretion response curves tabulated on a glucose grid, see
+    `pancreatic_secretion_table`.
+
+    Attributes:
+        Gblood (np.ndarray): Increasing plasma glucose grid (mM), containing every breakpoint of the curves.
+        insulin (np.ndarray): Insulin secretion at each grid point.
+        glucagon (np.ndarray): Glucagon secretion at each grid point.
+        somatostatin (np.ndarray): Somatostatin secretion at each grid point.
+    """
+    Gblood      : np.ndarray
+    insulin     : np.ndarray
+    glucagon    : np.ndarray
+    somatostatin: np.ndarray
+
+def pancreatic_secretion_table(Gblood_max: float = 30.0, spacing: float = 0.5) -> PancreaticSecretionTable:
+    """
+    Tabulates the secretion response curves from 0 to `Gblood_max` mM for
+    `pancreatic_secretion_response_to_Gblood_array(Gblood, table=...)`.
+
+    The breakpoints of the piecewise curves are always grid points, so linear interpolation reproduces the
+    curves up to rounding for any spacing; a finer grid only matters if the curves are replaced by
+    nonlinear ones.
+
+    Attributes:
+        Gblood_max (float): Upper end of the grid (mM). Glucose outside [0, Gblood_max] is evaluated directly.
+        spacing (float): Distance between the regular grid points (mM).
+
+    Returns:
+        table (PancreaticSecretionTable): The tabulated curves.
+    """
+    Gblood = np.union1d(
+        np.linspace(0.0, Gblood_max, int(np.ceil(Gblood_max / spacing)) + 1),
+        [x for x in __BREAKPOINTS if x < Gblood_max],
+    )
+    insulin, glucagon, somatostatin = pancreatic_secretion_response_to_Gblood_array(Gblood)
+    return PancreaticSecretionTable(
+        Gblood=Gblood,
+        insulin=insulin,
+        glucagon=glucagon,
+        somatostatin=somatostatin,
+    )
+
+def pancreatic_secretion_response_to_Gblood_array(Gblood, table: PancreaticSecretionTable = None):
+    """
+        elementwise version of `pancreatic_secretion_response_to_Gblood` for an
+        array of plasma glucose concentrations (mM), e.g. one per subject of a
+        batched state or one per time point of a solution. Without a table the
+        result matches the scalar function bit for bit. With a table from
+        `pancreatic_secretion_table` the curves are linearly interpolated
+        instead, falling back to the direct evaluation outside the table.
+    """
+    Gblood = np.asarray(Gblood, dtype=float)
+    if table is not None:
+        return __secretion_response_from_table(Gblood, table)
+
+    dinsulin = 0 + np.select(
+        (Gblood >= 30, Gblood >= 17, Gblood >= 11, Gblood >= 2.5),
+        (
+            np.full(np.shape(Gblood), __K_BASELINE_INSULIN_SECRETION_MAX, dtype=float),
+            __INSULIN_M3 * __K_BASELINE_INSULIN_SECRETION_MAX * (Gblood - __INSULIN_X3),
+            __INSULIN_M2 * __K_BASELINE_INSULIN_SECRETION_MAX * (Gblood - __INSULIN_X2),
+            __INSULIN_M1 * __K_BASELINE_INSULIN_SECRETION_MAX * (Gblood - __INSULIN_X1),
+        ),
+    )
+    dglucagon = 0 + np.select(
+        (Gblood <= 7.5, Gblood <= 30),
+        (
+            __GLUCAGON_M1 * __K_BASELINE_GLUCAGON_SECRETION_EMPTY * (Gblood - __GLUCAGON_X1),
+            __GLUCAGON_M2 * __K_BASELINE_GLUCAGON_SECRETION_EMPTY * (Gblood - __GLUCAGON_X2),
+        ),
+    )
+    dsomatostatin = __SOMATOSTATIN_M1 * __K_BASELINE_SOMATOSTATIN_SECRETION_MAX * Gblood
+
+    return (dinsulin, dglucagon, dsomatostatin)
+
+def __secretion_response_from_table(Gblood, table):
+    responses = tuple(
+        np.asarray(np.interp(Gblood, table.Gblood, values))
+        for values in (table.insulin, table.glucagon, table.somatostatin)
+    )
+    outside = (Gblood < table.Gblood[0]) | (Gblood > table.Gblood[-1])
+    if np.any(outside):
+        direct = pancreatic_secretion_response_to_Gblood_array(Gblood[outside])
+        for response, values in zip(responses, direct):
+            response[outside] = values
+    return responses
+
+def pancreatic_secretion_slope_to_Gblood(Gblood):
+    """
+        derivative of `pancreatic_secretion_response_to_Gblood` with respect to
+        plasma glucose. On a breakpoint the slope of the branch the response
+        function takes is returned.
+    """
+    dinsulin = 0
+    if Gblood >= 30:
+        pass
+    elif Gblood >= 17:
+        dinsulin += __INSULIN_M3 * __K_BASELINE_INSULIN_SECRETION_MAX
+    elif Gblood >= 11:
+        dinsulin += __INSULIN_M2 * __K_BASELINE_INSULIN_SECRETION_MAX
+    elif Gblood >= 2.5:
+        dinsulin += __INSULIN_M1 * __K_BASELINE_INSULIN_SECRETION_MAX
+
+    dglucagon = 0
+    if Gblood <= 7.5:
+        dglucagon += __GLUCAGON_M1 * __K_BASELINE_GLUCAGON_SECRETION_EMPTY
+    elif Gblood <= 30:
+        dglucagon += __GLUCAGON_M2 * __K_BASELINE_GLUCAGON_SECRETION_EMPTY
+
+    dsomatostatin = __SOMATOSTATIN_M1 * __K_BASELINE_SOMATOSTATIN_SECRETION_MAX
 
     return (dinsulin, dglucagon, dsomatostatin)
 
@@ -84,7 +211,7 @@ def plot_hormone_secretion_from_G_conc():
     import numpy as np
 
     Gblood = np.linspace(0, 30, 31)
-    hormones = np.array([pancreatic_secretion_response_to_Gblood(glucose) for glucose in Gblood])
+    hormones = np.stack(pancreatic_secretion_response_to_Gblood_array(Gblood), axis=1)
 
     hormone_labels = ('Insulin', 'Glucagon', 'Somatostatin')
     colors = ('blue', 'green', 'red')
@@ -0,0 +1,162 @@
+from dataclasses import fields
+
+import numpy as np
+from scipy.integrate import solve_ivp
+from scipy.optimize import OptimizeResult
+from scipy.sparse import identity, kron
+
+from .parameters import *
+from .index import Index
+from .compiled import compile_system
+from .jacobian import jac_sparsity
+from .simulate import METHODS
+
+def stack_parameters(params) -> Parameters:
+    """
+    Stacks the parameters of N virtual subjects into one batched `Parameters`.
+
+    The result has the same tree of dataclasses as each subject, but every rate constant and volume
+    is a float64 array of shape (N,) holding that field for each subject. Organs must be present (or
+    `None`) consistently across subjects.
+
+    Attributes:
+        params (Sequence[Parameters]): The parameters of each subject.
+
+    Returns:
+        p (Parameters): Batched parameters accepted by `system`, the organ functions, `compile_system`
+                        and `population_system` together with states of shape (len(Index), N).
+    """
+    params = list(params)
+    if not params:
+        raise ValueError("need at least one subject")
+
+    def stack(group, values):
+        present = [value is not None for value in values]
+        if not any(present):
+            return None
+        if not all(present):
+            raise ValueError(f"{group} parameters are set for some subjects but not for others")
+        cls = type(values[0])
+        return cls(**{
+            field.name: np.array([getattr(value, field.name) for value in values], dtype=float)
+            for field in fields(cls)
+        })
+
+    return Parameters(**{
+        field.name: stack(field.name, [getattr(p, field.name) for p in params])
+        for field in fields(Parameters)
+    })
+
+def select_subject(p: Parameters, i: int) -> Parameters:
+    """
+    Returns the parameters of subject `i` from batched parameters built by `stack_parameters`.
+    """
+    def select(group):
+        if group is None:
+            return None
+        cls = type(group)
+        return cls(**{field.name: float(getattr(group, field.name)[i]) for field in fields(cls)})
+
+    return Parameters(**{field.name: select(getattr(p, field.name)) for field in fields(Parameters)})
+
+def population_size(p: Parameters) -> int:
+    """
+    Number of subjects in batched parameters built by `stack_parameters`.
+    """
+    return len(p.V.plasma)
+
+def population_system(t: float, y: np.ndarray, p: Parameters) -> np.ndarray:
+    """
+    The population_system function computes dydt for N virtual subjects at once.
+
+    Attributes:
+        t (float): The current time point (in the simulation's time units).
+        y (np.ndarray): The states of all subjects, shape (len(Index), N) with one column per subject.
+        p (Parameters): Batched parameters from `stack_parameters`.
+
+    Returns:
+        dydt (np.ndarray): Shape (len(Index), N), column i equal to `system(t, y[:, i], select_subject(p, i))`.
+    """
+    return compile_system(p)(t, y)
+
+def solve_population(params, y0: np.ndarray, t_span: tuple, method: str = "BDF", sink=None, **options):
+    """
+    Integrates N virtual subjects in a single `solve_ivp` call.
+
+    The states of all subjects are flattened into one vector of length len(Index) * N and advanced by
+    the batched compiled kernel. Subjects do not interact, so for the implicit methods the Jacobian
+    sparsity is block diagonal and a finite difference Jacobian costs about as many batched right hand
+    side evaluations as a single subject would.
+
+    Attributes:
+        params (Parameters | Sequence[Parameters]): Batched parameters or the parameters of each subject.
+        y0 (np.ndarray): Initial states, shape (len(Index), N), or (len(Index),) to start every subject
+                         from the same state.
+        t_span (tuple): The (start, end) time of the simulation.
+        method (str): Any `solve_ivp` method.
+        sink (MetricsSink | TrajectoryWriter): Receives the stored time points as the solver produces them, with
+                                               states of shape (len(Index), N, k), instead of `solve_ivp` keeping
+                                               them, e.g. `metrics.Metrics().sink()`. `method` is then one of
+                                               `simulate.METHODS`.
+        options: Further keyword arguments for `solve_ivp` (t_eval, rtol, atol, ...).
+
+    Returns:
+        solution (OdeResult): The `solve_ivp` result with `y` reshaped to (len(Index), N, len(t)). With a sink,
+                              `t` and `y` are the sink's `view()` and the result has no dense output or events.
+    """
+    p = params if isinstance(params, Parameters) else stack_parameters(params)
+    N = population_size(p)
+    n = len(Index)
+    y0 = np.broadcast_to(np.asarray(y0, dtype=float).reshape(n, -1), (n, N))
+
+    rhs = compile_system(p)
+    out = np.empty((n, N))
+
+    def fun(t, y):
+        return rhs(t, y.reshape(n, N), out).ravel().copy()
+
+    if method in ("BDF", "Radau") and "jac" not in options:
+        # flattened layout is state major, state i of subject s sits at i * N + s
+        options.setdefault("jac_sparsity", kron(jac_sparsity(), identity(N), format="csc"))
+
+    if sink is not None:
+        return __stream(fun, t_span, y0.ravel(), method, sink, (n, N), options)
+    solution = solve_ivp(fun, t_span, y0.ravel(), method=method, **options)
+    solution.y = solution.y.reshape(n, N, -1)
+    return solution
+
+def __stream(fun, t_span, y0, method, sink, shape, options):
+    # the stepping loop of solve_ivp, handing the stored points to the sink instead of keeping them
+    t_eval = options.pop("t_eval", None)
+    solver = METHODS[method](fun, t_span[0], y0, t_span[1], **options)
+    direction = 1.0 if t_span[1] >= t_span[0] else -1.0
+    if t_eval is None:
+        sink.append(solver.t, y0.reshape(shape + (1,)))
+    else:
+        t_eval = np.asarray(t_eval, dtype=float)
+        stored = 0
+    message = None
+    while solver.status == "running":
+        t_old = solver.t
+        message = solver.step()
+        if solver.status == "failed":
+            break
+        if t_eval is None:
+            sink.append(solver.t, solver.y.reshape(shape + (1,)))
+            continue
+        end = np.searchsorted(direction * t_eval, direction * solver.t, side="right")
+        if end > stored:
+            times = t_eval[stored:end]
+            # the first step also stores t_eval points at t0, from the dense output of the step
+            interpolant = solver.dense_output() if solver.t != t_old else None
+            values = interpolant(times) if interpolant is not None else np.repeat(y0[:, None], len(times), axis=1)
+            sink.append(times, values.reshape(shape + (len(times),)))
+            stored = end
+
+    status = 0 if solver.status == "finished" else -1
+    t, y = sink.view()
+    return OptimizeResult(
+        t=t, y=y, status=status, success=status >= 0,
+        message="The solver successfully reached the end of the integration interval." if status == 0 else message,
+        nfev=solver.nfev, njev=solver.njev, nlu=solver.nlu, sol=None, t_events=None, y_events=None,
+    )
@@ -0,0 +1,212 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from .parameters import *
+from .index import Index
+from .packing import pack, layout
+
+@dataclass(frozen=True, slots=True)
+class PreparedParameters:
+    """
+    Data class caching the coefficients derived from a `Parameters` instance.
+
+    The compiled kernel, the analytic Jacobian and the stoichiometric form keep re-deriving the same
+    quantities from the raw rates and volumes. They are computed here once per parameter set; build instances
+    with `prepare`, which only rebuilds when a field of the parameters has changed. The organ functions in
+    `fat`, `GI` and `skeletalmuscle` (and so `system`) do not read these, they stay the plain reference
+    equations that `compiled.is_equivalent` checks against.
+
+    Attributes:
+        parameters (Parameters): The parameters the coefficients were derived from.
+        subq_esterification_rate (float): Subq.k_FA_to_TAG * V.subq, numerator of the subq esterification Hill term.
+        vsc_esterification_rate (float): Vsc.k_FA_to_TAG * V.vsc, numerator of the vsc esterification Hill term.
+        glycogen_synthesis_rate (float): M.k_G6P_to_P * V.muscle, numerator of the muscle glycogen synthesis term.
+        linear (dict[str, np.ndarray]): Per organ ("fat", "gi", "muscle") matrix A of the first-order terms,
+                                        the plasma/tissue exchange and every linear conversion, so that those
+                                        terms contribute A @ y to dydt. Shape (len(Index), len(Index)), with a
+                                        trailing subject axis for batched parameters.
+
+    With batched parameters from `population.stack_parameters` every coefficient is an array with one value
+    per subject.
+    """
+    parameters              : Parameters
+    subq_esterification_rate: float
+    vsc_esterification_rate : float
+    glycogen_synthesis_rate : float
+    linear                  : dict
+
+__cache = OrderedDict()
+__CACHE_SIZE = 64
+
+def prepare(p: Parameters) -> PreparedParameters:
+    """
+    Returns the derived coefficients of `p`, reusing the cached ones while none of its fields change.
+
+    The cache is keyed by the packed parameter values rather than the object, so editing a mutable field
+    (e.g. `p.V.muscle = 30`) rebuilds the coefficients on the next call, and equal parameter sets share
+    one instance.
+
+    Attributes:
+        p (Parameters): Parameters of one subject or batched parameters.
+
+    Returns:
+        prepared (PreparedParameters): The cached coefficients.
+    """
+    key = (layout(p).groups, pack(p).tobytes())
+    prepared = __cache.get(key)
+    if prepared is None:
+        prepared = __prepare(p)
+        __cache[key] = prepared
+        if len(__cache) > __CACHE_SIZE:
+            __cache.popitem(last=False)
+    else:
+        __cache.move_to_end(key)
+    return prepared
+
+def __prepare(p):
+    V = p.V
+    # volume ratios of the exchange terms, only needed to fill the linear blocks
+    ratios = dict(
+        subq_to_plasma=V.subq / V.plasma,
+        plasma_to_subq=V.plasma / V.subq,
+        vsc_to_plasma=V.vsc / V.plasma,
+        plasma_to_vsc=V.plasma / V.vsc,
+        muscle_to_plasma=V.muscle / V.plasma,
+        plasma_to_muscle=V.plasma / V.muscle,
+        gut_to_plasma=V.gut / V.plasma,
+    )
+
+    shape = (len(Index), len(Index)) + np.shape(V.plasma)
+    linear = {}
+    if p.Subq is not None and p.Vsc is not None:
+        linear["fat"] = __fat_linear(p, ratios, np.zeros(shape))
+    if p.GI is not None:
+        linear["gi"] = __GI_linear(p, ratios, np.zeros(shape))
+    if p.M is not None:
+        linear["muscle"] = __muscle_linear(p, ratios, np.zeros(shape))
+
+    return PreparedParameters(
+        parameters=p,
+        subq_esterification_rate=p.Subq.k_FA_to_TAG * V.subq if p.Subq is not None else None,
+        vsc_esterification_rate=p.Vsc.k_FA_to_TAG * V.vsc if p.Vsc is not None else None,
+        glycogen_synthesis_rate=p.M.k_G6P_to_P * V.muscle if p.M is not None else None,
+        linear=linear,
+    )
+
+def __fat_linear(p, ratios, A):
+    Subq, Vsc = p.Subq, p.Vsc
+
+    # plasma <-> tissue exchange
+    for plasma, subq, vsc, k_from, k_to in (
+        (Index.plasma_glucose, Index.subq_glucose, Index.vsc_glucose, "k_G_from_plasma", "k_G_to_plasma"),
+        (Index.plasma_insulin, Index.subq_insulin, Index.vsc_insulin, "k_insulin_from_plasma", "k_insulin_to_plasma"),
+        (Index.plasma_fattyacid, Index.subq_fattyacid, Index.vsc_fattyacid, "k_FA_from_plasma", "k_FA_to_plasma"),
+        (Index.plasma_aminoacid, Index.subq_aminoacid, Index.vsc_aminoacid, "k_AA_from_plasma", "k_AA_to_plasma"),
+    ):
+        for tissue, rates, to_plasma, from_plasma in (
+            (subq, Subq, ratios["subq_to_plasma"], ratios["plasma_to_subq"]),
+            (vsc, Vsc, ratios["vsc_to_plasma"], ratios["plasma_to_vsc"]),
+        ):
+            k_in, k_out = getattr(rates, k_from), getattr(rates, k_to)
+            A[plasma, plasma] += -k_in
+            A[plasma, tissue] += k_out * to_plasma
+            A[tissue, plasma] += k_in * from_plasma
+            A[tissue, tissue] += -k_out
+
+    # glucose phosphorylation, the vsc glucose balance uses the vsc rates
+    A[Index.subq_glucose, Index.subq_glucose] += -Subq.k_G_to_G6P
+    A[Index.subq_glucose, Index.subq_G6P] += Subq.k_G6P_to_G
+    A[Index.vsc_glucose, Index.vsc_glucose] += -Vsc.k_G_to_G6P
+    A[Index.vsc_glucose, Index.vsc_G6P] += Vsc.k_G6P_to_G
+
+    A[Index.subq_insulin, Index.subq_insulin] += -Subq.kCL_insulin
+    A[Index.vsc_insulin, Index.vsc_insulin] += -Vsc.kCL_insulin
+
+    # lipolysis uses each depot's own rate, everything else in vsc uses the subq rates
+    for fattyacid, TAG, ROS, k_TAG_to_FA in (
+        (Index.subq_fattyacid, Index.subq_TAG, Index.subq_ROS, Subq.k_TAG_to_FA),
+        (Index.vsc_fattyacid, Index.vsc_TAG, Index.vsc_ROS, Vsc.k_TAG_to_FA),
+    ):
+        A[fattyacid, TAG] += 3 * k_TAG_to_FA
+        A[TAG, TAG] += -k_TAG_to_FA
+        A[ROS, TAG] += 0.01 * 3 * k_TAG_to_FA
+
+    for glucose, fattyacid, aminoacid, G6P, pyruvate, ACoA, ROS in (
+        (Index.subq_glucose, Index.subq_fattyacid, Index.subq_aminoacid, Index.subq_G6P,
+         Index.subq_pyruvate, Index.subq_ACoA, Index.subq_ROS),
+        (Index.vsc_glucose, Index.vsc_fattyacid, Index.vsc_aminoacid, Index.vsc_G6P,
+         Index.vsc_pyruvate, Index.vsc_ACoA, Index.vsc_ROS),
+    ):
+        A[fattyacid, fattyacid] += -Subq.k_FA_to_ACoA
+        A[fattyacid, ACoA] += Subq.k_ACoA_to_FA
+        A[aminoacid, aminoacid] += -Subq.k_AA_to_ACoA
+
+        A[G6P, glucose] += Subq.k_G_to_G6P
+        A[G6P, G6P] += -Subq.k_G6P_to_G - Subq.k_G6P_to_P
+
+        A[pyruvate, G6P] += 2 * Subq.k_G6P_to_P
+        A[pyruvate, pyruvate] += -Subq.k_P_to_ACoA
+
+        A[ACoA, pyruvate] += Subq.k_P_to_ACoA
+        A[ACoA, fattyacid] += 8 * Subq.k_FA_to_ACoA
+        A[ACoA, aminoacid] += Subq.k_AA_to_ACoA
+        A[ACoA, ACoA] += -8 * Subq.k_ACoA_to_FA
+
+        A[ROS, fattyacid] += 0.01 * Subq.k_FA_to_ACoA
+        A[ROS, aminoacid] += 0.01 * Subq.k_AA_to_ACoA
+        A[ROS, ACoA] += 0.01 * 8 * Subq.k_ACoA_to_FA
+    return A
+
+def __GI_linear(p, ratios, A):
+    GI = p.GI
+
+    A[Index.gut_glucose, Index.gut_glucose] += -GI.kabs_glucose
+    A[Index.plasma_glucose, Index.gut_glucose] += GI.kabs_glucose * ratios["gut_to_plasma"]
+    A[Index.plasma_glucose, Index.plasma_glucose] += -GI.kCL_glucose
+
+    A[Index.gut_fructose, Index.gut_fructose] += -GI.kabs_fructose
+    A[Index.plasma_fructose, Index.gut_fructose] += GI.kabs_fructose * ratios["gut_to_plasma"]
+    A[Index.plasma_fructose, Index.plasma_fructose] += -GI.kCL_fructose
+
+    k = GI.k_diffusion_micelle_to_membrane
+    A[Index.micellar_fattyacid, Index.micellar_fattyacid] += -k
+    A[Index.micellar_fattyacid, Index.membrane_fattyacid] += k
+    A[Index.membrane_fattyacid, Index.micellar_fattyacid] += k
+    A[Index.membrane_fattyacid, Index.membrane_fattyacid] += -k
+    A[Index.plasma_fattyacid, Index.plasma_fattyacid] += -GI.kCL_fattyacid
+    return A
+
+def __muscle_linear(p, ratios, A):
+    M = p.M
+
+    for plasma, muscle, k_in, k_out in (
+        (Index.plasma_glucose, Index.muscle_glucose, M.k_G_from_plasma, M.k_G_to_plasma),
+        (Index.plasma_insulin, Index.muscle_insulin, M.k_insulin_from_plasma, M.k_insulin_to_plasma),
+        (Index.plasma_fattyacid, Index.muscle_fattyacid, M.k_FA_from_plasma, M.k_FA_to_plasma),
+        (Index.plasma_aminoacid, Index.muscle_aminoacid, M.k_AA_from_plasma, M.k_AA_to_plasma),
+        (Index.plasma_lactate, Index.muscle_lactate, M.k_L_from_plasma, M.k_L_to_plasma),
+    ):
+        A[plasma, plasma] += -k_in
+        A[plasma, muscle] += k_out * ratios["muscle_to_plasma"]
+        A[muscle, plasma] += k_in * ratios["plasma_to_muscle"]
+        A[muscle, muscle] += -k_out
+
+    A[Index.muscle_glucose, Index.muscle_glucose] += -M.k_Glc_to_G6P
+    A[Index.muscle_glucose, Index.muscle_G6P] += M.k_G6P_to_Glc
+    A[Index.muscle_G6P, Index.muscle_glucose] += M.k_Glc_to_G6P
+    A[Index.muscle_G6P, Index.muscle_G6P] += -M.k_G6P_to_Glc
+
+    A[Index.muscle_insulin, Index.muscle_insulin] += -M.kCL_insulin
+
+    A[Index.muscle_G6P, Index.muscle_glycogen] += M.k_P_to_G6P
+    A[Index.muscle_glycogen, Index.muscle_glycogen] += -M.k_P_to_G6P
+
+    A[Index.muscle_aminoacid, Index.muscle_aminoacid] += -M.k_AA_to_ACoA
+    A[Index.muscle_ACoA, Index.muscle_aminoacid] += M.k_AA_to_ACoA
+    A[Index.muscle_ROS, Index.muscle_aminoacid] += 0.02 * M.k_AA_to_ACoA
+
+    A[Index.muscle_ATP, Index.muscle_G6P] += M.k_G6P_to_G
+    A[Index.muscle_ATP, Index.muscle_ATP] += -M.kCL_ATP
+    return A
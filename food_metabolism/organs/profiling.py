@@ -0,0 +1,123 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from types import FunctionType
+
+from . import fat, gi, muscle, liver, pancreas
+from . import system as system_module
+
+# organ functions `system` calls, by module and name
+__ORGANS = (
+    (system_module, "__fat", fat),
+    (system_module, "__GI", gi),
+    (system_module, "__muscle", muscle),
+    (system_module, "__pancreas", pancreas),
+    (system_module, "__liver", liver),
+)
+
+@dataclass(slots=True)
+class Profile:
+    """
+    Data class collecting call counts and timings of a simulation, see `instrument` and
+    `simulate(..., profile=Profile())`.
+
+    Attributes:
+        subprocesses (bool): Whether to also time the sub-processes of each organ (`fat.__glucose`,
+                             `muscle.__NAD`, ...), not only the organ functions.
+        calls (dict[str, int]): Number of calls per organ function or sub-process.
+        seconds (dict[str, float]): Cumulative wall time per organ function or sub-process. Sub-process time is
+                                    included in its organ's time.
+        rhs_evaluations (int): Right hand side evaluations requested by the solver.
+        jacobian_evaluations (int): Jacobian evaluations requested by the solver.
+        lu_decompositions (int): LU decompositions done by the solver.
+        steps (int): Accepted steps.
+        rejected_steps (int | None): Steps the solver rejected and retried with a smaller step size, None for
+                                     LSODA, whose attempts are not observable from the right hand side calls.
+    """
+    subprocesses        : bool = False
+    calls               : dict = field(default_factory=dict)
+    seconds             : dict = field(default_factory=dict)
+    rhs_evaluations     : int = 0
+    jacobian_evaluations: int = 0
+    lu_decompositions   : int = 0
+    steps               : int = 0
+    rejected_steps      : int = None
+
+    def as_dict(self) -> dict:
+        """
+        Returns the profile as plain nested dicts, e.g. for json.
+        """
+        return {
+            "functions": {
+                name: {"calls": self.calls[name], "seconds": self.seconds[name]}
+                for name in self.calls
+            },
+            "solver": {
+                "rhs_evaluations": self.rhs_evaluations,
+                "jacobian_evaluations": self.jacobian_evaluations,
+                "lu_decompositions": self.lu_decompositions,
+                "steps": self.steps,
+                "rejected_steps": self.rejected_steps,
+            },
+        }
+
+    def report(self) -> str:
+        """
+        Returns a table of the organ and sub-process timings (slowest first) and the solver counters.
+        """
+        lines = [f"{'function':<32}{'calls':>10}{'seconds':>12}{'us/call':>10}"]
+        for name in sorted(self.calls, key=lambda name: -self.seconds[name]):
+            calls, seconds = self.calls[name], self.seconds[name]
+            lines.append(f"{name:<32}{calls:>10}{seconds:>12.4f}{1e6 * seconds / max(calls, 1):>10.1f}")
+        lines.append("")
+        for name, value in self.as_dict()["solver"].items():
+            lines.append(f"{name:<32}{'-' if value is None else value:>10}")
+        return "\n".join(lines)
+
+    def record(self, name: str, seconds: float):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+@contextmanager
+def instrument(profile: Profile):
+    """
+    Times every organ function `system` calls (and with `profile.subprocesses` every sub-process of the
+    organ modules) into `profile` while the block runs.
+
+    The functions are swapped for timing wrappers in their modules on entry and put back on exit, so code
+    outside the block runs the untouched functions at no cost. The fused `compile_system` kernel has no organ
+    functions to time, use `system` as the right hand side inside the block (`simulate` does so when given
+    a profile).
+    """
+    patched = []
+    try:
+        for module, name, organ_module in __ORGANS:
+            patched.append(__patch(module, name, name.lstrip("_"), profile))
+            if profile.subprocesses:
+                for sub in __subprocesses(organ_module, entry=name):
+                    patched.append(__patch(organ_module, sub, f"{name.lstrip('_')}.{sub.lstrip('_')}", profile))
+        yield profile
+    finally:
+        for module, name, original in reversed(patched):
+            setattr(module, name, original)
+
+def __subprocesses(module, entry):
+    return [
+        name for name, value in vars(module).items()
+        if isinstance(value, FunctionType) and value.__module__ == module.__name__
+        and name.startswith("__") and not name.endswith("__") and name != entry
+    ]
+
+def __patch(module, name, label, profile):
+    original = getattr(module, name)
+    perf_counter = time.perf_counter
+
+    def timed(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            profile.record(label, perf_counter() - start)
+
+    setattr(module, name, timed)
+    return module, name, original
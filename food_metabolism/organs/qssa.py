@@ -0,0 +1,276 @@
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.linalg import null_space
+
+from .parameters import *
+from .index import Index
+from .stoichiometry import reaction_network
+from .subsystem import subsystem
+from .conservation import _row_echelon
+
+# the muscle redox cofactors, whose mass-action terms (NAD**3, NADH**2 * ATP**3) are the usual candidates
+REDOX_STATES = (Index.muscle_NAD, Index.muscle_NADH, Index.muscle_FAD, Index.muscle_FADH2)
+
+@dataclass(frozen=True, slots=True)
+class QuasiSteadyState:
+    """
+    Data class replacing the ODEs of a set of fast states by algebraic constraints, see `qssa_reduction`.
+
+    The vector it reduces is the one a solver would integrate otherwise (`base` positions of the full
+    state). Its slow entries are integrated; the fast entries are solved from dydt[fast] = 0 at every
+    evaluation, except that the pools the fast states conserve among themselves (NAD + NADH when both are
+    fast) keep their totals, which the fast equations alone leave undetermined.
+
+    Attributes:
+        fast (tuple[Index, ...]): The fast states, in `Index` order.
+        base (np.ndarray): Positions of the base vector in the full state vector.
+        fast_positions (np.ndarray): Positions (into the base vector) of the fast states.
+        slow_positions (np.ndarray): Positions of the integrated states.
+        pools (np.ndarray): The conserved pools of the fast states as rows over them, shape
+                            (len(pivots), len(fast)).
+        pivots (np.ndarray): Positions (into `fast`) of the equations replaced by a pool total.
+        equations (np.ndarray): Positions (into `fast`) of the equations dydt = 0 that are kept.
+    """
+    fast          : tuple
+    base          : np.ndarray
+    fast_positions: np.ndarray
+    slow_positions: np.ndarray
+    pools         : np.ndarray
+    pivots        : np.ndarray
+    equations     : np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.slow_positions)
+
+    @property
+    def names(self) -> tuple:
+        return tuple(state.name for state in self.fast)
+
+    def reduce(self, z: np.ndarray) -> np.ndarray:
+        """
+        Returns the slow entries of the base vector(s) `z`.
+        """
+        return np.asarray(z)[self.slow_positions]
+
+    def totals(self, z: np.ndarray) -> np.ndarray:
+        """
+        Returns the totals of the fast pools for the base vector `z`.
+        """
+        return self.pools @ np.asarray(z)[self.fast_positions]
+
+    def solve(self, fun, jac, t: float, z: np.ndarray, totals: np.ndarray, tol: float = 1e-10,
+              max_iterations: int = 50) -> np.ndarray:
+        """
+        Solves for the fast entries by Newton iterations started from those of `z`.
+
+        Attributes:
+            fun (Callable): `fun(t, z)` returning the derivative of the base vector.
+            jac (Callable): `jac(t, z)` returning its dense Jacobian.
+            t (float): The time.
+            z (np.ndarray): The base vector with the slow entries set, its fast entries are the initial guess.
+            totals (np.ndarray): The totals of the fast pools.
+            tol (float): Relative tolerance on the Newton step, and absolute tolerance on the residual.
+            max_iterations (int): Limit on the number of Newton steps.
+
+        Returns:
+            z (np.ndarray): A copy of `z` with the fast entries on the slow manifold.
+        """
+        z = np.array(z, dtype=float)
+        fast = self.fast_positions
+        for _ in range(max_iterations):
+            residual, A = self.__system(fun(t, z), jac(t, z), z, totals)
+            # a fast state driven to zero by a quadratic sink (e.g. NADH by the ETC) converges only
+            # linearly in the step, while its residual is already negligible
+            if np.all(np.abs(residual) <= tol):
+                return z
+            try:
+                step = np.linalg.solve(A, -residual)
+            except np.linalg.LinAlgError:
+                raise self.__singular(f"at t={t}") from None
+            # the steps are not kept non-negative: trial points of the solver can have negative slow
+            # states (as the full model can), and the quasi-steady state there is negative as well
+            z[fast] += step
+            if np.all(np.abs(step) <= tol * (np.abs(z[fast]) + tol)):
+                return z
+        raise RuntimeError(f"the quasi-steady state of {self.names} did not converge at t={t}")
+
+    def jacobian(self, J: np.ndarray) -> np.ndarray:
+        """
+        Returns the Jacobian of the slow derivatives with respect to the slow entries, from the base
+        Jacobian `J` on the slow manifold: J_ss - J_sf A^-1 B with A and B the derivatives of the
+        constraints with respect to the fast and slow entries.
+        """
+        fast, slow = self.fast_positions, self.slow_positions
+        A = self.__constraint_jacobian(J)
+        B = np.zeros((len(fast), len(slow)))
+        B[self.equations] = J[np.ix_(fast[self.equations], slow)]
+        try:
+            return J[np.ix_(slow, slow)] - J[np.ix_(slow, fast)] @ np.linalg.solve(A, B)
+        except np.linalg.LinAlgError:
+            raise self.__singular("for this Jacobian") from None
+
+    def __singular(self, where):
+        return ValueError(
+            f"the quasi-steady state of {self.names} is singular {where}, the fast equations do not "
+            f"determine the fast states"
+        )
+
+    def __system(self, f, J, z, totals):
+        residual = np.empty(len(self.fast_positions))
+        residual[self.equations] = f[self.fast_positions[self.equations]]
+        residual[self.pivots] = self.pools @ z[self.fast_positions] - totals
+        return residual, self.__constraint_jacobian(J)
+
+    def __constraint_jacobian(self, J):
+        fast = self.fast_positions
+        A = np.empty((len(fast), len(fast)))
+        A[self.equations] = J[np.ix_(fast[self.equations], fast)]
+        A[self.pivots] = self.pools
+        return A
+
+@dataclass(frozen=True, slots=True)
+class QSSAComparison:
+    """
+    Data class comparing a quasi-steady-state run with the full model, see `compare_qssa`.
+
+    Attributes:
+        fast (tuple[Index, ...]): The states treated as fast.
+        t (np.ndarray): The common time points, shape (T,).
+        full (SimulationResult): The run of the full model.
+        reduced (SimulationResult): The run with the fast states on their quasi-steady state.
+        error (np.ndarray): Largest absolute difference of every state over `t`, shape (len(Index),).
+        relative_error (np.ndarray): `error` relative to the largest magnitude of the state in the full run.
+        separation (float): Ratio of the fastest slow rate to the slowest fast rate at the initial state
+                            (see `timescale_separation`), the first order size of the QSSA error.
+        full_time (float): Seconds of the full run.
+        reduced_time (float): Seconds of the quasi-steady-state run.
+    """
+    fast          : tuple
+    t             : np.ndarray
+    full          : object
+    reduced       : object
+    error         : np.ndarray
+    relative_error: np.ndarray
+    separation    : float
+    full_time     : float
+    reduced_time  : float
+
+    @property
+    def speedup(self) -> float:
+        return self.full_time / self.reduced_time
+
+    def worst(self, count: int = 5) -> tuple:
+        """
+        Returns the `count` slow states with the largest relative error, as (name, relative error) pairs.
+        """
+        fast = set(int(state) for state in self.fast)
+        order = [int(i) for i in np.argsort(-self.relative_error) if int(i) not in fast]
+        return tuple((Index(i).name, float(self.relative_error[i])) for i in order[:count])
+
+def qssa_reduction(p: Parameters, fast: tuple = REDOX_STATES, base: np.ndarray = None,
+                   organs: tuple = None, tol: float = 1e-9) -> QuasiSteadyState:
+    """
+    Builds the quasi-steady-state approximation of the model for a set of fast states.
+
+    Attributes:
+        p (Parameters): The parameters of the organs.
+        fast (tuple): `Index` members or names of the states to treat as fast.
+        base (np.ndarray): Positions of the integrated vector in the full state vector, by default all of
+                           `Index` (the full model), or `subsystem(p).indices` for a single organ preset.
+        organs (tuple): Organs of the model, by default the active organs of the preset (see `subsystem`).
+        tol (float): Pool weights below this are treated as zero.
+
+    Returns:
+        reduction (QuasiSteadyState): The fast and slow positions and the pools of the fast states.
+    """
+    fast = tuple(sorted(set(Index[getattr(state, "name", state)] for state in fast)))
+    if not fast:
+        raise ValueError("no fast states given")
+    reduced = subsystem(p, organs)
+    base = np.arange(len(Index)) if base is None else np.asarray(base, dtype=np.intp)
+    S = reaction_network(reduced.parameters, reduced.organs).S
+    unchanged = [state.name for state in fast if int(state) not in base or S[int(state)].getnnz() == 0]
+    if unchanged:
+        raise ValueError(f"{unchanged} are not changed by the model, they cannot be fast")
+
+    # pools of the fast states alone are conserved by every reaction, so dydt[fast] = 0 leaves them free
+    S_fast = S[[int(state) for state in fast]].toarray()
+    pools = _row_echelon(null_space(S_fast.T).T, tol)
+    pivots = np.array([np.flatnonzero(np.abs(row) > tol)[0] for row in pools], dtype=np.intp)
+
+    position = {int(state): k for k, state in enumerate(base)}
+    fast_positions = np.array([position[int(state)] for state in fast], dtype=np.intp)
+    return QuasiSteadyState(
+        fast=fast,
+        base=base,
+        fast_positions=fast_positions,
+        slow_positions=np.setdiff1d(np.arange(len(base)), fast_positions),
+        pools=pools.reshape(len(pivots), len(fast)),
+        pivots=pivots,
+        equations=np.setdiff1d(np.arange(len(fast)), pivots),
+    )
+
+def timescale_separation(p: Parameters, y: np.ndarray, fast: tuple = REDOX_STATES) -> float:
+    """
+    Estimates how well `fast` separates from the other states at the full state `y`: the largest rate
+    |Re λ| of the reduced slow Jacobian over the smallest rate of the fast block (leaving out its conserved
+    pools). The QSSA error is of first order in this ratio, values well below one justify the reduction.
+    """
+    reduced = subsystem(p)
+    reduction = qssa_reduction(p, fast, base=reduced.indices)
+    J = reduced.jac(0.0, reduced.restrict(np.asarray(y, dtype=float)))
+    J_fast = J[np.ix_(reduction.fast_positions, reduction.fast_positions)]
+    fast_rates = np.abs(np.linalg.eigvals(J_fast).real)
+    # every pool of the fast states is a zero eigenvalue of the fast block
+    fast_rates = np.sort(fast_rates)[len(reduction.pivots):]
+    slow_rates = np.abs(np.linalg.eigvals(reduction.jacobian(J)).real)
+    if len(fast_rates) == 0 or fast_rates[0] == 0:
+        return np.inf
+    return float(slow_rates.max(initial=0.0) / fast_rates[0])
+
+def compare_qssa(p: Parameters, y0, t_span: tuple, fast: tuple = REDOX_STATES, t_eval: np.ndarray = None,
+                 **options) -> QSSAComparison:
+    """
+    Runs `simulate` with and without `fast` on their quasi-steady state and compares the trajectories,
+    the error estimate for choosing the fast states (and larger `max_step`s) of long horizon scenarios.
+
+    Attributes:
+        p (Parameters): The parameters to simulate.
+        y0 (dict | np.ndarray): Initial state, see `simulate.initial_state`.
+        t_span (tuple): The (start, end) time of the simulation.
+        fast (tuple): The states to treat as fast.
+        t_eval (np.ndarray): Time points compared, 201 evenly spaced points over `t_span` by default.
+        options: Further keyword arguments for both `simulate` runs (method, schedule, rtol, ...).
+
+    Returns:
+        comparison (QSSAComparison): Both runs, the errors per state and the wall times.
+    """
+    # simulate imports this module for its `fast` option
+    from .simulate import simulate, initial_state
+
+    if t_eval is None:
+        t_eval = np.linspace(t_span[0], t_span[1], 201)
+    y0 = initial_state(y0)
+    start = time.perf_counter()
+    full = simulate(p, y0, t_span, t_eval=t_eval, **options)
+    full_time = time.perf_counter() - start
+    start = time.perf_counter()
+    reduced = simulate(p, y0, t_span, t_eval=t_eval, fast=fast, **options)
+    reduced_time = time.perf_counter() - start
+
+    stored = min(full.y.shape[1], reduced.y.shape[1])
+    error = np.abs(full.y[:, :stored] - reduced.y[:, :stored]).max(axis=1, initial=0.0)
+    scale = np.abs(full.y[:, :stored]).max(axis=1, initial=0.0)
+    return QSSAComparison(
+        fast=qssa_reduction(p, fast).fast,
+        t=t_eval[:stored],
+        full=full,
+        reduced=reduced,
+        error=error,
+        relative_error=error / np.where(scale > 0, scale, 1.0),
+        separation=timescale_separation(p, y0, fast),
+        full_time=full_time,
+        reduced_time=reduced_time,
+    )
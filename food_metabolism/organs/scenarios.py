@@ -0,0 +1,147 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+from .parameters import *
+from .index import Index
+from .packing import layout, pack, unpack
+from .schedule import Schedule
+from .checkpoint import Checkpoint
+from .simulate import simulate, initial_state
+
+@dataclass(frozen=True, slots=True)
+class Branch:
+    """
+    Data class for an arm of a scenario tree, see `run_scenarios`.
+
+    An arm starts at its parent's branch point from the parent's state, with its own doses and parameter
+    overrides from there on. An arm with `branches` runs until `at` and splits again; its doses after `at` are
+    not given (an infusion running across `at` stops there), the sub-arms carry on.
+
+    Attributes:
+        name (str): Name of the arm, results of sub-arms are named "arm/sub-arm".
+        schedule (Schedule): Doses of the arm, with absolute times.
+        overrides (dict): Dotted parameter names ("M.k_...", "V.plasma") mapped to values, applied on top of the
+                          parent's parameters from the branch point on.
+        at (float): Where the sub-arms split off, needed with `branches`.
+        branches (tuple[Branch, ...]): The sub-arms.
+    """
+    name     : str
+    schedule : Schedule = None
+    overrides: dict = None
+    at       : float = None
+    branches : tuple = ()
+
+def run_scenarios(params: Parameters, y0, t_span: tuple, at: float, branches: tuple, schedule: Schedule = None,
+                  t_eval: np.ndarray = None, method: str = "BDF", workers: int = 1, **options) -> dict:
+    """
+    Simulates a tree of scenarios sharing a prefix: the common lead-in (with `schedule`) runs once from `y0`
+    until `at`, and every arm continues from the state there, so the cost grows with the divergent parts rather
+    than with the number of arms times the whole horizon.
+
+    Every arm's result covers the whole `t_span`, the shared prefix included, and is the one `simulate` returns
+    for a run of the lead-in's doses up to `at` followed by the arm's doses (the solver restarts at `at`, as
+    it does at a dose, see `checkpoint`).
+
+    Attributes:
+        params (Parameters): Parameters of the lead-in.
+        y0 (dict | np.ndarray): Initial state, see `simulate.initial_state`.
+        t_span (tuple): The (start, end) time of every arm.
+        at (float): Where the arms split off the lead-in.
+        branches (tuple[Branch, ...]): The arms.
+        schedule (Schedule): Doses of the lead-in; doses at or after `at` are not given.
+        t_eval (np.ndarray): Times stored for every arm, every accepted step when not given.
+        method (str): The solver, see `simulate.METHODS`.
+        workers (int): Processes the arms fan out to after a branch point; 1 runs them in this process.
+        options: Further keyword arguments for `simulate` (rtol, atol, conserved, ...).
+
+    Returns:
+        results (dict): Arm name mapped to its `SimulationResult`, leaves of the tree only, in tree order.
+    """
+    t_eval = None if t_eval is None else np.asarray(t_eval, dtype=float)
+    root = Branch(name="", schedule=schedule, at=at, branches=tuple(branches))
+    __check(root, float(t_span[0]), float(t_span[1]))
+    start = __start(params, y0, t_span, t_eval, method)
+    prefix = __advance(params, start, root, t_span, t_eval, method, options)
+
+    tasks = [(params, prefix, branch, t_span, t_eval, method, options) for branch in root.branches]
+    if workers == 1 or len(tasks) <= 1:
+        subtrees = [__subtree(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            subtrees = list(pool.map(__subtree, tasks))
+    return {name: result for subtree in subtrees for name, result in subtree.items()}
+
+def override(p: Parameters, overrides: dict) -> Parameters:
+    """
+    Returns `p` with the fields named by dotted names ("M.k_...", "V.plasma") set to the given values.
+    """
+    if not overrides:
+        return p
+    offsets = layout(p).offsets
+    unknown = [name for name in overrides if name not in offsets]
+    if unknown:
+        raise ValueError(f"{unknown} are not fields of the parameters, expected dotted names like 'V.plasma'")
+    x = pack(p)
+    for name, value in overrides.items():
+        x[offsets[name]] = value
+    return unpack(x, layout(p))
+
+def __check(branch, start, stop):
+    if not branch.branches:
+        return
+    if branch.at is None or not start < branch.at < stop:
+        raise ValueError(f"the branch point of {branch.name or 'the lead-in'} must lie inside ({start}, {stop})")
+    names = [child.name for child in branch.branches]
+    if len(set(names)) != len(names):
+        raise ValueError(f"the arms of {branch.name or 'the lead-in'} need distinct names, got {names}")
+    for child in branch.branches:
+        __check(child, branch.at, stop)
+
+def __start(params, y0, t_span, t_eval, method):
+    # the state before anything ran, as the checkpoint every stage resumes from
+    return Checkpoint(
+        t=float(t_span[0]), y=initial_state(y0), step=None, segment=0, t_span=tuple(t_span), method=method,
+        t_eval=t_eval, t_stored=np.empty(0), y_stored=np.empty((len(Index), 0)), parameters=pack(params),
+        groups=layout(params).groups, settings={}, nfev=0, njev=0, nlu=0,
+    )
+
+def __advance(params, resume, branch, t_span, t_eval, method, options):
+    # runs a stage from `resume` until its branch point and returns the checkpoint there
+    until = branch.at
+    if t_eval is None:
+        stage_eval = None
+    else:
+        # the branch point is stored for its state and dropped from the prefix, the arms store it themselves
+        stage_eval = np.append(t_eval[t_eval < until], until)
+    result = simulate(
+        params, resume.y, (t_span[0], until), method=method, t_eval=stage_eval, schedule=branch.schedule,
+        resume=resume, **options,
+    )
+    if result.status < 0:
+        raise RuntimeError(f"the stage of {branch.name or 'the lead-in'} failed: {result.message}")
+    stored = len(result.t) if t_eval is None else len(result.t) - 1
+    segments = 1 if branch.schedule is None else len(branch.schedule.segments(resume.t, until))
+    return Checkpoint(
+        t=float(until), y=np.array(result.y[:, -1]), step=None, segment=resume.segment + segments,
+        t_span=tuple(t_span), method=method, t_eval=t_eval, t_stored=np.array(result.t[:stored]),
+        y_stored=np.array(result.y[:, :stored]), parameters=pack(params), groups=layout(params).groups,
+        settings={}, nfev=result.nfev, njev=result.njev, nlu=result.nlu,
+    )
+
+def __subtree(task):
+    params, resume, branch, t_span, t_eval, method, options = task
+    params = override(params, branch.overrides)
+    if not branch.branches:
+        result = simulate(
+            params, resume.y, t_span, method=method, t_eval=t_eval, schedule=branch.schedule, resume=resume,
+            **options,
+        )
+        return {branch.name: result}
+    checkpoint = __advance(params, resume, branch, t_span, t_eval, method, options)
+    results = {}
+    for child in branch.branches:
+        for name, result in __subtree((params, checkpoint, child, t_span, t_eval, method, options)).items():
+            results[f"{branch.name}/{name}"] = result
+    return results
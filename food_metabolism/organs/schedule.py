@@ -0,0 +1,155 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from .index import Index
+
+@dataclass(frozen=True, slots=True)
+class Bolus:
+    """
+    Data class for an instantaneous dose, e.g. a meal landing in the gut.
+
+    Attributes:
+        time (float): When the dose is given (in the simulation's time units).
+        amounts (dict): `Index` names (or members) mapped to the amount added to that state.
+    """
+    time   : float
+    amounts: dict
+
+@dataclass(frozen=True, slots=True)
+class Infusion:
+    """
+    Data class for a zero-order input running from `start` to `stop`.
+
+    Attributes:
+        start (float): When the infusion starts.
+        stop (float): When the infusion stops.
+        rates (dict): `Index` names (or members) mapped to the rate added to that state's dydt.
+    """
+    start: float
+    stop : float
+    rates: dict
+
+@dataclass(frozen=True, slots=True)
+class Regimen:
+    """
+    Data class repeating a set of doses at a fixed interval, e.g. three meals a day for 30 days.
+
+    Attributes:
+        doses (tuple[Bolus | Infusion, ...]): The doses of one repetition, timed relative to its start.
+        interval (float): Time between the starts of consecutive repetitions.
+        count (int): Number of repetitions.
+        start (float): When the first repetition starts.
+    """
+    doses   : tuple
+    interval: float
+    count   : int
+    start   : float = 0.0
+
+    def expand(self) -> tuple:
+        """
+        Returns every dose of the regimen with absolute times.
+        """
+        expanded = []
+        for k in range(self.count):
+            offset = self.start + k * self.interval
+            for dose in self.doses:
+                if isinstance(dose, Bolus):
+                    expanded.append(Bolus(time=dose.time + offset, amounts=dose.amounts))
+                else:
+                    expanded.append(Infusion(start=dose.start + offset, stop=dose.stop + offset, rates=dose.rates))
+        return tuple(expanded)
+
+@dataclass(frozen=True, slots=True)
+class Segment:
+    """
+    Data class for a stretch of a schedule in which no dose starts or stops, so the model is smooth inside it.
+
+    Attributes:
+        start (float): Start of the segment.
+        stop (float): End of the segment.
+        jump (np.ndarray | None): Sum of the boluses added to the state at `start`, None if there are none.
+        rate (np.ndarray | None): Sum of the infusion rates added to dydt throughout, None if there are none.
+    """
+    start: float
+    stop : float
+    jump : np.ndarray
+    rate : np.ndarray
+
+class Schedule:
+    """
+    A meal and dosing schedule consumed by `simulate(..., schedule=...)`.
+
+    Regimens are expanded into their doses, so a schedule is a flat, time-ordered list of boluses and
+    infusions. The integrator only needs to stop where a bolus is given or an infusion starts or stops;
+    `segments` returns those smooth stretches.
+
+    Attributes:
+        events (Bolus | Infusion | Regimen): The doses making up the schedule.
+    """
+    __slots__ = ("boluses", "infusions")
+
+    def __init__(self, *events):
+        doses = []
+        for event in events:
+            if isinstance(event, Regimen):
+                doses.extend(event.expand())
+            elif isinstance(event, (Bolus, Infusion)):
+                doses.append(event)
+            else:
+                raise TypeError(f"expected Bolus, Infusion or Regimen, got {type(event).__name__}")
+        for dose in doses:
+            if isinstance(dose, Infusion) and dose.stop < dose.start:
+                raise ValueError(f"infusion stops at {dose.stop} before it starts at {dose.start}")
+        self.boluses = tuple(sorted((d for d in doses if isinstance(d, Bolus)), key=lambda d: d.time))
+        self.infusions = tuple(sorted((d for d in doses if isinstance(d, Infusion)), key=lambda d: d.start))
+
+    def __len__(self) -> int:
+        return len(self.boluses) + len(self.infusions)
+
+    def segments(self, t0: float, t_bound: float) -> list:
+        """
+        Splits [t0, t_bound] at every dose time into the smooth stretches the integrator runs through.
+
+        A bolus at t0 is applied to the initial state, boluses at or after t_bound are ignored.
+
+        Returns:
+            segments (list[Segment]): Consecutive segments covering [t0, t_bound].
+        """
+        if t_bound < t0:
+            raise ValueError("schedules can only be simulated forward in time")
+
+        times = {t0, t_bound}
+        times.update(b.time for b in self.boluses if t0 <= b.time < t_bound)
+        for infusion in self.infusions:
+            times.update(t for t in (infusion.start, infusion.stop) if t0 < t < t_bound)
+        times = sorted(times)
+
+        segments = []
+        for start, stop in zip(times[:-1], times[1:]):
+            boluses = [b.amounts for b in self.boluses if b.time == start]
+            infusions = [i.rates for i in self.infusions if i.start <= start < i.stop]
+            segments.append(Segment(
+                start=start,
+                stop=stop,
+                jump=_state_vector(boluses) if boluses else None,
+                rate=_state_vector(infusions) if infusions else None,
+            ))
+        return segments
+
+def _state_vector(dicts):
+    vector = np.zeros(len(Index))
+    for values in dicts:
+        for name, value in values.items():
+            vector[Index[getattr(name, "name", name)]] += value
+    return vector
+
+def meal(time: float, glucose: float = 0.0, fructose: float = 0.0, fattyacid: float = 0.0) -> Bolus:
+    """
+    A meal as a bolus into the gut: glucose and fructose into the gut lumen and fat into the micelles.
+    """
+    return Bolus(time=time, amounts={
+        Index.gut_glucose.name: glucose,
+        Index.gut_fructose.name: fructose,
+        Index.micellar_fattyacid.name: fattyacid,
+    })
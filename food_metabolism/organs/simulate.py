@@ -0,0 +1,682 @@
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.integrate import BDF, DOP853, LSODA, RK23, RK45, Radau
+
+from .parameters import *
+from .index import Index, get_organ_slice
+from .system import system
+from .compiled import compile_system
+from .jacobian import compile_jacobian, jac_sparsity
+from .schedule import Schedule, Segment
+from .profiling import Profile, instrument
+from .subsystem import subsystem
+from .conservation import conserved_reduction
+from .qssa import qssa_reduction
+from .cache import ResultCache, result_key
+from .checkpoint import Checkpoint, Checkpointing, _capture, save_checkpoint
+
+METHODS = {"BDF": BDF, "Radau": Radau, "LSODA": LSODA, "RK45": RK45, "RK23": RK23, "DOP853": DOP853}
+__IMPLICIT = ("BDF", "Radau", "LSODA")
+
+@dataclass(frozen=True, slots=True)
+class OrganView:
+    """
+    Data class giving named access to the states of one organ in a solution, without copying.
+
+    Attributes:
+        names (tuple[str, ...]): The `Index` names of the organ's states, in `Index` order.
+        values (np.ndarray): A view of shape (len(names), len(t)) into the solution.
+
+    `view["muscle_ATP"]` (or `view[Index.muscle_ATP]`) is the time course of one state, again a view.
+    """
+    names : tuple
+    values: np.ndarray
+
+    def __getitem__(self, name) -> np.ndarray:
+        return self.values[self.names.index(getattr(name, "name", name))]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def keys(self) -> tuple:
+        return self.names
+
+@dataclass(slots=True)
+class SimulationResult:
+    """
+    Data class holding a solution of the whole-body model, see `simulate`.
+
+    Attributes:
+        t (np.ndarray): Time points, shape (T,).
+        y (np.ndarray): States, a C-contiguous array of shape (len(Index), T), or the read only, memory-mapped
+                        `trajectory.StateColumns` when `simulate` streamed the run to a `TrajectoryWriter`.
+        parameters (Parameters): The parameters that were simulated.
+        status (int): 0 if the end of `t_span` was reached, -1 if the solver failed.
+        message (str): The solver's termination message.
+        nfev (int): Number of right hand side evaluations.
+        njev (int): Number of Jacobian evaluations.
+        nlu (int): Number of LU decompositions.
+        profile (Profile | None): Timings and solver counters, when `simulate` was given a profile.
+
+    The organ properties (`plasma`, `subq`, `vsc`, `muscle`, `gut`, `liver`) return `OrganView`s onto
+    contiguous blocks of `y`, and `result["plasma_glucose"]` returns the row of one state; for a `y` in memory
+    none of them copy. With a sink `y` is a `trajectory.StateColumns`: one state is its memory map without a
+    copy, an organ is read from its states' files into a new array.
+    """
+    t         : np.ndarray
+    y         : np.ndarray
+    parameters: Parameters
+    status    : int
+    message   : str
+    nfev      : int
+    njev      : int
+    nlu       : int
+    profile   : Profile = None
+
+    @property
+    def success(self) -> bool:
+        return self.status >= 0
+
+    def __getitem__(self, name) -> np.ndarray:
+        return self.y[Index[getattr(name, "name", name)]]
+
+    def organ(self, organ: str) -> OrganView:
+        """
+        Returns the states of `organ` ("plasma", "subq", "vsc", "muscle", "gut" or "liver"), a view of `y`
+        when it is in memory.
+        """
+        block = get_organ_slice(organ)
+        return OrganView(
+            names=tuple(index.name for index in tuple(Index)[block]),
+            values=self.y[block],
+        )
+
+    @property
+    def plasma(self) -> OrganView:
+        return self.organ("plasma")
+
+    @property
+    def subq(self) -> OrganView:
+        return self.organ("subq")
+
+    @property
+    def vsc(self) -> OrganView:
+        return self.organ("vsc")
+
+    @property
+    def muscle(self) -> OrganView:
+        return self.organ("muscle")
+
+    @property
+    def gut(self) -> OrganView:
+        return self.organ("gut")
+
+    @property
+    def liver(self) -> OrganView:
+        return self.organ("liver")
+
+def initial_state(values) -> np.ndarray:
+    """
+    Builds a state vector from initial values keyed by state.
+
+    Attributes:
+        values (dict | np.ndarray): Mapping of `Index` members or their names to initial values, states that
+                                    are not listed start at zero. An array of length len(Index) is copied as is.
+
+    Returns:
+        y0 (np.ndarray): The state vector, shape (len(Index),).
+    """
+    if not isinstance(values, dict):
+        y0 = np.array(values, dtype=float)
+        if y0.shape != (len(Index),):
+            raise ValueError(f"expected {len(Index)} initial values, got shape {y0.shape}")
+        return y0
+
+    y0 = np.zeros(len(Index))
+    for name, value in values.items():
+        y0[Index[getattr(name, "name", name)]] = value
+    return y0
+
+def simulate(
+    params: Parameters,
+    y0,
+    t_span: tuple,
+    method: str = "BDF",
+    t_eval: np.ndarray = None,
+    rhs=None,
+    jac=None,
+    schedule: Schedule = None,
+    profile: Profile = None,
+    conserved: bool = False,
+    fast: tuple = None,
+    cache: ResultCache = None,
+    sink=None,
+    checkpoint: Checkpointing = None,
+    resume: Checkpoint = None,
+    **options,
+) -> SimulationResult:
+    """
+    Integrates the whole-body model from `y0` over `t_span`.
+
+    With the default hooks the fused kernel from `compile_system` is the right hand side and, for the
+    implicit methods, the analytic `compile_jacobian` is the Jacobian. Presets that leave organs out
+    (`giInit`, `muscle_init`, ...) integrate only the states their organs touch, see `subsystem`; the other
+    states keep their initial value (plus any infusion into them).
+
+    A `schedule` is consumed natively: the run is split where a bolus is given or an infusion starts or
+    stops, and each stretch restarts the solver from the post-dose state with the same compiled right hand
+    side and analytic Jacobian, instead of a fresh `solve_ivp` that rebuilds everything.
+    The stored solution has two points at a bolus time, the state before and after the dose.
+
+    Attributes:
+        params (Parameters): The parameters to simulate.
+        y0 (dict | np.ndarray): Initial state, see `initial_state`.
+        t_span (tuple): The (start, end) time of the simulation.
+        method (str): One of `METHODS`.
+        t_eval (np.ndarray): Times at which to store the solution, interpolated from the solver's dense
+                             output. Every accepted step is stored when not given.
+        rhs (Callable): `rhs(t, y, p)` overriding the right hand side, e.g. `organs.gi.GI`.
+        jac (Callable | bool): `jac(t, y)` overriding the Jacobian, or False to let the solver estimate it by
+                               finite differences (with the sparsity of `jac_sparsity` for the full model).
+        schedule (Schedule): Meals and doses given during the simulation.
+        profile (Profile): Collects per organ timings, solver counters and accepted and rejected steps. The
+                           right hand side is then the per-organ `system` (which gives bit-for-bit the same
+                           result as the fused kernel of the full model, and the presets' reduced right hand
+                           side up to rounding), so organ time can be attributed. Without a profile nothing
+                           is instrumented.
+        conserved (bool): Integrate only the independent states: the dependent state of every conservation
+                          law (e.g. muscle_NAD of NAD + NADH) is rebuilt from the law's total and states
+                          nothing changes are held, see `conservation.conserved_reduction`. Only for the
+                          model's own right hand side.
+        fast (tuple): `Index` members or names of states to put on their quasi-steady state, e.g.
+                      `qssa.REDOX_STATES`: their ODEs are replaced by dydt = 0 (pools they conserve among
+                      themselves keep their totals), solved by Newton's method at every evaluation, and only
+                      the other states are integrated, see `qssa.qssa_reduction`. The stored initial state is
+                      `y0` as given, the fast states are on the quasi-steady state from the first step on.
+                      Raises ValueError when the fast equations cannot be solved at the start of the run.
+                      Each evaluation pays a Newton solve, so check the cost and error with
+                      `qssa.compare_qssa` first: the redox states are about 10x slower than the full model.
+                      Only for the model's own right hand side, and not together with `conserved`.
+        cache (ResultCache): On-disk cache to look the run up in before integrating, keyed by `cache.result_key`
+                             of everything that changes the result. Successful runs are stored in it. Only for
+                             the model's own right hand side and Jacobian, and not with a profile.
+        sink (TrajectoryWriter): Streams the stored time points to disk as they are computed instead of keeping
+                                 them in memory, so memory stays constant in the length of the run; the result's
+                                 `t` is then a read only memory map and `y` the `trajectory.StateColumns` of the
+                                 written trajectory, one memory map per state. Any object
+                                 with `append(t, y)` (states of shape (len(Index), k)) and `view()` returning
+                                 (t, y) works. One run per sink, and not together with `cache`.
+        checkpoint (Checkpointing): Writes checkpoints of the run to a file, from which `checkpoint.restart`
+                                    resumes it bit-for-bit. With `every` the run is also split at every
+                                    multiple of it from t_span[0], where the solver restarts as at a dose.
+                                    Raises ValueError when the run has nowhere to checkpoint (no schedule
+                                    and no `every`). Only for the model's own right hand side and
+                                    Jacobian, with scalar or array solver options, and not together with a
+                                    profile, a sink or a cache.
+        resume (Checkpoint): Continues the run from a checkpoint, see `checkpoint.restart`, which passes the
+                             run's settings along with it. `y0` is then ignored.
+        options: Further keyword arguments for the solver (rtol, atol, max_step, first_step, ...).
+
+    Returns:
+        result (SimulationResult): The solution with organ-named views.
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown method {method!r}, expected one of {tuple(METHODS)}")
+    settings = None
+    if checkpoint is not None or resume is not None:
+        settings = __checkpoint_settings(rhs, jac, profile, sink, cache, checkpoint, resume, conserved, fast, options)
+    if cache is not None:
+        key = __cache_key(params, y0, t_span, method, t_eval, rhs, jac, schedule, profile, sink, conserved, fast,
+                          options)
+        hit = cache.get(key)
+        if hit is not None:
+            return SimulationResult(parameters=params, **hit)
+
+    fun, jac_options, reduced = __hooks(params, method, rhs, jac, fused=profile is None)
+    members = slice(None) if reduced is None else reduced.indices
+    conserved, quasi, model_jac = __reductions(params, rhs, conserved, fast, reduced)
+    fun, attempts = __profiled(fun, method, profile)
+    t0, t_bound = float(t_span[0]), float(t_span[1])
+    direction = 1.0 if t_bound >= t0 else -1.0
+    # a resumed run continues with the segments from the checkpoint on, which are those of the whole run
+    start = t0 if resume is None else resume.t
+    y = initial_state(y0) if resume is None else np.array(resume.y, dtype=float)
+    segments = __segments(schedule, t0, start, t_bound, direction, checkpoint, settings)
+    storage = __storage(t_eval, t0, t_bound, direction, sink, resume)
+
+    status, message = 0, "The solver successfully reached the end of the integration interval."
+    nfev, njev, nlu = (0, 0, 0) if resume is None else (resume.nfev, resume.njev, resume.nlu)
+    # the first step size is the run's, a resumed run starts its segment afresh as at any split
+    first_step = options.pop("first_step", None)
+    if resume is not None:
+        first_step = None
+    completed = 0 if resume is None else resume.segment
+    last_step, checkpointed, wall = None, start, time.perf_counter()
+    with instrument(profile) if profile is not None else nullcontext():
+        for segment in segments:
+            if checkpoint is not None and segment.start != start and __due(checkpoint, segment.start - checkpointed,
+                                                                          direction, wall):
+                save_checkpoint(_capture(
+                    params, t_span, method, storage.t_eval, settings, completed, segment.start, y, last_step,
+                    storage.stored_points(), (nfev, njev, nlu),
+                ), checkpoint.path)
+                checkpointed, wall = segment.start, time.perf_counter()
+            if segment.jump is not None:
+                y = y + segment.jump
+            storage.dose(segment.start, y, segment.jump is not None)
+            problem = __segment_problem(fun, jac_options, conserved, quasi, model_jac, segment, y, members, reduced)
+            solver, y, failure = __solve_segment(
+                method, problem, segment, y, members, first_step, options, storage, profile, attempts, direction
+            )
+            first_step = None
+            nfev, njev, nlu = nfev + int(solver.nfev), njev + int(solver.njev), nlu + int(solver.nlu)
+            last_step = solver.step_size
+            completed += 1
+            if failure is not None:
+                status, message = -1, failure
+                break
+
+    t, y = storage.finish(t0, y, status)
+    result = SimulationResult(
+        t=t,
+        # the memory maps of a sink are not copied into memory
+        y=np.ascontiguousarray(y) if sink is None else y,
+        parameters=params,
+        status=status,
+        message=message,
+        nfev=nfev,
+        njev=njev,
+        nlu=nlu,
+        profile=profile,
+    )
+    if cache is not None and status == 0:
+        cache.put(key, result)
+    return result
+
+@dataclass(slots=True)
+class _Storage:
+    """
+    The stored points of a `simulate` run: every accepted step (`t_eval` None) or the `t_eval` points
+    interpolated from the dense output, kept in memory or appended to a sink. `stored` counts the points kept so
+    far, `ts` and `ys` hold them in memory (`ys` is preallocated for `t_eval`).
+    """
+    t_eval   : np.ndarray
+    sink     : object
+    direction: float
+    ts       : list
+    ys       : object
+    stored   : int = 0
+
+    def dose(self, t: float, y: np.ndarray, dosed: bool):
+        # the state at the start of a segment, stored at a bolus (and first), included at t_eval points up to t
+        if self.t_eval is None:
+            if not self.stored or dosed:
+                self._append(t, y)
+            return
+        # doses given at a stored time are included in the stored state
+        end = np.searchsorted(self.direction * self.t_eval, self.direction * t, side="right")
+        self._fill(end, y[:, None])
+
+    def step(self, solver, expand):
+        # the state after an accepted step, or the t_eval points it passed, in full states by `expand(x, t)`
+        if self.t_eval is None:
+            self._append(solver.t, expand(solver.y, solver.t))
+            return
+        end = np.searchsorted(self.direction * self.t_eval, self.direction * solver.t, side="left")
+        if end > self.stored:
+            times = self.t_eval[self.stored:end]
+            self._fill(end, expand(solver.dense_output()(times), times))
+
+    def finish(self, t0: float, y: np.ndarray, status: int) -> tuple:
+        # the last state completes the stored points, returns (t, y) of the result
+        if self.t_eval is None and not self.stored:
+            self._append(t0, y)
+        elif self.t_eval is not None and status == 0:
+            self._fill(len(self.t_eval), y[:, None])
+        if self.sink is not None:
+            return self.sink.view()
+        if self.t_eval is None:
+            return np.array(self.ts), np.stack(self.ys, axis=1)
+        return self.t_eval[:self.stored], self.ys[:, :self.stored]
+
+    def stored_points(self) -> tuple:
+        # (t, y) of the points stored so far, for a checkpoint
+        if self.t_eval is not None:
+            return self.t_eval[:self.stored], self.ys[:, :self.stored]
+        return self.ts, np.stack(self.ys, axis=1) if self.ys else np.empty((len(Index), 0))
+
+    def _append(self, t, y):
+        if self.sink is None:
+            self.ts.append(t)
+            self.ys.append(y)
+        else:
+            self.sink.append(t, y)
+        self.stored += 1
+
+    def _fill(self, end, values):
+        if self.sink is None:
+            self.ys[:, self.stored:end] = values
+        elif end > self.stored:
+            self.sink.append(self.t_eval[self.stored:end], np.broadcast_to(values, (len(Index), end - self.stored)))
+        self.stored = end
+
+def __storage(t_eval, t0, t_bound, direction, sink, resume):
+    if t_eval is None:
+        storage = _Storage(t_eval=None, sink=sink, direction=direction, ts=[], ys=[])
+        if resume is not None:
+            storage.ts, storage.ys = list(resume.t_stored), list(resume.y_stored.T)
+            storage.stored = len(storage.ts)
+        return storage
+
+    t_eval = np.asarray(t_eval, dtype=float)
+    if np.any(direction * np.diff(t_eval) < 0) or np.any(direction * (t_eval - t0) < 0) \
+            or np.any(direction * (t_eval - t_bound) > 0):
+        raise ValueError("t_eval must be sorted and lie within t_span")
+    ys = np.empty((len(Index), len(t_eval))) if sink is None else None
+    storage = _Storage(t_eval=t_eval, sink=sink, direction=direction, ts=None, ys=ys)
+    if resume is not None:
+        storage.stored = len(resume.t_stored)
+        ys[:, :storage.stored] = resume.y_stored
+    return storage
+
+def __checkpoint_settings(rhs, jac, profile, sink, cache, checkpoint, resume, conserved, fast, options):
+    # validates a checkpointed or resumed run and returns the settings a checkpoint stores
+    if rhs is not None or callable(jac):
+        raise ValueError("checkpointed runs need the model's own right hand side and Jacobian")
+    if profile is not None or sink is not None or cache is not None:
+        raise ValueError("checkpointed runs cannot be profiled, streamed to a sink or cached")
+    if checkpoint is not None and checkpoint.every is not None and not checkpoint.every > 0:
+        raise ValueError("the simulated time between checkpoints must be positive")
+    # a resumed run is split where the run it continues was, whatever it checkpoints itself
+    every = resume.settings.get("every") if resume is not None else getattr(checkpoint, "every", None)
+    settings = dict(
+        jac=jac, conserved=bool(conserved), every=every,
+        fast=None if fast is None else [Index[getattr(state, "name", state)].name for state in fast],
+        **{key: value for key, value in options.items() if key != "first_step"},
+    )
+    unsupported = [key for key, value in settings.items()
+                   if not isinstance(value, (type(None), bool, int, float, str, list, np.ndarray))]
+    if unsupported:
+        raise ValueError(f"the options {unsupported} cannot be stored in a checkpoint")
+    return settings
+
+def __cache_key(params, y0, t_span, method, t_eval, rhs, jac, schedule, profile, sink, conserved, fast, options):
+    if rhs is not None or callable(jac):
+        raise ValueError("cached runs need the model's own right hand side and Jacobian")
+    if profile is not None:
+        raise ValueError("cached runs cannot be profiled, a hit does not integrate")
+    if sink is not None:
+        raise ValueError("cached runs cannot be streamed to a sink, a hit is read from the cache")
+    return result_key(
+        params, initial_state(y0), t_span, schedule, method=method,
+        t_eval=None if t_eval is None else np.asarray(t_eval, dtype=float), jac=jac, conserved=bool(conserved),
+        fast=None if fast is None else sorted(int(Index[getattr(state, "name", state)]) for state in fast),
+        options=options,
+    )
+
+def __reductions(params, rhs, conserved, fast, reduced):
+    # the conservation laws or quasi-steady state to integrate on, and the Jacobian the Newton solves use
+    base = None if reduced is None else reduced.indices
+    if conserved:
+        if rhs is not None:
+            raise ValueError("conserved=True needs the model's own right hand side, the laws of rhs are unknown")
+        conserved = conserved_reduction(params, base=base)
+    if fast is None:
+        return conserved, None, None
+    if rhs is not None:
+        raise ValueError("fast states need the model's own right hand side")
+    if conserved:
+        raise ValueError("fast states cannot be combined with conserved=True, pools of fast states are kept")
+    model_jac = compile_jacobian(params) if reduced is None else reduced.jac
+    return conserved, qssa_reduction(params, fast, base=base), model_jac
+
+def __profiled(fun, method, profile):
+    # records the times the solver evaluates `fun` at, from which rejected steps are counted
+    if profile is None:
+        return fun, None
+    trial_times = []
+    times_per_attempt = __times_per_attempt(method)
+    if times_per_attempt is not None and profile.rejected_steps is None:
+        profile.rejected_steps = 0
+    return __recording(fun, trial_times), (trial_times, times_per_attempt)
+
+def __segments(schedule, t0, start, t_bound, direction, checkpoint, settings):
+    if schedule is None:
+        segments = [Segment(start=start, stop=t_bound, jump=None, rate=None)]
+    else:
+        segments = schedule.segments(start, t_bound)
+    if settings is None:
+        return segments
+    if settings["every"] is not None:
+        return __split(segments, t0, settings["every"], direction)
+    if checkpoint is not None and len(segments) == 1:
+        raise ValueError(
+            "no checkpoint can be written, the schedule never splits the run: give the checkpoints a "
+            "simulated time `every`"
+        )
+    return segments
+
+def __segment_problem(fun, jac_options, conserved, quasi, model_jac, segment, y, members, reduced):
+    # every segment reuses the rhs and Jacobian built once per run, so a restart costs a couple of rhs
+    # evaluations for the initial step and one analytic Jacobian rather than recompiling the model or
+    # estimating the Jacobian by finite differences
+    segment_fun = fun if segment.rate is None else __with_rate(fun, segment.rate[members])
+    # states outside a reduced subsystem only change through infusions into them
+    outside_rate = segment.rate if reduced is not None else None
+    if quasi is None:
+        problem = __eliminate(conserved, segment_fun, jac_options, y[members], segment, members)
+    else:
+        problem = __quasi_steady(quasi, model_jac, segment_fun, jac_options, y[members], segment, members)
+    return problem + (outside_rate,)
+
+def __solve_segment(method, problem, segment, y, members, first_step, options, storage, profile, attempts,
+                    direction):
+    # integrates one segment, storing its steps; returns the solver, the state at its end and the failure message
+    segment_fun, segment_jac, x0, to_base, outside_rate = problem
+
+    def expand(x, t):
+        return __full_state(to_base(x, t), y if np.ndim(t) == 0 else y[:, None], members, outside_rate,
+                            t - segment.start)
+
+    solver = METHODS[method](
+        segment_fun, segment.start, x0, segment.stop, first_step=first_step, **segment_jac, **options
+    )
+    failure = None
+    while solver.status == "running":
+        message = solver.step() if profile is None else __profiled_step(solver, profile, attempts, direction)
+        if solver.status == "failed":
+            failure = message
+            break
+        storage.step(solver, expand)
+    if profile is not None:
+        profile.rhs_evaluations += int(solver.nfev)
+        profile.jacobian_evaluations += int(solver.njev)
+        profile.lu_decompositions += int(solver.nlu)
+    return solver, expand(solver.y, solver.t), failure
+
+def __split(segments, t0, every, direction):
+    # cuts the segments at t0 + k * every, on a grid a resumed run shares, so checkpoints are due however
+    # sparse the schedule is; the pieces keep the segment's infusions, its bolus stays with the first
+    pieces = []
+    for segment in segments:
+        first = np.floor(direction * (segment.start - t0) / every) + 1
+        last = np.ceil(direction * (segment.stop - t0) / every) - 1
+        cuts = [t for t in t0 + direction * every * np.arange(first, last + 1)
+                if direction * (t - segment.start) > 0 and direction * (segment.stop - t) > 0]
+        for start, stop in zip([segment.start] + cuts, cuts + [segment.stop]):
+            pieces.append(Segment(
+                start=float(start), stop=float(stop), jump=segment.jump if start == segment.start else None,
+                rate=segment.rate,
+            ))
+    return pieces
+
+def __due(checkpoint, elapsed, direction, wall):
+    # grid points are rounded, so one `every` apart may be a hair short of it
+    if checkpoint.every is not None and direction * elapsed >= checkpoint.every * (1 - 1e-9):
+        return True
+    return checkpoint.seconds is not None and time.perf_counter() - wall >= checkpoint.seconds
+
+def __recording(fun, trial_times):
+    def recorded(t, y):
+        trial_times.append(t)
+        return fun(t, y)
+    return recorded
+
+def __times_per_attempt(method):
+    # distinct times past the current one at which an attempted step evaluates the rhs
+    if method == "BDF":
+        return 1
+    if method == "Radau":
+        return 3
+    if method == "LSODA":
+        return None
+    return len(set(METHODS[method].C[1:].tolist()) | {1.0})
+
+def __profiled_step(solver, profile, attempts, direction):
+    trial_times, times_per_attempt = attempts
+    t_old = solver.t
+    trial_times.clear()
+    message = solver.step()
+    __count_attempts(profile, solver, t_old, trial_times, times_per_attempt, direction)
+    return message
+
+def __count_attempts(profile, solver, t_old, trial_times, times_per_attempt, direction):
+    if solver.status == "failed":
+        return
+    profile.steps += 1
+    if times_per_attempt is not None:
+        trials = len({t for t in trial_times if direction * (t - t_old) > 0})
+        profile.rejected_steps += max(trials // times_per_attempt - 1, 0)
+
+def __with_rate(fun, rate):
+    return lambda t, y: fun(t, y) + rate
+
+def __eliminate(conserved, fun, jac_options, z, segment, members):
+    if not conserved:
+        return fun, jac_options, z, lambda x, t: x
+
+    # infusions move the law totals (and held states) linearly, the reactions leave them unchanged
+    start = segment.start
+    rate = None if segment.rate is None else segment.rate[members]
+    totals = conserved.totals(z)
+    drift = None if rate is None else conserved.matrix @ rate
+    independent, embedding = conserved.independent, conserved.embedding
+
+    def to_base(x, t):
+        if rate is None:
+            return conserved.expand(x, totals, z)
+        elapsed = np.asarray(t) - start
+        return conserved.expand(x, __drifted(totals, drift, elapsed), __drifted(z, rate, elapsed))
+
+    def reduced_fun(t, x):
+        return fun(t, to_base(x, t))[independent]
+
+    if "jac" not in jac_options:
+        return reduced_fun, {}, conserved.reduce(z), to_base
+    jac = jac_options["jac"]
+    reduced_jac = lambda t, x: jac(t, to_base(x, t))[independent] @ embedding
+    return reduced_fun, {"jac": reduced_jac}, conserved.reduce(z), to_base
+
+def __quasi_steady(quasi, model_jac, fun, jac_options, z, segment, members):
+    start = segment.start
+    totals = quasi.totals(z)
+    drift = None if segment.rate is None else quasi.totals(segment.rate[members])
+    slow = quasi.slow_positions
+    try:
+        z = quasi.solve(fun, model_jac, start, z, totals)
+        # the reduced Jacobian needs the same constraint matrix, which the solve skips when z already satisfies it
+        quasi.jacobian(model_jac(start, z))
+    except (ValueError, RuntimeError) as error:
+        reason = "the Newton solve does not converge" if isinstance(error, RuntimeError) else \
+            "the constraint matrix of the fast equations is singular"
+        raise ValueError(
+            f"the fast states {quasi.names} have no quasi-steady state at t={start}: {reason} there (e.g. empty "
+            f"cofactor pools), give them non-zero initial values or choose other fast states"
+        ) from None
+    # the last solution seeds the next Newton solve, and the rhs and Jacobian at one point share it
+    last = {"t": None, "x": None, "z": z, "jac": None}
+
+    def on_manifold(x, t):
+        if t == last["t"] and np.array_equal(x, last["x"]):
+            return last["z"]
+        guess = last["z"].copy()
+        guess[slow] = x
+        pools = totals if drift is None else totals + drift * (t - start)
+        try:
+            solved = quasi.solve(fun, model_jac, t, guess, pools)
+        except (ValueError, RuntimeError):
+            # no quasi-steady state near a trial point of the solver (singular or not converging), the nan
+            # derivative rejects the step
+            guess[quasi.fast_positions] = np.nan
+            return guess
+        last.update(t=t, x=np.array(x), z=solved)
+        return solved
+
+    def to_base(x, t):
+        x = np.asarray(x)
+        if x.ndim == 1:
+            return on_manifold(x, t).copy()
+        return np.stack([on_manifold(x[:, k], t[k]) for k in range(x.shape[1])], axis=1)
+
+    def reduced_fun(t, x):
+        return fun(t, on_manifold(x, t))[slow]
+
+    def reduced_jac(t, x):
+        z = on_manifold(x, t)
+        try:
+            if np.isnan(z).any():
+                raise ValueError("no quasi-steady state")
+            last["jac"] = quasi.jacobian(model_jac(t, z))
+        except ValueError:
+            # only the iteration matrix: keep the last one, the nan derivative rejects the step
+            if last["jac"] is None:
+                raise
+        return last["jac"]
+
+    if "jac" not in jac_options:
+        return reduced_fun, {}, quasi.reduce(z), to_base
+    return reduced_fun, {"jac": reduced_jac}, quasi.reduce(z), to_base
+
+def __drifted(value, rate, elapsed):
+    return np.reshape(value, np.shape(value) + (1,) * np.ndim(elapsed)) + np.multiply.outer(rate, elapsed)
+
+def __full_state(x, y, members, outside_rate, elapsed):
+    if outside_rate is None:
+        full = np.array(np.broadcast_to(y, (len(y),) + np.shape(x)[1:]))
+    else:
+        full = y + np.multiply.outer(outside_rate, elapsed)
+    full[members] = x
+    return full
+
+def __hooks(p, method, rhs, jac, fused=True):
+    full = p.M is not None and p.Subq is not None and p.Vsc is not None and p.GI is not None and p.Liver is None
+    if rhs is None and not full and p.Liver is None:
+        return __reduced_hooks(p, method, jac, fused)
+    if rhs is not None:
+        fun = lambda t, y: rhs(t, y, p)
+    elif full and fused:
+        fun = compile_system(p)
+    else:
+        fun = lambda t, y: system(t, y, p)
+
+    if method not in __IMPLICIT:
+        return fun, {}, None
+    if callable(jac):
+        return fun, {"jac": jac}, None
+    if rhs is not None or not full:
+        return fun, {}, None
+    if jac is None:
+        return fun, {"jac": compile_jacobian(p)}, None
+    return fun, ({"jac_sparsity": jac_sparsity()} if method != "LSODA" else {}), None
+
+def __reduced_hooks(p, method, jac, fused):
+    reduced = subsystem(p, fused=fused)
+    if method not in __IMPLICIT or jac is False:
+        return reduced.rhs, {}, reduced
+    if callable(jac):
+        block = np.ix_(reduced.indices, reduced.indices)
+        return reduced.rhs, {"jac": lambda t, x: np.asarray(jac(t, reduced.expand(x)))[block]}, reduced
+    return reduced.rhs, {"jac": reduced.jac}, reduced
@@ -0,0 +1,193 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from .parameters import *
+from .index import Index
+from .system import system
+from .compiled import compile_system
+from .jacobian import ORGANS, compile_jacobian, jac_sparsity
+from .packing import fingerprint
+from .simulate import initial_state
+
+@dataclass(frozen=True, slots=True)
+class SteadyState:
+    """
+    Data class holding an equilibrium of the model, see `steady_state`.
+
+    Attributes:
+        y (np.ndarray): The equilibrium state, shape (len(Index),). Read only, it may be shared through the cache.
+        solved (np.ndarray): Boolean mask of the states that were solved for. The others (states nothing
+                             reads, like glucagon, somatostatin and ROS, which only accumulate) keep
+                             their initial value.
+        residual (float): Largest |dydt| over the solved states at `y`.
+        iterations (int): Number of linear solves.
+        method (str): "newton" if Newton's method converged on its own, "pseudo-transient" if it fell back.
+        converged (bool): Whether `residual` reached the tolerance.
+    """
+    y         : np.ndarray
+    solved    : np.ndarray
+    residual  : float
+    iterations: int
+    method    : str
+    converged : bool
+
+__cache = OrderedDict()
+__CACHE_SIZE = 128
+
+# largest pseudo time step, large enough to act as Newton's method while keeping the matrix regular
+# along conserved directions (muscle NAD + NADH, FAD + FADH2) so their totals stay put
+__DT_MAX = 1e6
+# relative undershoot below zero still treated as rounding
+__NEGATIVE = 1e-6
+
+def steady_state(
+    params: Parameters,
+    y0,
+    rhs=None,
+    jac=None,
+    tol: float = 1e-9,
+    max_iterations: int = 200,
+    cache: bool = True,
+) -> SteadyState:
+    """
+    Finds the equilibrium dydt = 0 reached from `y0`, e.g. the fasting baseline of a scenario, without
+    integrating the model for a long time.
+
+    Newton's method is tried first. If a step leaves the admissible region (non-finite or negative states)
+    or stops reducing the residual, the solve restarts from `y0` with pseudo-transient continuation:
+    implicit Euler steps (I / dt - J) dx = f whose pseudo time step dt grows as the residual falls
+    (switched evolution relaxation), which follows the trajectory towards the equilibrium and turns into
+    Newton's method close to it. Both keep conserved totals (e.g. muscle NAD + NADH) at their `y0` values.
+    States that only decay to zero through higher order terms (e.g. NADH through the quadratic ETC flux)
+    approach it algebraically, so at `tol` they can still be clearly above zero.
+
+    Results are memoized by the parameter `fingerprint` and the initial state, so scenario arms sharing a
+    baseline solve it once.
+
+    Attributes:
+        params (Parameters): The parameters to equilibrate.
+        y0 (dict | np.ndarray): Initial state, see `simulate.initial_state`. It picks the equilibrium when
+                                there are several (the conserved totals) and seeds the iteration.
+        rhs (Callable): `rhs(t, y, p)` overriding the right hand side, as in `simulate`.
+        jac (Callable): `jac(t, y)` overriding the Jacobian. The analytic `compile_jacobian` is used for the
+                        full model and a finite difference Jacobian otherwise.
+        tol (float): Absolute tolerance on the largest |dydt| of the solved states.
+        max_iterations (int): Limit on the number of linear solves.
+        cache (bool): Whether to look up and store the result in the memo.
+
+    Returns:
+        equilibrium (SteadyState): The equilibrium and how it was found.
+    """
+    y0 = initial_state(y0)
+    key = (fingerprint(params), y0.tobytes(), rhs, jac, tol, max_iterations)
+    if cache and key in __cache:
+        __cache.move_to_end(key)
+        return __cache[key]
+
+    fun, jacobian, organs = __hooks(params, rhs, jac)
+    sparsity = jac_sparsity(organs).toarray() != 0
+    solved = sparsity.any(axis=0) & sparsity.any(axis=1)
+
+    result = __iterate(fun, jacobian, y0, solved, tol, max_iterations, dt0=__DT_MAX, method="newton")
+    if not result.converged:
+        result = __iterate(fun, jacobian, y0, solved, tol, max_iterations - result.iterations,
+                           dt0=1e-3, method="pseudo-transient", offset=result.iterations)
+
+    result.y.flags.writeable = False
+    if cache:
+        __cache[key] = result
+        if len(__cache) > __CACHE_SIZE:
+            __cache.popitem(last=False)
+    return result
+
+def clear_steady_state_cache():
+    """
+    Empties the memo of `steady_state`.
+    """
+    __cache.clear()
+
+def __hooks(p, rhs, jac):
+    organs = tuple(
+        organ for organ, present in (
+            ("fat", p.Subq is not None and p.Vsc is not None),
+            ("gi", p.GI is not None),
+            ("muscle", p.M is not None),
+            ("pancreas", True),
+        ) if present
+    )
+    full = organs == ORGANS and p.Liver is None
+
+    if rhs is not None:
+        fun = lambda t, y: rhs(t, y, p)
+    elif full:
+        fun = compile_system(p)
+    else:
+        fun = lambda t, y: system(t, y, p)
+
+    if jac is None:
+        jac = compile_jacobian(p) if full and rhs is None else __finite_difference(fun)
+    return fun, jac, organs
+
+def __finite_difference(fun):
+    def jac(t, y):
+        f = fun(t, y)
+        J = np.empty((len(y), len(y)))
+        for j in range(len(y)):
+            h = np.sqrt(np.finfo(float).eps) * max(1.0, abs(y[j]))
+            y_h = y.copy()
+            y_h[j] += h
+            J[:, j] = (fun(t, y_h) - f) / h
+        return J
+    return jac
+
+def __iterate(fun, jac, y0, solved, tol, max_iterations, dt0, method, offset=0):
+    y = y0.copy()
+    f = fun(0.0, y)[solved]
+    residual = np.max(np.abs(f), initial=0.0)
+    dt = dt0
+    identity = np.eye(np.count_nonzero(solved))
+
+    iterations = 0
+    while residual > tol and iterations < max_iterations:
+        iterations += 1
+        J = jac(0.0, y)[np.ix_(solved, solved)]
+        try:
+            dx = np.linalg.solve(identity / dt - J, f)
+        except np.linalg.LinAlgError:
+            dx = np.full_like(f, np.nan)
+
+        y_new = y.copy()
+        y_new[solved] += dx
+        # implicit Euler steps are not positivity preserving, states overshooting zero by rounding are
+        # clipped and real overshoots are rejected
+        scale = 1 + np.max(np.abs(y[solved]), initial=0.0)
+        negative = np.min(y_new[solved], initial=0.0) < -__NEGATIVE * scale
+        admissible = np.all(np.isfinite(y_new)) and not negative
+        if admissible:
+            y_new[solved] = np.maximum(y_new[solved], 0.0)
+            f_new = fun(0.0, y_new)[solved]
+            residual_new = np.max(np.abs(f_new), initial=0.0)
+
+        if method == "newton":
+            if not admissible or not residual_new < residual:
+                break
+        elif not admissible or not residual_new < 10 * residual:
+            dt /= 4
+            continue
+        else:
+            # switched evolution relaxation, dt grows as the residual shrinks, and at least doubles so that
+            # slowly draining stores (adipose TAG) do not hold the pseudo time step back
+            dt = min(dt * max(residual / max(residual_new, np.finfo(float).tiny), 2.0), __DT_MAX)
+
+        y, f, residual = y_new, f_new, residual_new
+
+    return SteadyState(
+        y=y,
+        solved=solved,
+        residual=float(residual),
+        iterations=offset + iterations,
+        method=method,
+        converged=bool(residual <= tol),
+    )
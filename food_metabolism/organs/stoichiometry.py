@@ -0,0 +1,393 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.sparse import csc_matrix, csr_matrix
+
+from .parameters import *
+from .index import Index
+from .jacobian import ORGANS
+from .packing import fingerprint
+from .pancreas import pancreatic_secretion_response_to_Gblood, pancreatic_secretion_response_to_Gblood_array
+from .prepared import prepare
+
+@dataclass(frozen=True, slots=True)
+class Reaction:
+    """
+    Data class for one flux of the model and the states it changes.
+
+    Attributes:
+        name (str): "<compartment>.<flux>", e.g. "muscle.TCA".
+        stoichiometry (tuple[tuple[Index, float], ...]): Change of each state per unit of flux, one column of S.
+                                                        Exchange with plasma is an amount per time, so its
+                                                        coefficients are 1 / volume of each side.
+        reads (tuple[Index, ...]): The states the rate depends on.
+    """
+    name         : str
+    stoichiometry: tuple
+    reads        : tuple
+
+@dataclass(frozen=True, slots=True)
+class ReactionNetwork:
+    """
+    Data class for the model written as dydt = S · v, see `reaction_network`.
+
+    Attributes:
+        reactions (tuple[Reaction, ...]): The fluxes, in the order of the columns of S and the entries of v.
+        S (csr_matrix): Stoichiometric matrix of shape (len(Index), len(reactions)).
+        rates (Callable): `rates(t, y)` returning the flux vector v, shape (len(reactions),), or
+                          (len(reactions), N) for a batch of states of shape (len(Index), N).
+    """
+    reactions: tuple
+    S        : csr_matrix
+    rates    : object
+
+    @property
+    def names(self) -> tuple:
+        return tuple(reaction.name for reaction in self.reactions)
+
+    def rhs(self, t: float, y: np.ndarray) -> np.ndarray:
+        """
+        Returns dydt = S · v(t, y), shape (len(Index),) or (len(Index), N).
+        """
+        return self.S @ self.rates(t, y)
+
+    def reads(self) -> csr_matrix:
+        """
+        Returns the (len(reactions), len(Index)) pattern of the states each rate depends on, the
+        structure of dv/dy.
+        """
+        rows = [r for r, reaction in enumerate(self.reactions) for _ in reaction.reads]
+        cols = [int(state) for reaction in self.reactions for state in reaction.reads]
+        return csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(self.reactions), len(Index)))
+
+    def jac_sparsity(self) -> csc_matrix:
+        """
+        Returns the sparsity pattern of the Jacobian S · dv/dy, ones where J[i, j] can be non-zero.
+        """
+        pattern = (abs(self.S) @ self.reads()) != 0
+        return csc_matrix(pattern.astype(float))
+
+__cache = OrderedDict()
+__CACHE_SIZE = 64
+
+def reaction_network(p: Parameters, organs: tuple = ORGANS) -> ReactionNetwork:
+    """
+    Builds the stoichiometric form of the model: every flux of `organs` declared once as an entry of the
+    rate vector v(t, y) with its column of the sparse stoichiometric matrix S over `Index`.
+
+    The organ modules write out each derivative by hand, so a flux like the TCA cycle is evaluated in
+    every equation it appears in. Here it is evaluated once and scattered by one sparse product, batched
+    states (and parameters from `population.stack_parameters`) go through unchanged, and S with the
+    `reads` of each rate gives the Jacobian structure and the conserved moieties. `S @ v` equals `system`
+    up to rounding.
+
+    Networks are cached by the parameter `fingerprint`.
+
+    Attributes:
+        p (Parameters): The parameters of `organs`. Batched parameters must share their volumes, which
+                        enter S.
+        organs (tuple): Any of "fat", "gi", "muscle" and "pancreas".
+
+    Returns:
+        network (ReactionNetwork): The reactions, S and the rate function.
+    """
+    unknown = set(organs) - set(ORGANS)
+    if unknown:
+        raise ValueError(f"unknown organs {sorted(unknown)}, expected a subset of {ORGANS}")
+    if p.Liver is not None:
+        raise NotImplementedError("the liver model is not part of the reaction network yet")
+    organs = tuple(organ for organ in ORGANS if organ in organs)
+
+    key = (fingerprint(p), organs)
+    network = __cache.get(key)
+    if network is not None:
+        __cache.move_to_end(key)
+        return network
+
+    builders = {
+        "fat": lambda: (__fat_reactions(p, "subq"), __fat_reactions(p, "vsc")),
+        "gi": lambda: (__GI_reactions(p),),
+        "muscle": lambda: (__muscle_reactions(p),),
+        "pancreas": lambda: (__pancreas_reactions(),),
+    }
+    reactions, parts = [], []
+    for organ in organs:
+        for organ_reactions, part in builders[organ]():
+            reactions.extend(organ_reactions)
+            parts.append(part)
+
+    rows, cols, data = [], [], []
+    for column, reaction in enumerate(reactions):
+        for state, coefficient in reaction.stoichiometry:
+            rows.append(int(state))
+            cols.append(column)
+            data.append(coefficient)
+    S = csr_matrix((data, (rows, cols)), shape=(len(Index), len(reactions)))
+
+    def rates(t: float, y: np.ndarray) -> np.ndarray:
+        batched = y.ndim == 2
+        values = y if batched else y.tolist()
+        v = []
+        for part in parts:
+            v.extend(part(values, batched))
+        return np.array(v)
+
+    network = ReactionNetwork(reactions=tuple(reactions), S=S, rates=rates)
+    __cache[key] = network
+    if len(__cache) > __CACHE_SIZE:
+        __cache.popitem(last=False)
+    return network
+
+def stoichiometric_system(t: float, y: np.ndarray, p: Parameters) -> np.ndarray:
+    """
+    The stoichiometric_system function computes dydt as S · v for the full model, a drop-in for `system`
+    (e.g. `simulate(..., rhs=stoichiometric_system)`).
+
+    The network is looked up by the parameter values on every call, so editing a field in place (e.g.
+    `p.V.muscle = 30`) takes effect on the next call. In a hot loop over fixed parameters call
+    `reaction_network(p).rhs` instead.
+    """
+    return reaction_network(p).rhs(t, y)
+
+def __volume(volume):
+    values = np.unique(np.asarray(volume, dtype=float))
+    if values.size != 1:
+        raise ValueError("the stoichiometric matrix needs volumes shared by every subject")
+    return float(values[0])
+
+def __exchange(compartment, species, plasma, tissue, V_plasma, V_tissue):
+    # plasma <-> tissue transport as amounts per time, uptake first
+    return [
+        Reaction(f"{compartment}.{species}_uptake", ((plasma, -1 / V_plasma), (tissue, 1 / V_tissue)), (plasma,)),
+        Reaction(f"{compartment}.{species}_release", ((plasma, 1 / V_plasma), (tissue, -1 / V_tissue)), (tissue,)),
+    ]
+
+def __fat_reactions(p, depot):
+    own = p.Subq if depot == "subq" else p.Vsc
+    # the fat equations take most intracellular rates of both depots from the Subq parameters
+    shared = p.Subq
+    V_plasma, V = __volume(p.V.plasma), __volume(getattr(p.V, depot))
+    prepared = prepare(p)
+    esterification_rate = getattr(prepared, f"{depot}_esterification_rate")
+    V_plasma_rate, V_rate = p.V.plasma, getattr(p.V, depot)
+    Km = 1
+    ROSpercent = 0.01
+
+    glucose, insulin, fattyacid, aminoacid, G6P, TAG, pyruvate, ACoA, ROS = (
+        Index[f"{depot}_{name}"]
+        for name in ("glucose", "insulin", "fattyacid", "aminoacid", "G6P", "TAG", "pyruvate", "ACoA", "ROS")
+    )
+    plasma_glucose, plasma_insulin, plasma_fattyacid, plasma_aminoacid = (
+        Index.plasma_glucose, Index.plasma_insulin, Index.plasma_fattyacid, Index.plasma_aminoacid
+    )
+
+    reactions = [
+        *__exchange(depot, "glucose", plasma_glucose, glucose, V_plasma, V),
+        *__exchange(depot, "insulin", plasma_insulin, insulin, V_plasma, V),
+        *__exchange(depot, "fattyacid", plasma_fattyacid, fattyacid, V_plasma, V),
+        *__exchange(depot, "aminoacid", plasma_aminoacid, aminoacid, V_plasma, V),
+    ]
+    if depot == "subq":
+        reactions += [
+            Reaction("subq.glucose_to_G6P", ((glucose, -1), (G6P, 1)), (glucose,)),
+            Reaction("subq.G6P_to_glucose", ((glucose, 1), (G6P, -1)), (G6P,)),
+        ]
+    else:
+        # the glucose side uses the Vsc rates and the G6P side the Subq rates, so they are separate fluxes
+        reactions += [
+            Reaction("vsc.glucose_to_G6P", ((glucose, -1),), (glucose,)),
+            Reaction("vsc.G6P_to_glucose", ((glucose, 1),), (G6P,)),
+            Reaction("vsc.G6P_from_glucose", ((G6P, 1),), (glucose,)),
+            Reaction("vsc.glucose_from_G6P", ((G6P, -1),), (G6P,)),
+        ]
+    reactions += [
+        Reaction(f"{depot}.insulin_clearance", ((insulin, -1),), (insulin,)),
+        Reaction(f"{depot}.fattyacid_to_ACoA", ((fattyacid, -1), (ACoA, 8), (ROS, ROSpercent)), (fattyacid,)),
+        Reaction(f"{depot}.esterification", ((fattyacid, -3), (TAG, 1), (ROS, ROSpercent * 3)), (fattyacid,)),
+        Reaction(f"{depot}.lipolysis", ((fattyacid, 3), (TAG, -1), (ROS, ROSpercent * 3)), (TAG,)),
+        Reaction(f"{depot}.ACoA_to_fattyacid", ((fattyacid, 1), (ACoA, -8), (ROS, ROSpercent * 8)), (ACoA,)),
+        Reaction(f"{depot}.aminoacid_to_ACoA", ((aminoacid, -1), (ACoA, 1), (ROS, ROSpercent)), (aminoacid,)),
+        Reaction(f"{depot}.G6P_to_pyruvate", ((G6P, -1), (pyruvate, 2)), (G6P,)),
+        Reaction(f"{depot}.pyruvate_to_G6P", ((G6P, 1), (pyruvate, -2)), (pyruvate,)),
+        Reaction(f"{depot}.pyruvate_to_ACoA", ((pyruvate, -1), (ACoA, 1)), (pyruvate,)),
+    ]
+
+    k_G_from_plasma, k_G_to_plasma = own.k_G_from_plasma, own.k_G_to_plasma
+    k_insulin_from_plasma, k_insulin_to_plasma = own.k_insulin_from_plasma, own.k_insulin_to_plasma
+    k_FA_from_plasma, k_FA_to_plasma = own.k_FA_from_plasma, own.k_FA_to_plasma
+    k_AA_from_plasma, k_AA_to_plasma = own.k_AA_from_plasma, own.k_AA_to_plasma
+    k_G_to_G6P, k_G6P_to_G = own.k_G_to_G6P, own.k_G6P_to_G
+    shared_k_G_to_G6P, shared_k_G6P_to_G = shared.k_G_to_G6P, shared.k_G6P_to_G
+    kCL_insulin, k_TAG_to_FA = own.kCL_insulin, own.k_TAG_to_FA
+    k_FA_to_ACoA, k_ACoA_to_FA, k_AA_to_ACoA = shared.k_FA_to_ACoA, shared.k_ACoA_to_FA, shared.k_AA_to_ACoA
+    k_G6P_to_P, k_P_to_G6P, k_P_to_ACoA = shared.k_G6P_to_P, shared.k_P_to_G6P, shared.k_P_to_ACoA
+    split = depot == "vsc"
+
+    def part(y, batched):
+        depot_glucose, depot_G6P, depot_fattyacid = y[glucose], y[G6P], y[fattyacid]
+        depot_pyruvate = y[pyruvate]
+        conversions = [k_G_to_G6P * depot_glucose, k_G6P_to_G * depot_G6P]
+        if split:
+            conversions += [shared_k_G_to_G6P * depot_glucose, shared_k_G6P_to_G * depot_G6P]
+        return [
+            k_G_from_plasma * y[plasma_glucose] * V_plasma_rate, k_G_to_plasma * depot_glucose * V_rate,
+            k_insulin_from_plasma * y[plasma_insulin] * V_plasma_rate, k_insulin_to_plasma * y[insulin] * V_rate,
+            k_FA_from_plasma * y[plasma_fattyacid] * V_plasma_rate, k_FA_to_plasma * depot_fattyacid * V_rate,
+            k_AA_from_plasma * y[plasma_aminoacid] * V_plasma_rate, k_AA_to_plasma * y[aminoacid] * V_rate,
+            *conversions,
+            kCL_insulin * y[insulin],
+            k_FA_to_ACoA * depot_fattyacid,
+            (esterification_rate * depot_fattyacid / (Km + depot_fattyacid * V_rate))**3,
+            k_TAG_to_FA * y[TAG],
+            k_ACoA_to_FA * y[ACoA],
+            k_AA_to_ACoA * y[aminoacid],
+            k_G6P_to_P * depot_G6P,
+            k_P_to_G6P * depot_pyruvate**2,
+            k_P_to_ACoA * depot_pyruvate,
+        ]
+
+    return reactions, part
+
+def __GI_reactions(p):
+    V_plasma, V_gut = __volume(p.V.plasma), __volume(p.V.gut)
+    GI = p.GI
+    V_gut_rate = p.V.gut
+
+    reactions = [
+        Reaction("gi.glucose_absorption", ((Index.gut_glucose, -1 / V_gut), (Index.plasma_glucose, 1 / V_plasma)),
+                 (Index.gut_glucose,)),
+        Reaction("gi.glucose_clearance", ((Index.plasma_glucose, -1),), (Index.plasma_glucose,)),
+        Reaction("gi.fructose_absorption",
+                 ((Index.gut_fructose, -1 / V_gut), (Index.plasma_fructose, 1 / V_plasma)), (Index.gut_fructose,)),
+        Reaction("gi.fructose_clearance", ((Index.plasma_fructose, -1),), (Index.plasma_fructose,)),
+        Reaction("gi.micelle_diffusion", ((Index.micellar_fattyacid, -1), (Index.membrane_fattyacid, 1)),
+                 (Index.micellar_fattyacid, Index.membrane_fattyacid)),
+        Reaction("gi.fattyacid_transport", ((Index.membrane_fattyacid, -1), (Index.cytosol_fattyacid, 1)),
+                 (Index.membrane_fattyacid,)),
+        Reaction("gi.reesterification", ((Index.cytosol_fattyacid, -1), (Index.cytosol_TAG, 1)),
+                 (Index.cytosol_fattyacid,)),
+        Reaction("gi.chylomicron_export", ((Index.cytosol_TAG, -1), (Index.plasma_fattyacid, 1)),
+                 (Index.cytosol_TAG,)),
+        Reaction("gi.fattyacid_clearance", ((Index.plasma_fattyacid, -1),), (Index.plasma_fattyacid,)),
+    ]
+
+    kabs_glucose, kabs_fructose = GI.kabs_glucose, GI.kabs_fructose
+    kCL_glucose, kCL_fructose, kCL_fattyacid = GI.kCL_glucose, GI.kCL_fructose, GI.kCL_fattyacid
+    k_diffusion = GI.k_diffusion_micelle_to_membrane
+    k_Vmax_trans, k_Vmax_reester, k_Vmax_export = GI.k_Vmax_trans, GI.k_Vmax_reester, GI.k_Vmax_export
+    Km_trans, Km_reester, Km_export = GI.Km_trans, GI.Km_reester, GI.Km_export
+
+    def part(y, batched):
+        membrane, cytosol, TAG = y[Index.membrane_fattyacid], y[Index.cytosol_fattyacid], y[Index.cytosol_TAG]
+        return [
+            kabs_glucose * y[Index.gut_glucose] * V_gut_rate,
+            kCL_glucose * y[Index.plasma_glucose],
+            kabs_fructose * y[Index.gut_fructose] * V_gut_rate,
+            kCL_fructose * y[Index.plasma_fructose],
+            k_diffusion * (y[Index.micellar_fattyacid] - membrane),
+            (k_Vmax_trans * membrane) / (Km_trans + membrane + 1e-6),
+            (k_Vmax_reester * cytosol) / (Km_reester + cytosol + 1e-6),
+            (k_Vmax_export * TAG) / (Km_export + TAG + 1e-6),
+            kCL_fattyacid * y[Index.plasma_fattyacid],
+        ]
+
+    return reactions, part
+
+def __muscle_reactions(p):
+    M = p.M
+    V_plasma, V_muscle = __volume(p.V.plasma), __volume(p.V.muscle)
+    V_plasma_rate, V_muscle_rate = p.V.plasma, p.V.muscle
+    glycogen_synthesis_rate = prepare(p).glycogen_synthesis_rate
+    Km = 1
+    ROSpercent = 0.02
+
+    G6P, glycogen, pyruvate, ACoA = Index.muscle_G6P, Index.muscle_glycogen, Index.muscle_pyruvate, Index.muscle_ACoA
+    NAD, NADH, FAD, FADH2 = Index.muscle_NAD, Index.muscle_NADH, Index.muscle_FAD, Index.muscle_FADH2
+    ATP, ROS, lactate = Index.muscle_ATP, Index.muscle_ROS, Index.muscle_lactate
+
+    reactions = [
+        *__exchange("muscle", "glucose", Index.plasma_glucose, Index.muscle_glucose, V_plasma, V_muscle),
+        *__exchange("muscle", "insulin", Index.plasma_insulin, Index.muscle_insulin, V_plasma, V_muscle),
+        *__exchange("muscle", "fattyacid", Index.plasma_fattyacid, Index.muscle_fattyacid, V_plasma, V_muscle),
+        *__exchange("muscle", "aminoacid", Index.plasma_aminoacid, Index.muscle_aminoacid, V_plasma, V_muscle),
+        *__exchange("muscle", "lactate", Index.plasma_lactate, lactate, V_plasma, V_muscle),
+        Reaction("muscle.glucose_to_G6P", ((Index.muscle_glucose, -1), (G6P, 1)), (Index.muscle_glucose,)),
+        Reaction("muscle.G6P_to_glucose", ((Index.muscle_glucose, 1), (G6P, -1)), (G6P,)),
+        Reaction("muscle.insulin_clearance", ((Index.muscle_insulin, -1),), (Index.muscle_insulin,)),
+        Reaction("muscle.beta_oxidation", ((Index.muscle_fattyacid, -1), (ACoA, 8), (ATP, -1), (ROS, ROSpercent)),
+                 (Index.muscle_fattyacid, ATP)),
+        Reaction("muscle.aminoacid_to_ACoA", ((Index.muscle_aminoacid, -1), (ACoA, 1), (ROS, ROSpercent)),
+                 (Index.muscle_aminoacid,)),
+        Reaction("muscle.glycogen_synthesis", ((G6P, -1), (glycogen, 1)), (G6P,)),
+        Reaction("muscle.glycogenolysis", ((G6P, 1), (glycogen, -1)), (glycogen,)),
+        Reaction("muscle.glycolysis", ((G6P, -1), (pyruvate, 2), (NAD, -2), (NADH, 2), (ATP, 3)), (G6P, NAD)),
+        Reaction("muscle.gluconeogenesis", ((G6P, 1), (pyruvate, -2), (NAD, 2), (NADH, -2), (ATP, -3)),
+                 (pyruvate, ATP, NADH)),
+        Reaction("muscle.pyruvate_to_ACoA", ((pyruvate, -1), (ACoA, 1), (NAD, -1), (NADH, 1)), (pyruvate, NAD)),
+        Reaction("muscle.pyruvate_to_lactate", ((pyruvate, -1), (NAD, 1), (NADH, -1), (lactate, 1)),
+                 (pyruvate, NADH)),
+        Reaction("muscle.lactate_to_pyruvate", ((pyruvate, 1), (NAD, -1), (NADH, 1), (lactate, -1)),
+                 (lactate, NAD)),
+        Reaction("muscle.ACoA_to_pyruvate",
+                 ((ACoA, -1), (NAD, -3), (NADH, 3), (FAD, -1), (FADH2, 1), (ATP, 1), (ROS, ROSpercent)),
+                 (ACoA, NAD, FAD)),
+        Reaction("muscle.TCA", ((ACoA, -1), (NAD, -3), (NADH, 3), (FAD, -1), (FADH2, 1)), (ACoA, NAD, FAD)),
+        Reaction("muscle.NADH_ETC", ((NAD, 2), (NADH, -2), (ATP, 5), (ROS, ROSpercent)), (NADH,)),
+        Reaction("muscle.FADH2_ETC", ((FAD, 2), (FADH2, -2), (ATP, 3), (ROS, ROSpercent)), (FADH2,)),
+        Reaction("muscle.insulin_ATP_use", ((ATP, -1),), (Index.plasma_insulin, ATP)),
+        Reaction("muscle.ATP_from_G6P", ((ATP, 1),), (G6P,)),
+        Reaction("muscle.ATP_clearance", ((ATP, -1),), (ATP,)),
+    ]
+
+    def part(y, batched):
+        muscle_G6P, muscle_pyruvate, muscle_ATP = y[G6P], y[pyruvate], y[ATP]
+        muscle_NAD, muscle_NADH, muscle_fattyacid = y[NAD], y[NADH], y[Index.muscle_fattyacid]
+        oxidation = y[ACoA] * muscle_NAD**3 * y[FAD]
+        return [
+            M.k_G_from_plasma * y[Index.plasma_glucose] * V_plasma_rate,
+            M.k_G_to_plasma * y[Index.muscle_glucose] * V_muscle_rate,
+            M.k_insulin_from_plasma * y[Index.plasma_insulin] * V_plasma_rate,
+            M.k_insulin_to_plasma * y[Index.muscle_insulin] * V_muscle_rate,
+            M.k_FA_from_plasma * y[Index.plasma_fattyacid] * V_plasma_rate,
+            M.k_FA_to_plasma * muscle_fattyacid * V_muscle_rate,
+            M.k_AA_from_plasma * y[Index.plasma_aminoacid] * V_plasma_rate,
+            M.k_AA_to_plasma * y[Index.muscle_aminoacid] * V_muscle_rate,
+            M.k_L_from_plasma * y[Index.plasma_lactate] * V_plasma_rate,
+            M.k_L_to_plasma * y[lactate] * V_muscle_rate,
+            M.k_Glc_to_G6P * y[Index.muscle_glucose],
+            M.k_G6P_to_Glc * muscle_G6P,
+            M.kCL_insulin * y[Index.muscle_insulin],
+            M.k_FA_to_ACoA * muscle_fattyacid * muscle_ATP,
+            M.k_AA_to_ACoA * y[Index.muscle_aminoacid],
+            glycogen_synthesis_rate * muscle_G6P / (Km + muscle_G6P * V_muscle_rate),
+            M.k_P_to_G6P * y[glycogen],
+            M.k_G6P_to_P * muscle_G6P * muscle_NAD**2,
+            M.k_P_to_G6P * muscle_pyruvate**2 * muscle_ATP**3 * muscle_NADH**2,
+            M.k_P_to_ACoA * muscle_pyruvate * muscle_NAD,
+            M.k_P_to_L * muscle_pyruvate * muscle_NADH,
+            M.k_L_to_P * y[lactate] * muscle_NAD,
+            M.k_ACoA_to_P * oxidation,
+            M.k_ACoA_to_TCA * oxidation,
+            M.NADH_ETC * muscle_NADH**2,
+            M.FADH2_ETC * y[FADH2]**2,
+            M.k_G_to_G6P * y[Index.plasma_insulin] * muscle_ATP,
+            M.k_G6P_to_G * muscle_G6P,
+            M.kCL_ATP * muscle_ATP,
+        ]
+
+    return reactions, part
+
+def __pancreas_reactions():
+    reactions = [
+        Reaction("pancreas.insulin_secretion", ((Index.plasma_insulin, 1),), (Index.plasma_glucose,)),
+        Reaction("pancreas.glucagon_secretion", ((Index.plasma_glucagon, 1),), (Index.plasma_glucose,)),
+        Reaction("pancreas.somatostatin_secretion", ((Index.plasma_somatostatin, 1),), (Index.plasma_glucose,)),
+    ]
+
+    def part(y, batched):
+        if batched:
+            return list(pancreatic_secretion_response_to_Gblood_array(y[Index.plasma_glucose]))
+        return list(pancreatic_secretion_response_to_Gblood(y[Index.plasma_glucose]))
+
+    return reactions, part
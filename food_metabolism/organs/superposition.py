@@ -0,0 +1,276 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.fft import irfft, next_fast_len, rfft
+from scipy.linalg import expm
+
+from .schedule import Bolus, Infusion, Regimen, Schedule
+
+@dataclass(frozen=True, slots=True)
+class LinearPK:
+    """
+    Data class for a linear compartmental drug model dA/dt = K A, with A the amounts in the compartments.
+    Linear models respond to a sum of doses with the sum of the single dose responses, which
+    `superpose` uses to evaluate regimens without solving the ODEs again.
+
+    Attributes:
+        names (tuple[str, ...]): Compartment names, e.g. ("central", "peripheral1", "peripheral2"). Doses
+                                 in a `Schedule` are keyed by them as the metabolic model's are by `Index`.
+        K (np.ndarray): The rate matrix in 1/time, shape (len(names), len(names)).
+        volumes (tuple[float, ...]): Volume of each compartment, amount / volume is its concentration.
+    """
+    names  : tuple
+    K      : np.ndarray
+    volumes: tuple
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def position(self, name) -> int:
+        """
+        Returns the row of compartment `name` in the state.
+        """
+        return self.names.index(getattr(name, "name", name))
+
+@dataclass(frozen=True, slots=True)
+class UnitResponse:
+    """
+    Data class holding the responses of a `LinearPK` model to unit doses on a regular grid, see
+    `unit_response`.
+
+    Attributes:
+        model (LinearPK): The model.
+        dt (float): Spacing of the grid.
+        steps (int): Number of grid points, the first one at the dose.
+        bolus (np.ndarray): Amounts after a unit bolus into each compartment, shape
+                            (len(model), len(model), steps), bolus[:, j, k] for a dose into j k steps earlier.
+        infusion (np.ndarray): Amounts after a unit rate infusion into each compartment over one grid interval,
+                               same shape, infusion[:, j, k] for the interval that started k steps earlier.
+    """
+    model   : LinearPK
+    dt      : float
+    steps   : int
+    bolus   : np.ndarray
+    infusion: np.ndarray
+
+@dataclass(frozen=True, slots=True)
+class SuperpositionResult:
+    """
+    Data class holding a regimen evaluated by `superpose`.
+
+    Attributes:
+        t (np.ndarray): The grid, shape (T,).
+        y (np.ndarray): Amounts in the compartments, shape (len(model), T).
+        model (LinearPK): The model.
+
+    `result["central"]` returns the amount in a compartment and `result.concentration("central")` its
+    concentration.
+    """
+    t    : np.ndarray
+    y    : np.ndarray
+    model: LinearPK
+
+    def __getitem__(self, name) -> np.ndarray:
+        return self.y[self.model.position(name)]
+
+    def concentration(self, name) -> np.ndarray:
+        position = self.model.position(name)
+        return self.y[position] / self.model.volumes[position]
+
+__cache = OrderedDict()
+__spectra = OrderedDict()
+__CACHE_SIZE = 32
+
+def one_compartment(V: float, kcl: float, ka: float = None) -> LinearPK:
+    """
+    The one compartment model of IV infusion and oral dosing fits: a central compartment of volume `V`
+    cleared at `kcl`, and with an absorption rate `ka` a gut depot emptying into it.
+    """
+    if ka is None:
+        return LinearPK(names=("central",), K=np.array([[-kcl]], dtype=float), volumes=(V,))
+    return LinearPK(
+        names=("gut", "central"),
+        K=np.array([[-ka, 0.0], [ka, -kcl]], dtype=float),
+        volumes=(np.inf, V),
+    )
+
+def mammillary(CL: float, V: float, peripheral: tuple = ()) -> LinearPK:
+    """
+    A central compartment of volume `V` with clearance `CL`, exchanging with peripheral compartments given
+    as (inter-compartmental clearance Q, volume) pairs, e.g. the three compartment penicillin model
+    `mammillary(CL=25.3, V=7.77, peripheral=((19.3, 6.92), (2.33, 8.08)))`.
+    """
+    n = 1 + len(peripheral)
+    K = np.zeros((n, n))
+    K[0, 0] = -CL / V
+    for k, (Q, Vp) in enumerate(peripheral, start=1):
+        K[0, 0] -= Q / V
+        K[0, k] += Q / Vp
+        K[k, 0] += Q / V
+        K[k, k] -= Q / Vp
+    return LinearPK(
+        names=("central",) + tuple(f"peripheral{k}" for k in range(1, n)),
+        K=K,
+        volumes=(V,) + tuple(Vp for _, Vp in peripheral),
+    )
+
+def unit_response(model: LinearPK, dt: float, steps: int) -> UnitResponse:
+    """
+    Computes the responses to unit boluses and unit one-interval infusions into every compartment on a
+    grid of `steps` points spaced `dt`, exactly by powers of the matrix exponential. Cached by the model
+    and grid, so every regimen evaluated on the same grid reuses them.
+    """
+    key = (model.names, model.K.tobytes(), float(dt), int(steps))
+    if key in __cache:
+        __cache.move_to_end(key)
+        return __cache[key]
+
+    n = len(model)
+    # expm of [[K, I], [0, 0]] dt holds expm(K dt) and the integral of expm(K s) over one interval
+    block = np.zeros((2 * n, 2 * n))
+    block[:n, :n] = model.K * dt
+    block[:n, n:] = np.eye(n) * dt
+    exponential = expm(block)
+    step, interval = exponential[:n, :n], exponential[:n, n:]
+
+    bolus = np.empty((n, n, steps))
+    infusion = np.zeros((n, n, steps))
+    bolus[:, :, 0] = np.eye(n)
+    for k in range(1, steps):
+        bolus[:, :, k] = step @ bolus[:, :, k - 1]
+        infusion[:, :, k] = bolus[:, :, k - 1] @ interval if k > 1 else interval
+    result = UnitResponse(model=model, dt=float(dt), steps=int(steps), bolus=bolus, infusion=infusion)
+    __cache[key] = result
+    if len(__cache) > __CACHE_SIZE:
+        __cache.popitem(last=False)
+    return result
+
+def superpose(model: LinearPK, schedule: Schedule, t_end: float, dt: float, y0=None,
+              t0: float = 0.0) -> SuperpositionResult:
+    """
+    Evaluates a regimen of a linear model by superposing its unit dose responses: the dose trains on the
+    grid t0, t0 + dt, ..., t_end are convolved (by FFT) with the cached `unit_response`, so no ODE is solved.
+    The result is exact on the grid for doses given at grid times.
+
+    Attributes:
+        model (LinearPK): The model.
+        schedule (Schedule | Regimen | Bolus | Infusion): The doses, keyed by compartment name. Doses must
+                                                          start and stop on the grid.
+        t_end (float): End of the grid.
+        dt (float): Spacing of the grid.
+        y0 (dict | np.ndarray): Amounts at t0, keyed by compartment name, zero by default.
+        t0 (float): Start of the grid.
+
+    Returns:
+        result (SuperpositionResult): The amounts on the grid with named access.
+    """
+    t, trains = __grid(model, (schedule,), t_end, dt, t0)
+    y = superpose_many(model, (schedule,), t_end, dt, t0=t0, trains=trains)[0]
+    if y0 is not None:
+        response = unit_response(model, dt, len(t))
+        y = y + np.einsum("ijk,j->ik", response.bolus, __amounts(model, y0))
+    return SuperpositionResult(t=t, y=y, model=model)
+
+def superpose_many(model: LinearPK, schedules, t_end: float, dt: float, outputs: tuple = None,
+                   t0: float = 0.0, chunk: int = 1000, trains: tuple = None) -> np.ndarray:
+    """
+    Evaluates many candidate regimens of the same model on one grid, e.g. 10,000 dosing schedules, as
+    batched FFT convolutions with one set of unit dose responses.
+
+    Attributes:
+        model (LinearPK): The model.
+        schedules (Iterable[Schedule]): The regimens, each as for `superpose`.
+        t_end (float): End of the grid.
+        dt (float): Spacing of the grid.
+        outputs (tuple): Names of the compartments to return, by default all of them. Fewer outputs need
+                         proportionally less memory.
+        t0 (float): Start of the grid.
+        chunk (int): Number of regimens convolved at once, bounding the memory of the FFTs.
+        trains (tuple): Dose trains from a previous call on the same grid, internal.
+
+    Returns:
+        y (np.ndarray): Amounts, shape (len(schedules), len(outputs), T), starting from empty compartments.
+    """
+    schedules = tuple(schedules)
+    if trains is None:
+        _, trains = __grid(model, schedules, t_end, dt, t0)
+    boluses, rates = trains
+    steps = boluses.shape[-1]
+    rows = np.arange(len(model)) if outputs is None else np.array([model.position(name) for name in outputs])
+
+    response = unit_response(model, dt, steps)
+    size = next_fast_len(2 * steps - 1, real=True)
+    bolus_spectrum, infusion_spectrum = __response_spectra(response, size)
+    bolus_spectrum, infusion_spectrum = bolus_spectrum[rows], infusion_spectrum[rows]
+    # only the compartments that are dosed in some regimen take part in the convolution
+    dosed_boluses = np.flatnonzero(boluses.any(axis=(0, 2)))
+    dosed_rates = np.flatnonzero(rates.any(axis=(0, 2)))
+
+    y = np.zeros((len(schedules), len(rows), steps))
+    for start in range(0, len(schedules), chunk):
+        block = slice(start, start + chunk)
+        spectrum = 0
+        if len(dosed_boluses):
+            spectrum = spectrum + np.einsum(
+                "ijf,njf->nif", bolus_spectrum[:, dosed_boluses],
+                rfft(boluses[block][:, dosed_boluses], size, axis=-1),
+            )
+        if len(dosed_rates):
+            spectrum = spectrum + np.einsum(
+                "ijf,njf->nif", infusion_spectrum[:, dosed_rates],
+                rfft(rates[block][:, dosed_rates], size, axis=-1),
+            )
+        if len(dosed_boluses) or len(dosed_rates):
+            y[block] = irfft(spectrum, size, axis=-1)[..., :steps]
+    return y
+
+def __grid(model, schedules, t_end, dt, t0):
+    if dt <= 0 or t_end <= t0:
+        raise ValueError("the grid needs dt > 0 and t_end > t0")
+    steps = int(round((t_end - t0) / dt)) + 1
+    t = t0 + dt * np.arange(steps)
+    boluses = np.zeros((len(schedules), len(model), steps))
+    rates = np.zeros((len(schedules), len(model), steps))
+    for n, schedule in enumerate(schedules):
+        if isinstance(schedule, (Bolus, Infusion, Regimen)):
+            schedule = Schedule(schedule)
+        for bolus in schedule.boluses:
+            k = __on_grid(bolus.time, t0, dt, "bolus")
+            # as in `Schedule.segments`, a bolus at the end of the grid is not given
+            if 0 <= k < steps - 1:
+                boluses[n, :, k] += __amounts(model, bolus.amounts)
+        for infusion in schedule.infusions:
+            first = max(__on_grid(infusion.start, t0, dt, "infusion start"), 0)
+            last = min(__on_grid(infusion.stop, t0, dt, "infusion stop"), steps - 1)
+            if last > first:
+                rates[n, :, first:last] += __amounts(model, infusion.rates)[:, None]
+    return t, (boluses, rates)
+
+def __response_spectra(response, size):
+    # the unit responses are cached, so their FFTs can be as well; the entry keeps the response alive
+    key = (id(response), size)
+    if key in __spectra:
+        __spectra.move_to_end(key)
+    else:
+        __spectra[key] = (response, rfft(response.bolus, size, axis=-1), rfft(response.infusion, size, axis=-1))
+        if len(__spectra) > __CACHE_SIZE:
+            __spectra.popitem(last=False)
+    return __spectra[key][1:]
+
+def __on_grid(time, t0, dt, what):
+    k = int(round((time - t0) / dt))
+    if abs(t0 + k * dt - time) > 1e-9 * max(dt, abs(time)):
+        raise ValueError(f"{what} at {time} is not on the grid t0 + k * {dt}")
+    return k
+
+def __amounts(model, values):
+    if not isinstance(values, dict):
+        vector = np.asarray(values, dtype=float)
+        if vector.shape != (len(model),):
+            raise ValueError(f"expected {len(model)} values, got shape {vector.shape}")
+        return vector
+    vector = np.zeros(len(model))
+    for name, value in values.items():
+        vector[model.position(name)] += value
+    return vector
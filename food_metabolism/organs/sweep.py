@@ -0,0 +1,272 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.stats import qmc
+
+from .parameters import *
+from .index import Index
+from .packing import ParameterLayout, _layout, layout, pack, unpack
+from .simulate import simulate, initial_state
+from .cache import result_key
+from .metrics import Metrics
+
+# status of a design row that has not been run yet; finished rows hold `SimulationResult.status`
+PENDING = -128
+
+@dataclass(frozen=True, slots=True)
+class SweepResult:
+    """
+    Data class holding a parameter sweep written by `run_sweep`.
+
+    Attributes:
+        path (str): The directory holding the sweep.
+        layout (ParameterLayout): Layout of the packed design rows.
+        design (np.ndarray): The packed parameters of every run, shape (N, len(layout)), memory-mapped.
+        t (np.ndarray): The time points, shape (T,).
+        y (np.ndarray): Trajectories of shape (N, len(Index), T), or summaries of shape (N, ...) when the sweep
+                        was run with a `summary`, memory-mapped. Rows of failed runs are nan from the point
+                        the solver stopped.
+        status (np.ndarray): `SimulationResult.status` of every run, `PENDING` for runs not done yet, shape (N,).
+    """
+    path  : str
+    layout: ParameterLayout
+    design: np.ndarray
+    t     : np.ndarray
+    y     : np.ndarray
+    status: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.design)
+
+    @property
+    def done(self) -> bool:
+        return bool(np.all(self.status != PENDING))
+
+    def parameters(self, i: int) -> Parameters:
+        """
+        Returns the parameters of run `i`.
+        """
+        return unpack(self.design[i], self.layout)
+
+def grid_design(p: Parameters, values: dict) -> np.ndarray:
+    """
+    Builds a full factorial design around `p`: every combination of the given field values, the other
+    fields as in `p`.
+
+    Attributes:
+        p (Parameters): The base parameters.
+        values (dict): Dotted field names ("M.k_G_from_plasma", "V.plasma", ...) mapped to the values to take.
+
+    Returns:
+        design (np.ndarray): Packed parameters, shape (prod(len(v) for v in values), len(layout(p))), with
+                             the last field varying fastest.
+    """
+    columns = __columns(p, values)
+    combinations = np.array(list(itertools.product(*values.values())), dtype=float).reshape(-1, len(columns))
+    design = np.repeat(pack(p)[None], len(combinations), axis=0)
+    design[:, columns] = combinations
+    return design
+
+def latin_hypercube(p: Parameters, bounds: dict, n: int, seed: int = None, log: bool = False) -> np.ndarray:
+    """
+    Builds a Latin hypercube design of `n` runs around `p`.
+
+    Attributes:
+        p (Parameters): The base parameters.
+        bounds (dict): Dotted field names mapped to (low, high) ranges, the other fields as in `p`.
+        n (int): Number of runs.
+        seed (int): Seed of the sampler, the same seed gives the same design.
+        log (bool): Sample the ranges uniformly in log space, for rate constants spanning decades.
+
+    Returns:
+        design (np.ndarray): Packed parameters, shape (n, len(layout(p))).
+    """
+    columns = __columns(p, bounds)
+    low, high = np.array(list(bounds.values()), dtype=float).reshape(-1, 2).T
+    if log:
+        low, high = np.log(low), np.log(high)
+    sample = qmc.scale(qmc.LatinHypercube(d=len(columns), seed=seed).random(n), low, high)
+    design = np.repeat(pack(p)[None], n, axis=0)
+    design[:, columns] = np.exp(sample) if log else sample
+    return design
+
+def run_sweep(p: Parameters, design: np.ndarray, y0, t_eval: np.ndarray, path: str, summary=None,
+              workers: int = None, chunk: int = None, schedule=None, **options) -> SweepResult:
+    """
+    Simulates every row of a design on a process pool, writing the results straight into memory-mapped
+    arrays under `path`.
+
+    Workers open the arrays themselves and write their rows in place, so no result is pickled back and row i
+    always holds run i, whatever the number of workers. A run's status is written after its row, so after a
+    crash calling `run_sweep` again with the same arguments runs only the rows still `PENDING`. A sweep
+    stores a digest of its design, time points, initial state, schedule, summary and options, and refuses
+    to resume with any of them changed.
+    With many workers, limit BLAS to one thread per process (e.g. OMP_NUM_THREADS=1).
+
+    Attributes:
+        p (Parameters): Parameters with the layout of the design rows, see `grid_design` and `latin_hypercube`.
+        design (np.ndarray): Packed parameters of every run, shape (N, len(layout(p))).
+        y0 (dict | np.ndarray): Initial state of every run, see `simulate.initial_state`.
+        t_eval (np.ndarray): Time points stored for every run, from t_eval[0] to t_eval[-1].
+        path (str): Directory for the sweep, created if needed.
+        summary (Callable): `summary(result)` reducing a `SimulationResult` to an array of fixed shape, stored
+                            instead of the trajectory. Must be picklable (a module-level function). Summaries
+                            with a `sink()` method, like `metrics.Metrics`, are streamed: each run writes to a
+                            fresh `summary.sink()` and its `values()` are stored, so no trajectory is kept.
+        workers (int): Number of processes, `os.cpu_count()` by default; 1 runs in this process.
+        chunk (int): Runs per task, by default small enough to give every worker several tasks.
+        schedule (Schedule): Meals and doses of every run.
+        options: Further keyword arguments for `simulate` (method, rtol, atol, ...).
+
+    Returns:
+        result (SweepResult): The memory-mapped results.
+    """
+    design = np.ascontiguousarray(design, dtype=float)
+    t_eval = np.asarray(t_eval, dtype=float)
+    packed = layout(p)
+    if design.ndim != 2 or design.shape[1] != len(packed):
+        raise ValueError(f"expected a design of shape (N, {len(packed)}), got {design.shape}")
+    if len(design) == 0:
+        raise ValueError("the design has no runs")
+
+    config = (path, packed, y0, t_eval, schedule, summary, options)
+    digest = __digest(config, design)
+    if not __exists(path, digest):
+        __create(config, design, digest)
+    status = np.load(os.path.join(path, "status.npy"), mmap_mode="r")
+    pending = np.flatnonzero(status == PENDING)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunk is None:
+        chunk = max(1, min(64, len(pending) // (4 * workers)))
+    tasks = [pending[start:start + chunk] for start in range(0, len(pending), chunk)]
+    if workers == 1 or len(tasks) <= 1:
+        __open(config)
+        for task in tasks:
+            __run(task)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=__open,
+                                 initargs=(config,)) as pool:
+            # results are in the arrays, consuming the iterator only re-raises the first error of a worker
+            for _ in pool.map(__run, tasks):
+                pass
+    return open_sweep(path)
+
+def open_sweep(path: str) -> SweepResult:
+    """
+    Opens a sweep written by `run_sweep`, read only, e.g. to read the finished rows of a running sweep.
+    """
+    if not os.path.exists(os.path.join(path, "design.npy")):
+        raise FileNotFoundError(f"no sweep in {path}")
+    groups = tuple(str(group) for group in np.load(os.path.join(path, "groups.npy")))
+    return SweepResult(
+        path=path,
+        layout=_layout(groups),
+        design=np.load(os.path.join(path, "design.npy"), mmap_mode="r"),
+        t=np.load(os.path.join(path, "t.npy")),
+        y=np.load(os.path.join(path, "y.npy"), mmap_mode="r"),
+        status=np.load(os.path.join(path, "status.npy"), mmap_mode="r"),
+    )
+
+# arrays and settings of the sweep in this process, set by `__open`
+__worker = {}
+
+def __columns(p, values):
+    offsets = layout(p).offsets
+    unknown = [name for name in values if name not in offsets]
+    if unknown:
+        raise ValueError(f"{unknown} are not fields of the parameters, expected dotted names like 'V.plasma'")
+    return [offsets[name] for name in values]
+
+def __digest(config, design):
+    # `cache.result_key` of everything that fills the rows, the parameters of every run included
+    _, packed, y0, t_eval, schedule, summary, options = config
+    settings = {name: __named(value) if callable(value) else value for name, value in options.items()}
+    return result_key(
+        unpack(design[0], packed), initial_state(y0), (t_eval[0], t_eval[-1]), schedule,
+        design=design, t_eval=t_eval, summary=__summary_key(summary), **settings,
+    )
+
+def __summary_key(summary):
+    if summary is None:
+        return None
+    if isinstance(summary, Metrics):
+        ranges = {name: tuple(float(bound) for bound in summary.ranges[name]) for name in summary.ranges}
+        return ("Metrics", summary.names, ranges)
+    return __named(summary)
+
+def __named(function):
+    # functions are told apart by their qualified name, their code is not hashed
+    return f"{getattr(function, '__module__', None)}.{getattr(function, '__qualname__', type(function).__qualname__)}"
+
+def __exists(path, digest):
+    # design.npy is written last, so a sweep whose creation was interrupted is created again
+    if not os.path.exists(os.path.join(path, "design.npy")):
+        return False
+    stored = os.path.join(path, "digest.npy")
+    if not os.path.exists(stored) or str(np.load(stored)) != digest:
+        raise ValueError(
+            f"{path} holds a different sweep (design, time points, initial state, schedule, summary or options "
+            f"differ), remove it or choose another path"
+        )
+    return True
+
+def __create(config, design, digest):
+    path, packed, y0, t_eval, schedule, summary, options = config
+    os.makedirs(path, exist_ok=True)
+    if summary is None:
+        shape, first = (len(Index), len(t_eval)), None
+    else:
+        # the first run sizes the summaries and is kept as row 0
+        first, value = __simulate(design[0], config)
+        shape = np.shape(value)
+    y = np.lib.format.open_memmap(os.path.join(path, "y.npy"), mode="w+", shape=(len(design),) + shape)
+    status = np.lib.format.open_memmap(os.path.join(path, "status.npy"), mode="w+", dtype=np.int8,
+                                       shape=(len(design),))
+    status[:] = PENDING
+    if first is not None:
+        y[0] = value
+        status[0] = first.status
+    y.flush()
+    status.flush()
+    np.save(os.path.join(path, "t.npy"), t_eval)
+    np.save(os.path.join(path, "groups.npy"), np.array(packed.groups))
+    np.save(os.path.join(path, "digest.npy"), np.array(digest))
+    np.save(os.path.join(path, "design.npy"), design)
+
+def __open(config):
+    path = config[0]
+    __worker["config"] = config
+    __worker["design"] = np.load(os.path.join(path, "design.npy"), mmap_mode="r")
+    __worker["y"] = np.load(os.path.join(path, "y.npy"), mmap_mode="r+")
+    __worker["status"] = np.load(os.path.join(path, "status.npy"), mmap_mode="r+")
+
+def __run(rows):
+    config, design, y, status = __worker["config"], __worker["design"], __worker["y"], __worker["status"]
+    summary = config[5]
+    results = [__simulate(design[i], config) for i in rows]
+    for i, (result, value) in zip(rows, results):
+        if summary is not None:
+            y[i] = value
+        else:
+            stored = result.y.shape[1]
+            y[i, :, :stored] = result.y
+            y[i, :, stored:] = np.nan
+    y.flush()
+    for i, (result, _) in zip(rows, results):
+        status[i] = result.status
+    status.flush()
+
+def __simulate(row, config):
+    # returns the result and its summary
+    _, packed, y0, t_eval, schedule, summary, options = config
+    sink = summary.sink() if hasattr(summary, "sink") else None
+    result = simulate(unpack(row, packed), y0, (t_eval[0], t_eval[-1]), t_eval=t_eval, schedule=schedule,
+                      sink=sink, **options)
+    if summary is None:
+        return result, None
+    return result, sink.values() if sink is not None else summary(result)
@@ -2,17 +2,20 @@ from .fat import __fat
 from .gi import __GI
 from .muscle import __muscle
 from .pancreas import __pancreas
+from .liver import __liver
 from .index import Index
 from .parameters import *
 
 import numpy as np
 def system(t: float, y: np.ndarray, p: Parameters) -> np.ndarray:
-    dydt = np.zeros(len(Index))
+    dydt = np.zeros(np.shape(y))
     __fat(t, y, p, dydt)
     __GI(t, y, p, dydt)
     __muscle(t, y, p, dydt)
     __pancreas(t, y, dydt)
-    __liver(t, y, p, dydt)
+    # the liver model is still being written, only run it once a preset provides parameters for it
+    if p.Liver is not None:
+        __liver(t, y, p, dydt)
     return dydt
 
 def init() -> Parameters:
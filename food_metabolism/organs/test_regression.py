@@ -0,0 +1,82 @@
+"""
+Regression tests of the equalities the fast paths promise on `init()`, bit-for-bit.
+
+    python -m organs.test_regression
+
+The functions are plain `test_*` functions, so pytest collects them as well. `python -m organs.benchmark` times
+these paths, this module checks that they still give the same numbers.
+"""
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from .system import init
+from .compiled import is_equivalent
+from .benchmark import benchmark_state
+from .schedule import Schedule, Regimen, Infusion, meal
+from .simulate import simulate
+from .checkpoint import Checkpointing, restart
+from .scenarios import Branch, run_scenarios
+
+# a day of meals and an insulin infusion across a checkpoint, stopping before the arms branch off at 24 h
+LEAD_IN = (
+    Regimen((meal(0.0, glucose=50, fructose=10),), interval=8.0, count=3),
+    Infusion(10.0, 20.0, {"plasma_insulin": 0.1}),
+)
+ARMS = {
+    "meals": (Regimen((meal(0.0, glucose=50, fructose=10),), interval=8.0, count=3, start=24.0),),
+    "feast": (meal(24.0, glucose=150, fattyacid=20),),
+}
+
+def test_compiled():
+    p = init()
+    rng = np.random.default_rng(0)
+    y = benchmark_state(p)
+    states = y * rng.lognormal(0.0, 0.5, size=(20, len(y)))
+    assert is_equivalent(p, states)
+
+def test_restart():
+    p = init()
+    schedule = Schedule(*LEAD_IN, *ARMS["meals"])
+    for t_eval in (None, np.linspace(0.0, 48.0, 97)):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "run.npz")
+            full = simulate(
+                p, benchmark_state(p), (0.0, 48.0), t_eval=t_eval, schedule=schedule,
+                checkpoint=Checkpointing(path, every=12.0),
+            )
+            resumed = restart(path, schedule=schedule)
+        assert full.success and resumed.success
+        assert np.array_equal(resumed.t, full.t) and np.array_equal(resumed.y, full.y)
+        assert (resumed.nfev, resumed.njev, resumed.nlu) == (full.nfev, full.njev, full.nlu)
+
+def test_scenarios():
+    # every arm doses at the branch point, where the direct run restarts the solver as well
+    p = init()
+    y0 = benchmark_state(p)
+    arms = run_scenarios(
+        p, y0, (0.0, 48.0), at=24.0, schedule=Schedule(*LEAD_IN),
+        branches=[Branch(name, schedule=Schedule(*doses)) for name, doses in ARMS.items()],
+    )
+    for name, doses in ARMS.items():
+        direct = simulate(p, y0, (0.0, 48.0), schedule=Schedule(*LEAD_IN, *doses))
+        assert direct.success and arms[name].success
+        assert np.array_equal(arms[name].t, direct.t) and np.array_equal(arms[name].y, direct.y)
+
+def main() -> int:
+    failed = 0
+    tests = {name: test for name, test in globals().items() if name.startswith("test_")}
+    for name, test in tests.items():
+        try:
+            test()
+        except AssertionError:
+            failed += 1
+            print(f"FAILED {name}")
+        else:
+            print(f"ok     {name}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import json
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from .index import Index, get_organ_slice
+
+# time points buffered by a writer before they are appended to its files
+CHUNK = 4096
+_FILES = ("t.f64",) + tuple(f"{state.name}.f64" for state in Index)
+
+class TrajectoryWriter:
+    """
+    A streaming sink for `simulate(..., sink=...)`: time points are appended to files on disk in chunks of
+    `chunk` rows, so memory stays constant however long the run is.
+
+    The directory holds `t.f64` (the times) and one file `<state>.f64` per `Index` state with its time course,
+    so reading one state (or one organ) touches only that state's pages; `columns.json` has the state names
+    and the number of time points written. The count is updated after the values themselves, so
+    `open_trajectory` reads a consistent prefix of a run that is still being written.
+
+    Attributes:
+        path (str): Directory of the trajectory, created if needed. Existing files in it are replaced.
+        chunk (int): Number of time points buffered between writes.
+    """
+    __slots__ = ("path", "chunk", "count", "__t", "__y", "__buffered", "__files")
+
+    def __init__(self, path: str, chunk: int = CHUNK):
+        if chunk <= 0:
+            raise ValueError("chunk must be positive")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk = int(chunk)
+        self.count = 0
+        self.__t = np.empty(self.chunk)
+        # buffered state-major, every state's values go to its file in one write
+        self.__y = np.empty((len(Index), self.chunk))
+        self.__buffered = 0
+        self.__files = tuple(open(os.path.join(path, name), "wb") for name in _FILES)
+        self.__write_columns()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def closed(self) -> bool:
+        return self.__files is None
+
+    def append(self, t, y) -> None:
+        """
+        Appends time points.
+
+        Attributes:
+            t (float | np.ndarray): A time, or times of shape (k,).
+            y (np.ndarray): The state at `t`, shape (len(Index),), or states of shape (len(Index), k).
+        """
+        if self.closed:
+            raise ValueError(f"the trajectory in {self.path} is closed")
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        y = np.asarray(y, dtype=float).reshape(len(Index), len(t))
+        written = 0
+        while written < len(t):
+            take = min(len(t) - written, self.chunk - self.__buffered)
+            columns = slice(self.__buffered, self.__buffered + take)
+            self.__t[columns] = t[written:written + take]
+            self.__y[:, columns] = y[:, written:written + take]
+            self.__buffered += take
+            written += take
+            if self.__buffered == self.chunk:
+                self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes the buffered time points to the files.
+        """
+        if self.closed or self.__buffered == 0:
+            return
+        t_file, *state_files = self.__files
+        t_file.write(self.__t[:self.__buffered].tobytes())
+        for values, file in zip(self.__y, state_files):
+            file.write(values[:self.__buffered].tobytes())
+        for file in self.__files:
+            file.flush()
+        self.count += self.__buffered
+        self.__buffered = 0
+        self.__write_columns()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.flush()
+        for file in self.__files:
+            file.close()
+        self.__files = None
+
+    def view(self) -> tuple:
+        """
+        Flushes and returns the times and states written so far, read only: the times as a memory map of
+        shape (T,), the states as `StateColumns` of shape (len(Index), T).
+        """
+        self.flush()
+        trajectory = open_trajectory(self.path)
+        return trajectory.t, trajectory.y
+
+    def __write_columns(self):
+        # replaced atomically, readers never see a partial file
+        temporary = os.path.join(self.path, "columns.json.tmp")
+        with open(temporary, "w") as file:
+            json.dump({"columns": [state.name for state in Index], "dtype": "<f8", "count": self.count}, file)
+        os.replace(temporary, os.path.join(self.path, "columns.json"))
+
+class StateColumns:
+    """
+    The states of a trajectory as a read only array of shape (len(Index), T), backed by one memory map per
+    state. Indexing gathers only the states it selects: `y[Index.plasma_glucose]` is that state's memory map
+    without a copy, `y[get_organ_slice("muscle")]` or `y[:, -1]` read just the pages they need into a new
+    array, and `np.asarray(y)` loads everything.
+
+    Attributes:
+        columns (tuple[np.ndarray, ...]): The time course of every state, in `Index` order.
+    """
+    __slots__ = ("columns",)
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self.columns), len(self.columns[0]) if self.columns else 0)
+
+    @property
+    def ndim(self) -> int:
+        return 2
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(float)
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def __getitem__(self, key):
+        rows, rest = (key[0], key[1:]) if isinstance(key, tuple) else (key, ())
+        if isinstance(rows, (int, np.integer)):
+            return self.columns[rows][rest]
+        selected = np.arange(len(self.columns))[rows]
+        if len(selected) == 0:
+            return np.empty((0,) + np.shape(self.columns[0][rest]))
+        return np.stack([self.columns[i][rest] for i in selected])
+
+    def __array__(self, dtype=None, copy=None):
+        y = np.stack(self.columns) if self.columns else np.empty((0, 0))
+        return y if dtype is None else y.astype(dtype)
+
+@dataclass(frozen=True, slots=True)
+class Trajectory:
+    """
+    Data class giving memory-mapped access to a trajectory written by a `TrajectoryWriter`.
+
+    Attributes:
+        path (str): The directory of the trajectory.
+        t (np.ndarray): Times, shape (T,).
+        y (StateColumns): States, shape (len(Index), T), one memory map per state.
+
+    `trajectory["plasma_glucose"]` is the memory map of one state, without a copy; `trajectory.organ("muscle")`
+    (or the `plasma`, ..., `liver` properties) copies the organ's states into a new array. Either way only the
+    files of the states asked for are read.
+    """
+    path: str
+    t   : np.ndarray
+    y   : np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    def __getitem__(self, name) -> np.ndarray:
+        return self.y[Index[getattr(name, "name", name)]]
+
+    def organ(self, organ: str):
+        """
+        Returns the states of `organ` ("plasma", "subq", "vsc", "muscle", "gut" or "liver"), read from their
+        files into a new array.
+        """
+        # simulate imports this module for its sink
+        from .simulate import OrganView
+
+        block = get_organ_slice(organ)
+        return OrganView(names=tuple(index.name for index in tuple(Index)[block]), values=self.y[block])
+
+    @property
+    def plasma(self):
+        return self.organ("plasma")
+
+    @property
+    def subq(self):
+        return self.organ("subq")
+
+    @property
+    def vsc(self):
+        return self.organ("vsc")
+
+    @property
+    def muscle(self):
+        return self.organ("muscle")
+
+    @property
+    def gut(self):
+        return self.organ("gut")
+
+    @property
+    def liver(self):
+        return self.organ("liver")
+
+def open_trajectory(path: str) -> Trajectory:
+    """
+    Opens a trajectory written by a `TrajectoryWriter`, read only, with the rows flushed so far.
+    """
+    with open(os.path.join(path, "columns.json")) as file:
+        columns = json.load(file)
+    if columns["columns"] != [state.name for state in Index]:
+        raise ValueError(f"the trajectory in {path} was written with a different state layout")
+    count = columns["count"]
+    if count == 0:
+        return Trajectory(path=path, t=np.empty(0), y=StateColumns(np.empty(0) for _ in Index))
+    t, *states = (
+        np.memmap(os.path.join(path, name), dtype=columns["dtype"], mode="r", shape=(count,)) for name in _FILES
+    )
+    return Trajectory(path=path, t=t, y=StateColumns(states))